@@ -0,0 +1,129 @@
+#!/usr/bin/python
+"""
+Collection throughput benchmark: runs metric-collection.py against the local mock suite-api
+(mock_suite_api.py) for synthetic inventories of several sizes and reports requests/s, resources/s,
+wall time and peak RSS of the collector process.
+
+    python benchmark/collection_benchmark.py --sizes 100 1000 10000 --latency 0.02
+
+nagini has to be importable by the collector, as for a normal run (pip install ./vcops-python).
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from mock_suite_api import MockSuiteApiServer, SyntheticInventory
+
+BENCHMARK_PATH = os.path.dirname(os.path.realpath(__file__))
+COLLECTOR = os.path.join(os.path.dirname(BENCHMARK_PATH), "metric-collection.py")
+
+def make_certificate(workdir):
+    """Self-signed certificate for the mock server, created with the openssl command line tool"""
+    certfile = os.path.join(workdir, "cert.pem")
+    keyfile = os.path.join(workdir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=localhost", "-keyout", keyfile, "-out", certfile],
+                   check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return certfile, keyfile
+
+def write_config(workdir, server, inventory, opts):
+    config = {
+        "servers": [{
+            "name": server.host,
+            "userid": "admin",
+            "password": base64.b64encode(b"admin").decode("utf-8"),
+            "concurrency": opts.concurrency,
+        }],
+        "collections": [{
+            "serverId": server.host,
+            "adapterKind": inventory.adapter_kind,
+            "resourceKind": inventory.resource_kind,
+            "sampleno": opts.sampleno,
+            "metricKeys": inventory.stat_keys,
+            "propertyKeys": inventory.property_keys,
+            "batchSize": opts.batch_size,
+        }],
+        "outputFormat": opts.output_format,
+    }
+    fullpath = os.path.join(workdir, "config.json")
+    with open(fullpath, "w") as outfile:
+        json.dump(config, outfile, indent=2)
+    return fullpath
+
+def run_collector(config_path, output_dir):
+    """Run metric-collection.py, return (wall time in seconds, peak RSS in bytes, exit status)"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, COLLECTOR, "--config", config_path, "--output-dir", output_dir],
+                               stdout=subprocess.DEVNULL)
+    # wait4 instead of wait, for the resource usage of exactly this child
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    return elapsed, peak_rss, process.returncode
+
+def run_benchmark(size, certfile, keyfile, opts):
+    inventory = SyntheticInventory(size)
+    server = MockSuiteApiServer(("127.0.0.1", 0), inventory, certfile, keyfile, opts.latency, opts.max_in_flight)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            config_path = write_config(workdir, server, inventory, opts)
+            elapsed, peak_rss, returncode = run_collector(config_path, workdir)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    return {
+        "resources": size,
+        "requests": server.request_count,
+        "throttled": server.throttled_count,
+        "wall_time": elapsed,
+        "requests_per_second": server.request_count / elapsed,
+        "resources_per_second": size / elapsed,
+        "peak_rss": peak_rss,
+        "returncode": returncode,
+    }
+
+def print_result(result):
+    print(f"{result['resources']:>10} {result['requests']:>9} {result['throttled']:>9} "
+          f"{result['wall_time']:>9.2f} {result['requests_per_second']:>9.1f} "
+          f"{result['resources_per_second']:>9.1f} {result['peak_rss'] / 1024 / 1024:>9.1f}"
+          + ("" if result["returncode"] == 0 else f"  (exit status {result['returncode']})"), flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark metric-collection.py against the local mock suite-api")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000], help="inventory sizes to run")
+    parser.add_argument("--latency", type=float, default=0.02, help="mock server latency per request in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="mock server answers 429 above this many concurrent requests, 0 for no limit")
+    parser.add_argument("--concurrency", type=int, default=8, help="servers[].concurrency of the collector")
+    parser.add_argument("--batch-size", type=int, default=100, help="collections[].batchSize of the collector")
+    parser.add_argument("--sampleno", type=int, default=1)
+    parser.add_argument("--output-format", default="json", choices=["json", "ndjson", "columnar"])
+    parser.add_argument("--certfile", help="certificate for the mock server (default: a generated self-signed one)")
+    parser.add_argument("--keyfile")
+    parser.add_argument("--json", help="also write the results to this file")
+    opts = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as certdir:
+        certfile, keyfile = (opts.certfile, opts.keyfile) if opts.certfile else make_certificate(certdir)
+        print(f"{'resources':>10} {'requests':>9} {'throttled':>9} {'wall(s)':>9} {'req/s':>9} {'res/s':>9} {'RSS(MB)':>9}")
+        results = []
+        for size in opts.sizes:
+            results.append(run_benchmark(size, certfile, keyfile, opts))
+            print_result(results[-1])
+
+    if opts.json:
+        with open(opts.json, "w") as outfile:
+            json.dump(results, outfile, indent=2)
+
+if __name__ == "__main__":
+    main()
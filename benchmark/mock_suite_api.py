@@ -0,0 +1,265 @@
+#!/usr/bin/python
+"""
+Local stand-in for the Aria Operations suite-api, to run metric-collection.py without an appliance.
+
+Serves token acquisition, paged get_resources, per-resource latest stats and properties, and the bulk
+stats/latest, stats and properties/latest queries for a synthetic inventory of configurable size.
+Any user/password is accepted.
+
+    python mock_suite_api.py --resources 1000 --latency 0.02 --certfile cert.pem --keyfile key.pem
+"""
+
+import argparse
+import json
+import re
+import ssl
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+SAMPLE_INTERVAL_MS = 5 * 60 * 1000
+TOKEN_VALIDITY_MS = 6 * 60 * 60 * 1000
+
+
+class SyntheticInventory:
+    """
+    Deterministic inventory of resources with synthetic stats and properties
+    """
+    def __init__(self, size, resource_kind="VirtualMachine", adapter_kind="VMWARE",
+                 stat_keys=None, property_keys=None):
+        self.resource_kind = resource_kind
+        self.adapter_kind = adapter_kind
+        self.stat_keys = stat_keys or ["cpu|usage_average", "mem|usage_average", "disk|usage_average"]
+        self.property_keys = property_keys or ["config|name", "summary|guest|fullName", "config|hardware|numCpu"]
+        self.resources = [self._make_resource(i) for i in range(size)]
+        self.by_id = {resource["identifier"]: i for i, resource in enumerate(self.resources)}
+        self.now = int(time.time() * 1000) // SAMPLE_INTERVAL_MS * SAMPLE_INTERVAL_MS
+
+    def _make_resource(self, index):
+        return {
+            "identifier": "00000000-0000-0000-0000-%012d" % index,
+            "resourceKey": {
+                "name": "%s-%05d" % (self.resource_kind, index),
+                "adapterKindKey": self.adapter_kind,
+                "resourceKindKey": self.resource_kind,
+            },
+        }
+
+    def value(self, index, stat_key, timestamp):
+        return float((index * 31 + len(stat_key) * 7 + timestamp // SAMPLE_INTERVAL_MS) % 100)
+
+    def stat_list(self, resource_id, stat_keys, max_samples=1, begin=None, end=None, latest_max_samples=None):
+        index = self.by_id[resource_id]
+        if begin is not None:
+            first = max(int(begin), self.now - 288 * SAMPLE_INTERVAL_MS)
+            first = -(-first // SAMPLE_INTERVAL_MS) * SAMPLE_INTERVAL_MS
+            last = min(int(end), self.now) if end is not None else self.now
+            timestamps = list(range(first, last + 1, SAMPLE_INTERVAL_MS))
+            if latest_max_samples:
+                timestamps = timestamps[-int(latest_max_samples):]
+        else:
+            timestamps = [self.now - i * SAMPLE_INTERVAL_MS for i in range(max(int(max_samples), 1))][::-1]
+        stats = []
+        for key in stat_keys or self.stat_keys:
+            if key not in self.stat_keys or not timestamps:
+                continue
+            stats.append({
+                "statKey": {"key": key},
+                "timestamps": timestamps,
+                "data": [self.value(index, key, ts) for ts in timestamps],
+            })
+        return {"stat": stats}
+
+    def properties(self, resource_id, property_keys=None):
+        index = self.by_id[resource_id]
+        values = {
+            "config|name": self.resources[index]["resourceKey"]["name"],
+            "summary|guest|fullName": "Synthetic Linux (64-bit)",
+            "config|hardware|numCpu": str(2 + index % 8),
+        }
+        # padding properties that a report never asks for, to make unfiltered payloads realistic
+        for i in range(40):
+            values["summary|synthetic|padding_%02d" % i] = "x" * 64
+        if property_keys:
+            values = {k: v for k, v in values.items() if k in property_keys}
+        return values
+
+
+class MockSuiteApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else {}
+
+    def _dispatch(self, method):
+        server = self.server
+        if not server.enter_request():
+            # drain the body, the connection is kept alive
+            self._read_body()
+            return self._send(429, {"message": "Too many requests"}, {"Retry-After": "1"})
+        try:
+            if server.latency:
+                time.sleep(server.latency)
+            return self._handle(method)
+        finally:
+            server.leave_request()
+
+    def _handle(self, method):
+        server = self.server
+
+        url = urlparse(self.path)
+        path = url.path
+        query = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(url.query).items()}
+        body = self._read_body() if method == "POST" else {}
+
+        if path == "/suite-api/api/auth/token/acquire" and method == "POST":
+            return self._send(200, {"token": "mock-token",
+                                    "validity": int(time.time() * 1000) + TOKEN_VALIDITY_MS,
+                                    "roles": []})
+
+        if not (self.headers.get("Authorization") or "").endswith("mock-token"):
+            return self._send(401, {"message": "Authentication required"})
+
+        inventory = server.inventory
+        if path == "/suite-api/api/resources" and method == "GET":
+            page = int(query.get("page", 0))
+            page_size = int(query.get("pageSize", 1000))
+            resources = inventory.resources[page * page_size:(page + 1) * page_size]
+            return self._send(200, {
+                "pageInfo": {"totalCount": len(inventory.resources), "page": page, "pageSize": page_size},
+                "resourceList": resources,
+            })
+
+        match = re.match(r"^/suite-api/api/resources/([^/]+)/(stats/latest|properties)$", path)
+        if match and method == "GET":
+            resource_id = match.group(1)
+            if resource_id not in inventory.by_id:
+                return self._send(404, {"message": "No such resource"})
+            if match.group(2) == "properties":
+                properties = inventory.properties(resource_id)
+                return self._send(200, {"resourceId": resource_id,
+                                        "property": [{"name": k, "value": v} for k, v in properties.items()]})
+            stat_keys = query.get("statKey")
+            if isinstance(stat_keys, str):
+                stat_keys = [stat_keys]
+            return self._send(200, {"values": [{
+                "resourceId": resource_id,
+                "stat-list": inventory.stat_list(resource_id, stat_keys, query.get("maxSamples", 1)),
+            }]})
+
+        if path in ("/suite-api/api/resources/stats/latest/query", "/suite-api/api/resources/stats/query") \
+                and method == "POST":
+            values = []
+            for resource_id in body.get("resourceId", []):
+                if resource_id not in inventory.by_id:
+                    continue
+                if path.endswith("/latest/query"):
+                    stat_list = inventory.stat_list(resource_id, body.get("statKey"), body.get("maxSamples", 1))
+                else:
+                    stat_list = inventory.stat_list(resource_id, body.get("statKey"),
+                                                    begin=body.get("begin", 0), end=body.get("end"),
+                                                    latest_max_samples=body.get("latestMaxSamples"))
+                values.append({"resourceId": resource_id, "stat-list": stat_list})
+            return self._send(200, {"values": values})
+
+        if path == "/suite-api/api/resources/properties/latest/query" and method == "POST":
+            values = []
+            for resource_id in body.get("resourceIds", []):
+                if resource_id not in inventory.by_id:
+                    continue
+                properties = inventory.properties(resource_id, body.get("propertyKeys"))
+                values.append({"resourceId": resource_id, "property-contents": {"property-content": [
+                    {"statKey": k, "timestamps": [inventory.now], "values": [v]} for k, v in properties.items()
+                ]}})
+            return self._send(200, {"values": values})
+
+        return self._send(404, {"message": "Not supported by the mock server: %s %s" % (method, path)})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+
+class MockSuiteApiServer(ThreadingHTTPServer):
+    """
+    Local stand-in for the Aria Operations suite-api, serving a synthetic inventory over https
+    """
+    daemon_threads = True
+    # many clients connect at once, the socketserver default of 5 drops connections
+    request_queue_size = 1024
+
+    def __init__(self, address, inventory, certfile, keyfile, latency=0.0, max_in_flight=0):
+        super().__init__(address, MockSuiteApiHandler)
+        self.inventory = inventory
+        self.latency = latency
+        self.max_in_flight = max_in_flight
+        self.request_count = 0
+        self.throttled_count = 0
+        self.in_flight = 0
+        self._count_lock = threading.Lock()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        # the handshake happens on first read, in the request thread instead of the accepting one
+        self.socket = context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+
+    @property
+    def host(self):
+        """host:port to use as server name in config.json"""
+        return "%s:%d" % self.server_address[:2]
+
+    def enter_request(self):
+        """Counts a request, False if it is over max_in_flight and has to be throttled"""
+        with self._count_lock:
+            self.request_count += 1
+            if self.max_in_flight and self.in_flight >= self.max_in_flight:
+                self.throttled_count += 1
+                return False
+            self.in_flight += 1
+            return True
+
+    def leave_request(self):
+        with self._count_lock:
+            self.in_flight -= 1
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the Aria Operations suite-api")
+    parser.add_argument("--port", type=int, default=8443)
+    parser.add_argument("--resources", type=int, default=1000, help="size of the synthetic inventory")
+    parser.add_argument("--latency", type=float, default=0.0, help="added latency per request in seconds")
+    parser.add_argument("--max-in-flight", type=int, default=0,
+                        help="answer 429 with Retry-After above this many concurrent requests, 0 for no limit")
+    parser.add_argument("--certfile", required=True)
+    parser.add_argument("--keyfile", required=True)
+    opts = parser.parse_args()
+
+    server = MockSuiteApiServer(("127.0.0.1", opts.port), SyntheticInventory(opts.resources),
+                                opts.certfile, opts.keyfile, opts.latency, opts.max_in_flight)
+    print(f"Serving {opts.resources} resources on https://{server.host}/suite-api")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
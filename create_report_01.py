@@ -6,59 +6,124 @@ from reportlab.platypus import BaseDocTemplate,Flowable, Frame, PageTemplate, Ta
 from reportlab.lib.styles import getSampleStyleSheet
 from reportlab.pdfbase.ttfonts import TTFont
 from reportlab.pdfbase import pdfmetrics
+from metric_data import find_metric_data, load_metric_data
+from metric_history import find_history
+from metric_index import IndexSnapshot, ResourceTable, compile_filters
+from pipeline_profile import PipelineProfiler
+import argparse
 
 
 
-# JSON 파일 읽기
 def get_script_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
 path = get_script_path()
-json_path = path+"/"+"metric-data.json"
 cover_image_path = path+"/reportlab/"+"banner.png"
-#json_path = '/mnt/data/metric-data.json'  # 업로드된 JSON 파일 경로
-with open(json_path, 'r') as file:
-    json_data = json.load(file)
 
 class VSphereMetricsHandler:
+    # 리소스 타입 -> collection의 resourceKind
     RESOURCE_TYPES = {
-        'VSPHERE_WORLD': 0,
-        'VCENTER': 1,
-        'VIRTUAL_MACHINE': 5,
-        'HOST_SYSTEM': 3,
-        'CLUSTER': 2,
-        'DATASTORE': 4
+        'VSPHERE_WORLD': 'vSphere World',
+        'VCENTER': 'VMwareAdapter Instance',
+        'VIRTUAL_MACHINE': 'VirtualMachine',
+        'HOST_SYSTEM': 'HostSystem',
+        'CLUSTER': 'ClusterComputeResource',
+        'DATASTORE': 'Datastore'
     }
+    # resourceKind가 없는 collection은 예전 metric-data.json의 순서로 구분
+    LEGACY_ORDER = ['vSphere World', 'VMwareAdapter Instance', 'ClusterComputeResource', 'HostSystem', 'Datastore',
+                    'VirtualMachine']
 
-    def __init__(self, json_data):
+    def __init__(self, json_data, history=None, snapshot=None):
         self.data = json_data
+        self.history = history
+        # IndexSnapshot of a previous run on the same file, its tables are used instead of building them again
+        self.snapshot = snapshot
         self._validate_data()
+        self.collections = self._group_collections()
         self.available_metrics = self._get_available_metrics()
         self.available_properties = self._get_available_properties()
+        # 리소스 타입별 컬럼 인덱스, 처음 조회할 때 구성 (lazy 로딩이면 그때 해당 collection을 파싱)
+        self.tables = {}
 
     def _validate_data(self):
         """데이터 구조 검증"""
         if not isinstance(self.data, list):
             raise ValueError("Invalid data format: Expected a list")
-        
+
+    def _group_collections(self):
+        """resourceKind별 collection 목록 (여러 서버의 같은 종류 collection을 하나로 묶음)"""
+        collections = {}
+        for index, collection in enumerate(self.data):
+            kind = collection.get('resourceKind')
+            if kind is None and index < len(self.LEGACY_ORDER):
+                kind = self.LEGACY_ORDER[index]
+            collections.setdefault(kind, []).append(collection)
+        return collections
+
+    def _get_available_keys(self, field):
+        keys = {}
+        for resource_type, kind in self.RESOURCE_TYPES.items():
+            if kind in self.collections:
+                # 서버마다 다를 수 있으므로 순서를 유지한 합집합
+                keys[resource_type] = list(dict.fromkeys(
+                    key for collection in self.collections[kind] for key in collection.get(field, [])))
+        return keys
+
     def _get_available_metrics(self):
         """각 리소스 타입별 사용 가능한 메트릭 키 수집"""
-        metrics = {}
-        for resource_type, index in self.RESOURCE_TYPES.items():
-            if index < len(self.data):
-                metrics[resource_type] = self.data[index].get('metricKeys', [])
-        return metrics
+        return self._get_available_keys('metricKeys')
 
     def _get_available_properties(self):
         """각 리소스 타입별 사용 가능한 프로퍼티 키 수집"""
-        properties = {}
-        for resource_type, index in self.RESOURCE_TYPES.items():
-            if index < len(self.data):
-                properties[resource_type] = self.data[index].get('propertyKeys', [])
-        return properties
+        return self._get_available_keys('propertyKeys')
 
     def get_timestamp(self):
-        """타임스탬프 반환"""
-        return self.data[self.RESOURCE_TYPES['VCENTER']]['timestamp']
+        """타임스탬프 반환 (서버가 여러 개면 가장 최근 수집 시각)"""
+        collections = self.collections.get(self.RESOURCE_TYPES['VCENTER']) or self.data
+        timestamps = [collection['timestamp'] for collection in collections if collection.get('timestamp')]
+        return max(timestamps) if timestamps else None
+
+    def list_servers(self):
+        """데이터에 포함된 서버 목록 (수집 순서)"""
+        return list(dict.fromkeys(collection['server'] for collection in self.data if collection.get('server')))
+
+    def _get_table(self, resource_type):
+        """리소스 타입의 컬럼 인덱스 (처음 조회할 때 한 번만 구성, 여러 서버의 리소스를 합침)"""
+        if resource_type not in self.RESOURCE_TYPES:
+            raise ValueError(f"Invalid resource type: {resource_type}")
+        table = self.tables.get(resource_type)
+        if table is None:
+            kind = self.RESOURCE_TYPES[resource_type]
+            collections = self.collections.get(kind)
+            if collections is None:
+                return None
+            table = self.snapshot.load(kind) if self.snapshot is not None else None
+            if table is None:
+                table = ResourceTable.from_collections(collections)
+                if self.snapshot is not None:
+                    self.snapshot.store(kind, table)
+            self.tables[resource_type] = table
+        return table
+
+    def _filter_rows(self, table, filters):
+        """필터 조건을 만족하는 행 번호 목록, 필터가 없으면 None (전체)"""
+        if not filters:
+            return None
+        return table.select(compile_filters(filters))
+
+    def _get_values(self, resource_type, section, key, filters):
+        table = self._get_table(resource_type)
+        if table is None:
+            return {}
+        rows = self._filter_rows(table, filters)
+        if key:
+            return table.values(section, key, rows)
+        # 키가 없으면 조건을 만족하는 마지막 리소스의 값 전체 (기존 동작)
+        if rows is None:
+            rows = range(len(table))
+        if not rows:
+            return []
+        return table.item(rows[-1]).get(section, {})
 
     def get_metrics(self, resource_type, metric_key=None, filters=None):
         """특정 리소스 타입의 메트릭 데이터 반환
@@ -66,36 +131,13 @@ class VSphereMetricsHandler:
         Args:
             resource_type (str): RESOURCE_TYPES에 정의된 리소스 타입
             metric_key (str, optional): 특정 메트릭 키. None이면 모든 메트릭 반환
-            filters (dict, optional): 필터링 조건 (예: {'name': 'vm-01', 'cpu|usage_average': '>50'})
+            filters (dict, optional): 필터링 조건 (예: {'name': 'vm-01', 'cpu|usage_average': '>50'}, 범위는 '50..80')
+                또는 metric_index의 Predicate (예: Compare('cpu|usage_average', '>', 80) | Name('vm-01'))
         
         Returns:
             dict: 필터링된 메트릭 데이터
         """
-        if resource_type not in self.RESOURCE_TYPES:
-            raise ValueError(f"Invalid resource type: {resource_type}")
-        
-        resource_index = self.RESOURCE_TYPES[resource_type]
-        if resource_index >= len(self.data):
-            return {}
-
-        resource_data = self.data[resource_index]
-        result = []
-
-        for item in resource_data.get('allstats', []):
-            # 필터 조건 검사
-            if filters and not self._check_filters(item, filters):
-                continue
-
-            stats = item.get('stats', {})
-            if metric_key:
-                # 특정 메트릭 키만 반환
-                if metric_key in stats:
-                    result.append(stats[metric_key]) 
-            else:
-                # 모든 메트릭 반환
-                result = stats
-
-        return result
+        return self._get_values(resource_type, 'stats', metric_key, filters)
 
     def get_properties(self, resource_type, property_key=None, filters=None):
         """특정 리소스 타입의 프로퍼티 데이터 반환
@@ -108,79 +150,64 @@ class VSphereMetricsHandler:
         Returns:
             dict: 필터링된 프로퍼티 데이터
         """
-        if resource_type not in self.RESOURCE_TYPES:
-            raise ValueError(f"Invalid resource type: {resource_type}")
-        
-        resource_index = self.RESOURCE_TYPES[resource_type]
-        if resource_index >= len(self.data):
-            return {}
-
-        resource_data = self.data[resource_index]
-        result = []
+        return self._get_values(resource_type, 'properties', property_key, filters)
 
-        for item in resource_data.get('allstats', []):
-            # 필터 조건 검사
-            if filters and not self._check_filters(item, filters):
-                continue
+    def get_total(self, resource_type, metric_key, filters=None):
+        """메트릭 값의 합계 (예: 여러 vCenter의 vSphere World 집계 값 합산)"""
+        return sum(value for value in self.get_metrics(resource_type, metric_key, filters)
+                   if isinstance(value, (int, float)))
 
-            properties = item.get('properties', {})
-            if property_key:
-                # 특정 프로퍼티 키만 반환
-                if property_key in properties:
-                    result.append(properties[property_key]) 
-            else:
-                # 모든 프로퍼티 반환
-                result = properties
+    def get_resource(self, resource_type, identifier):
+        """리소스 ID로 allstats 항목 조회, 없으면 None"""
+        table = self._get_table(resource_type)
+        row = table.find_row(identifier) if table is not None else None
+        return table.item(row) if row is not None else None
 
-        return result
+    def _get_resource_kind(self, resource_type):
+        if resource_type not in self.RESOURCE_TYPES:
+            raise ValueError(f"Invalid resource type: {resource_type}")
+        return self.RESOURCE_TYPES[resource_type]
 
-    def _check_filters(self, item, filters):
-        """필터 조건 검사
+    def get_history(self, resource_type, metric_key, begin=None, end=None, name=None):
+        """히스토리 DB에서 특정 리소스 타입의 메트릭 이력 조회
         
         Args:
-            item (dict): 검사할 아이템
-            filters (dict): 필터 조건
+            resource_type (str): RESOURCE_TYPES에 정의된 리소스 타입
+            metric_key (str): 메트릭 키
+            begin (int, optional): 시작 시각 (epoch ms)
+            end (int, optional): 종료 시각 (epoch ms)
+            name (str, optional): 리소스 이름. None이면 모든 리소스
         
         Returns:
-            bool: 필터 조건 만족 여부
+            dict: {리소스 ID: [(timestamp, value), ...]}, 히스토리가 없으면 빈 dict.
+                리소스 이름은 get_history_resources로 조회
         """
-        for key, value in filters.items():
-            # 이름으로 필터링
-            if key == 'name' and item.get('name') != value:
-                return False
-            
-            # 메트릭 값으로 필터링
-            if key in item.get('stats', {}):
-                stat_value = item['stats'][key]
-                if isinstance(value, str):
-                    # 비교 연산자 처리 (예: '>50', '<=30' 등)
-                    operator = ''.join(c for c in value if not c.isdigit() and c != '.')
-                    threshold = float(''.join(c for c in value if c.isdigit() or c == '.'))
-                    
-                    if operator == '>':
-                        if not stat_value > threshold:
-                            return False
-                    elif operator == '>=':
-                        if not stat_value >= threshold:
-                            return False
-                    elif operator == '<':
-                        if not stat_value < threshold:
-                            return False
-                    elif operator == '<=':
-                        if not stat_value <= threshold:
-                            return False
-                    elif operator == '==':
-                        if not stat_value == threshold:
-                            return False
-                else:
-                    if stat_value != value:
-                        return False
-            
-            # 프로퍼티 값으로 필터링
-            if key in item.get('properties', {}) and item['properties'][key] != value:
-                return False
-                
-        return True
+        resource_kind = self._get_resource_kind(resource_type)
+        if self.history is None or resource_kind is None:
+            return {}
+        return self.history.get_range(resource_kind, metric_key, begin, end, name)
+
+    def get_latest_history(self, resource_type, metric_key):
+        """히스토리 DB에서 리소스별 최신 메트릭 값 조회
+        
+        Returns:
+            dict: {리소스 ID: (timestamp, value)}, 히스토리가 없으면 빈 dict
+        """
+        resource_kind = self._get_resource_kind(resource_type)
+        if self.history is None or resource_kind is None:
+            return {}
+        return self.history.get_latest(resource_kind, metric_key)
+
+    def get_history_resources(self, resource_type):
+        """히스토리 DB의 리소스 조회
+        
+        Returns:
+            dict: {리소스 ID: (서버 이름, 리소스 이름)}, 히스토리가 없으면 빈 dict
+        """
+        resource_kind = self._get_resource_kind(resource_type)
+        if self.history is None or resource_kind is None:
+            return {}
+        return self.history.get_resources(resource_kind)
 
     def list_available_metrics(self, resource_type):
         """특정 리소스 타입에서 사용 가능한 메트릭 키 목록 반환"""
@@ -209,6 +236,13 @@ high_cpu_vms = metrics_handler.get_metrics(
     filters={'cpu|usage_average': '>50'}
 )
 
+# CPU 또는 메모리 사용량이 80~100%인 VM 이름 조회
+busy_vms = metrics_handler.get_properties(
+    'VIRTUAL_MACHINE',
+    'config|name',
+    filters=Range('cpu|usage_average', 80, 100) | Range('mem|usage_average', 80, 100)
+)
+
 # 특정 프로퍼티를 가진 호스트 조회
 hosts = metrics_handler.get_properties(
     'HOST_SYSTEM',
@@ -333,12 +367,16 @@ class TableGenerator:
         return table
 
 
-def generate_pdf():
+def generate_pdf(json_data, history=None, profiler=None, snapshot=None):
+    profiler = profiler or PipelineProfiler("create_report_01", enabled=False)
+
     # 핸들러 초기화
-    metrics_handler = VSphereMetricsHandler(json_data)
+    profiler.begin("handler")
+    metrics_handler = VSphereMetricsHandler(json_data, history, snapshot)
 
 
     # 한글 폰트 등록
+    profiler.begin("fonts")
     pdfmetrics.registerFont(TTFont('Freesentation', path+'/reportlab/Freesentation-5Medium.ttf'))  # 시스템에 설치된 폰트 경로
     pdfmetrics.registerFont(TTFont('Freesentation-Bold', path+'/reportlab/Freesentation-7Bold.ttf'))
 
@@ -353,6 +391,7 @@ def generate_pdf():
 
 
     # PDF 설정
+    profiler.begin("tables")
     pdf_path = "metric_report.pdf"
     doc = BaseDocTemplate(pdf_path, pagesize=letter, topMargin=0, bottomMargin=50)
     page_width, page_height = letter
@@ -399,7 +438,7 @@ def generate_pdf():
     # "기본 정보" 추가
     title_pages = [
         f"고객사 : ",
-        f"보고서 생성 시간 : {json_data[1]['timestamp']}",
+        f"보고서 생성 시간 : {metrics_handler.get_timestamp()}",
         f"유지보수 계약 구분 : ",
         f"지원 엔지니어 : "
         ]
@@ -461,11 +500,11 @@ def generate_pdf():
     
     product_count_data = [
     ["항목", "수량"],
-    ["vCenter", f"{metrics_handler.get_metrics(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_vcenters')[0]:.0f} (EA)"],
-    ["Datacenter", f"{metrics_handler.get_metrics(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_datacenters')[0]:.0f} (EA)"],
-    ["Cluster", f"{metrics_handler.get_metrics(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_clusters')[0]:.0f} (EA)"],
-    ["Host(ESXi)", f"{metrics_handler.get_metrics(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_hosts')[0]:.0f} (EA)"],
-    ["Virtual Machine", f"{metrics_handler.get_metrics(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_vms')[0]:.0f} (EA)"]
+    ["vCenter", f"{metrics_handler.get_total(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_vcenters'):.0f} (EA)"],
+    ["Datacenter", f"{metrics_handler.get_total(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_datacenters'):.0f} (EA)"],
+    ["Cluster", f"{metrics_handler.get_total(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_clusters'):.0f} (EA)"],
+    ["Host(ESXi)", f"{metrics_handler.get_total(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_hosts'):.0f} (EA)"],
+    ["Virtual Machine", f"{metrics_handler.get_total(resource_type='VSPHERE_WORLD',metric_key='summary|total_number_vms'):.0f} (EA)"]
     ]
     product_count_style = {
         'col_widths': {
@@ -519,10 +558,10 @@ def generate_pdf():
     elements.append(Paragraph("심각도 수준(Severity Level) 별 이벤트 발생 수",styles['Heading2']))
     list_data = [
         ["위험(Critical Level)","즉시(High Level)","경고(Medium Level)","정보(Low Level)"],
-        [f"{metrics_handler.get_metrics(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_critical")[0]:.0f}",
-        f"{metrics_handler.get_metrics(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_immediate")[0]:.0f}",
-        f"{metrics_handler.get_metrics(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_warning")[0]:.0f}",
-        f"{metrics_handler.get_metrics(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_info")[0]:.0f}"
+        [f"{metrics_handler.get_total(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_critical"):.0f}",
+        f"{metrics_handler.get_total(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_immediate"):.0f}",
+        f"{metrics_handler.get_total(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_warning"):.0f}",
+        f"{metrics_handler.get_total(resource_type="VSPHERE_WORLD",metric_key="System Attributes|alert_count_info"):.0f}"
         ]
     ]
     list_data_table = Table(list_data, colWidths=frame_width/4, rowHeights=[30,40])
@@ -571,14 +610,19 @@ def generate_pdf():
         ['클러스터 이름','DRS 사용', 'DRS 기본 동작', '마이그레이션 임계값','DRS로 수행된 vMotion 수']
     ]
 
+    # 컬럼은 루프 밖에서 한 번씩만 조회
     tt = metrics_handler.get_properties(resource_type='CLUSTER',property_key='config|name')
+    drs_enabled = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|enabled')
+    drs_behavior = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|defaultVmBehavior')
+    drs_vmotion_rate = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|vmotionRate')
+    drs_vmotions = metrics_handler.get_metrics(resource_type='CLUSTER', metric_key='summary|number_drs_vmotion')
     for i in range(len(tt)):
         li = [
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='config|name')[i],
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|enabled')[i],
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|defaultVmBehavior')[i],  
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|drsConfig|vmotionRate')[i],
-            metrics_handler.get_metrics(resource_type='CLUSTER', metric_key='summary|number_drs_vmotion')[i]
+            tt[i],
+            drs_enabled[i],
+            drs_behavior[i],
+            drs_vmotion_rate[i],
+            drs_vmotions[i]
               ]
         cluster_drs_data.append(li)
 
@@ -610,13 +654,17 @@ def generate_pdf():
         ['클러스터 이름','HA 사용','승인제어 사용', 'HA CPU 페일로버 비율', 'HA 메모리 페일오버 비율']
     ]
 
+    ha_enabled = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|enabled')
+    ha_admission_control = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|admissionControlEnabled')
+    ha_cpu_failover = metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|cpuFailoverPercent')
+    ha_mem_failover = metrics_handler.get_properties(resource_type='CLUSTER', property_key='configuration|dasConfig|memFailoverPercent')
     for i in range(len(tt)):
         li = [
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='config|name')[i],
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|enabled')[i],
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|admissionControlEnabled')[i],  
-            metrics_handler.get_properties(resource_type='CLUSTER',property_key='configuration|dasConfig|cpuFailoverPercent')[i],
-            metrics_handler.get_properties(resource_type='CLUSTER', property_key='configuration|dasConfig|memFailoverPercent')[i]
+            tt[i],
+            ha_enabled[i],
+            ha_admission_control[i],
+            ha_cpu_failover[i],
+            ha_mem_failover[i]
             ]
         cluster_ha_data.append(li)
 
@@ -663,7 +711,39 @@ def generate_pdf():
     elements.append(Paragraph("데이터스토어 사용율 상태 확인",styles['Title']))
     elements.append(PageBreak())
     # PDF 작성
+    profiler.begin("build")
     doc.build(elements)
+    profiler.end()
     print(f"PDF 생성 완료: {pdf_path}")
 
-generate_pdf()
\ No newline at end of file
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create the PDF report from the collected metric data")
+    parser.add_argument("--profile", action="store_true",
+                        help="record time, memory and hot functions per stage to profile-create_report_01.json")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="ignore the index snapshot (<metric data file>.idx) of previous runs and write it again")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    profiler = PipelineProfiler("create_report_01", enabled=args.profile)
+
+    # JSON 파일 읽기 (metric-data.json, metric-data.ndjson, metric-data.col 중 최근 수집된 파일)
+    profiler.begin("load data")
+    json_path = find_metric_data(path)
+    #json_path = '/mnt/data/metric-data.json'  # 업로드된 JSON 파일 경로
+    # collection 위치만 색인하고, 보고서에서 조회하는 리소스 종류만 그때 파싱
+    json_data = load_metric_data(json_path, lazy=True)
+    # config.json에 "history"가 설정된 경우 이전 수집 이력 (없으면 None)
+    history = find_history(path)
+    # 같은 데이터 파일로 다시 실행하면 이전 실행에서 만든 인덱스를 사용 (metric-data.col은 memory map이라 제외)
+    snapshot = None if json_path.endswith(".col") else IndexSnapshot(json_path, rebuild=args.rebuild_index)
+
+    generate_pdf(json_data, history, profiler, snapshot)
+    if snapshot is not None:
+        profiler.begin("save index snapshot")
+        snapshot.save()
+    profiler.write(path)
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,39 @@
 
 import nagini
 import requests
+import argparse
 import json
 import os, sys
 import base64
+import hashlib
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from threading import Lock
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from metric_data import WriterGroup, get_output_path, load_metric_data, open_writer
+from metric_history import MetricHistoryStore, get_history_path
+from pipeline_profile import PipelineProfiler
+
+# requests in flight against one server (servers[].concurrency), set-config.py offers the same default
+DEFAULT_CONCURRENCY = 8
+# ceiling up to which the rate limiter may raise it while the server keeps up (servers[].maxConcurrency)
+DEFAULT_MAX_CONCURRENCY = 32
+# number of resource ids sent in one bulk stats/properties query
+DEFAULT_BATCH_SIZE = 100
+# number of resources requested per get_resources page
+DEFAULT_PAGE_SIZE = 1000
+# collection interval of the stats (collections[].sampleInterval, seconds), 5 minutes by default in Aria Operations
+DEFAULT_SAMPLE_INTERVAL = 300
+# cached tokens are not reused when they expire within this many milliseconds
+TOKEN_EXPIRY_MARGIN = 5 * 60 * 1000
+
+# one client per server, shared by every collection so that its token and keep-alive pool are reused
+_connections = {}
+_connections_lock = Lock()
+# optional on-disk cache of read-only responses (config.json "responseCache"), shared by the clients
+_response_cache = None
 
 def get_script_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
@@ -32,117 +59,574 @@ def get_resource_properties(vrops, resource_id, property_keys):
     properties = {}
     try:
         resource_data = vrops.get_resource_properties(resourceId=resource_id, id=resource_id)
-    # After test remove #    
         if 'property' in resource_data:
             for prop in resource_data['property']:
-    #            if prop['name'] in property_keys:
+                if not property_keys or prop['name'] in property_keys:
                     properties[prop['name']] = prop['value']
     except Exception as e:
         print(f"Error getting properties for resource {resource_id}: {str(e)}")
     
     return properties
 
-def get_metric_stats(vrops, resource_id, metric_keys, sampleno):
+def format_property_value(value):
+    # numeric properties come back as numbers from the bulk query, but as strings from get_resource_properties
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def get_resource_properties_bulk(vrops, resource_ids, property_keys):
+    """Latest values of the configured properties of many resources, returned as {resource id: properties}"""
+    query = {
+        "resourceIds": resource_ids,
+        "propertyKeys": property_keys,
+        "instanced": False
+    }
+    
+    allproperties = {}
+    response = vrops.query_latest_properties_of_resources(query)
+    for value in response.get("values", []):
+        properties = {}
+        for content in value.get("property-contents", {}).get("property-content", []):
+            # string properties are returned in "values", numeric ones in "data"
+            samples = content.get("values") or content.get("data")
+            if samples:
+                properties[content["statKey"]] = format_property_value(samples[-1])
+        allproperties[value["resourceId"]] = properties
+    
+    return allproperties
+
+def parse_stat_list(stat_list, sampleno):
+    stats = {}
+    if int(sampleno) == 1:
+        for value in stat_list["stat"]:
+            stats[value["statKey"]["key"]] = value["data"][0]
+    else:
+        for singlevalue in stat_list["stat"]:
+            all_metric_data = []
+            sample = len(singlevalue["data"])
+            for i in range(sample):
+                metric_data = {
+                    "value": singlevalue["data"][i],
+                    "timestamp": singlevalue["timestamps"][i]
+                }
+                all_metric_data.append(metric_data)
+            stats[singlevalue["statKey"]["key"]] = all_metric_data
+    return stats
+
+def parse_stat_timestamps(stat_list):
+    return {stat["statKey"]["key"]: stat["timestamps"][-1] for stat in stat_list["stat"] if stat.get("timestamps")}
+
+class CollectionCheckpoint:
+    """
+    Last sample timestamp per resource and stat key of an incremental collection.
+    Resources with a checkpoint for every metric key and stored stats from the previous run
+    only fetch newer samples, everything else is collected in full.
+    Fetching newer samples only pays off while there are fewer of them than sampleno: a resource whose oldest
+    checkpoint is more than sampleno sample intervals old (e.g. a powered-off VM), and any resource of a single-sample
+    collection, is collected in full by the latest stats query, which returns no more than sampleno samples anyway.
+    """
+    def __init__(self, sampleno, metric_keys, previous=None, stored=None, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+        self.sampleno = int(sampleno)
+        self.metric_keys = metric_keys
+        self.previous = previous or {}
+        self.stored = stored or {}
+        self.current = {}
+        # checkpoints older than this are not worth an incremental query
+        self.window_start = int(time.time() * 1000) - self.sampleno * int(sample_interval) * 1000
+        self._lock = Lock()
+
+    def is_incremental(self, resource_id):
+        if self.sampleno <= 1 or resource_id not in self.stored:
+            return False
+        last = self.previous.get(resource_id) or {}
+        # without any timestamp (nothing collected last time) there is nothing to continue from
+        if not last or not all(key in last for key in self.metric_keys):
+            return False
+        return min(last.values()) >= self.window_start
+
+    def update(self, resource_id, timestamps):
+        merged = dict(self.previous.get(resource_id, {}))
+        for key, timestamp in timestamps.items():
+            merged[key] = max(timestamp, merged.get(key, timestamp))
+        with self._lock:
+            self.current[resource_id] = merged
+
+    def to_dict(self):
+        return {"sampleno": self.sampleno, "resources": self.current}
+
+def get_metric_stats(vrops, resource_id, metric_keys, sampleno, checkpoint=None, timestamps=None):
     stats = {}
     try:
-        for key in metric_keys:
-            # After test add statKey=[key]
-            allvalues = vrops.get_latest_stats(resourceId=resource_id,maxSamples=sampleno, id=resource_id) 
-            
-            if allvalues["values"]:
-                if int(sampleno) == 1:
-                    for value in allvalues["values"][0]["stat-list"]["stat"]:
-                        stats[value["statKey"]["key"]] = value["data"][0]
-                else:
-                    for singlevalue in allvalues["values"][0]["stat-list"]["stat"]:
-                        all_metric_data = []
-                        sample = len(singlevalue["data"])
-                        for i in range(sample):
-                            metric_data = {
-                                "value": singlevalue["data"][i],
-                                "timestamp": singlevalue["timestamps"][i]
-                            }
-                            all_metric_data.append(metric_data)
-                        stats[singlevalue["statKey"]["key"]] = all_metric_data
+        if metric_keys:
+            allvalues = vrops.get_latest_stats(resourceId=resource_id, maxSamples=sampleno, statKey=metric_keys, id=resource_id)
+        else:
+            allvalues = vrops.get_latest_stats(resourceId=resource_id, maxSamples=sampleno, id=resource_id)
+        
+        if allvalues["values"]:
+            stats = parse_stat_list(allvalues["values"][0]["stat-list"], sampleno)
+            if timestamps is not None:
+                timestamps[resource_id] = parse_stat_timestamps(allvalues["values"][0]["stat-list"])
+            if checkpoint is not None:
+                checkpoint.update(resource_id, parse_stat_timestamps(allvalues["values"][0]["stat-list"]))
     except Exception as e:
         print(f"Error getting metrics for resource {resource_id}: {str(e)}")
     
     return stats
 
-def get_resource_data(vrops, resource, metric_keys, property_keys, sampleno):
+def get_metric_stats_since(vrops, resource_ids, metric_keys, checkpoint):
+    """Samples newer than the checkpoint of many resources, returned as {resource id: {stat key: [(timestamp, value)]}}"""
+    begin = min(timestamp for resource_id in resource_ids for timestamp in checkpoint.previous[resource_id].values())
+    query = {
+        "resourceId": resource_ids,
+        "begin": begin + 1,
+        "end": int(time.time() * 1000),
+        "rollUpType": "NONE",
+        # only the newest samples are kept, whatever the window of the chunk
+        "latestMaxSamples": checkpoint.sampleno
+    }
+    if metric_keys:
+        query["statKey"] = metric_keys
+    
+    newsamples = {}
+    allvalues = vrops.get_stats_for_resources(query)
+    for value in allvalues.get("values", []):
+        last = checkpoint.previous.get(value["resourceId"], {})
+        samples = {}
+        for stat in value["stat-list"]["stat"]:
+            key = stat["statKey"]["key"]
+            # the query begins at the oldest checkpoint of the chunk, drop what this resource already has
+            pairs = [(timestamp, data) for timestamp, data in zip(stat["timestamps"], stat["data"])
+                     if timestamp > last.get(key, 0)]
+            if pairs:
+                samples[key] = pairs
+        newsamples[value["resourceId"]] = samples
+    
+    return newsamples
+
+def merge_stats(stored, newsamples, sampleno):
+    stats = dict(stored)
+    for key, pairs in newsamples.items():
+        if int(sampleno) == 1:
+            stats[key] = pairs[-1][1]
+        else:
+            series = list(stats.get(key, [])) + [{"value": data, "timestamp": timestamp} for timestamp, data in pairs]
+            stats[key] = series[-int(sampleno):]
+    return stats
+
+def get_metric_stats_incremental(vrops, resource_ids, metric_keys, sampleno, checkpoint, timestamps=None):
+    """Stored stats of many resources merged with the samples collected since their checkpoint"""
+    allstats = {}
+    newsamples = get_metric_stats_since(vrops, resource_ids, metric_keys, checkpoint)
+    for resource_id in resource_ids:
+        samples = newsamples.get(resource_id, {})
+        allstats[resource_id] = merge_stats(checkpoint.stored[resource_id].get("stats", {}), samples, sampleno)
+        if timestamps is not None:
+            timestamps[resource_id] = {**checkpoint.stored[resource_id].get("statTimestamps", {}),
+                                       **{key: pairs[-1][0] for key, pairs in samples.items()}}
+        checkpoint.update(resource_id, {key: pairs[-1][0] for key, pairs in samples.items()})
+    
+    return allstats
+
+def get_metric_stats_bulk(vrops, resource_ids, metric_keys, sampleno, checkpoint=None, timestamps=None):
+    """
+    Latest stats of many resources in one query, returned as {resource id: stats}.
+    timestamps, if given, is filled with {resource id: {stat key: timestamp of the latest sample}}
+    """
+    query = {
+        "resourceId": resource_ids,
+        "maxSamples": int(sampleno)
+    }
+    if metric_keys:
+        query["statKey"] = metric_keys
+    
+    allstats = {}
+    allvalues = vrops.query_latest_stats_of_resources(query)
+    for value in allvalues.get("values", []):
+        allstats[value["resourceId"]] = parse_stat_list(value["stat-list"], sampleno)
+        if timestamps is not None:
+            timestamps[value["resourceId"]] = parse_stat_timestamps(value["stat-list"])
+        if checkpoint is not None:
+            checkpoint.update(value["resourceId"], parse_stat_timestamps(value["stat-list"]))
+    
+    return allstats
+
+def get_resource_data(vrops, resource, metric_keys, property_keys, sampleno, stats=None, properties=None,
+                      checkpoint=None, stat_timestamps=None):
     resourcedata = {}
     name = resource['identifier']
     
-    stats = get_metric_stats(vrops, name, metric_keys, sampleno)
-    properties = get_resource_properties(vrops, name, property_keys)
+    if stats is None:
+        stats = get_metric_stats(vrops, name, metric_keys, sampleno, checkpoint, stat_timestamps)
+    if properties is None:
+        properties = get_resource_properties(vrops, name, property_keys)
     
     if stats or properties:
         resourcedata["identifier"] = name
         resourcedata["name"] = resource['resourceKey']['name']
         resourcedata["stats"] = stats
         resourcedata["properties"] = properties
+        # single-sample stats are stored without their timestamps, these keep them (e.g. for the history store)
+        if stat_timestamps and stat_timestamps.get(name):
+            resourcedata["statTimestamps"] = stat_timestamps[name]
     
     return resourcedata
 
-def get_vrops_connection(server_config):
-    passwd = base64.b64decode(server_config["password"].encode('utf-8')).decode('utf-8')
-    return nagini.Nagini(
-        host=server_config["name"],
-        user_pass=(server_config["userid"], passwd)
-    )
+def is_query_unsupported(e):
+    """
+    True for a bulk query the server rejected as such (e.g. 400/404/405 from a version without it), whose resources
+    are then asked for one by one. Throttling, authentication, server and connection errors are not: more calls
+    would only add load to a server that is already failing.
+    """
+    return isinstance(e, nagini.ClientSideException) and not isinstance(e, nagini.AuthException) and \
+        e.error_code != 429
 
-def process_configuration(collection, server_config):
-    adapter = collection["adapterKind"]
-    resourceknd = collection["resourceKind"]
-    sampleno = collection["sampleno"]
-    metric_keys = collection.get("metricKeys", [])
-    property_keys = collection.get("propertyKeys", [])
+def get_chunk_data(vrops, resources, metric_keys, property_keys, sampleno, checkpoint=None):
+    resource_ids = [resource['identifier'] for resource in resources]
+    chunk_stats = {}
+    # series carry their own timestamps
+    stat_timestamps = {} if int(sampleno) == 1 else None
     
-    vrops = get_vrops_connection(server_config)
+    incremental_ids = [rid for rid in resource_ids if checkpoint.is_incremental(rid)] if checkpoint else []
+    if incremental_ids:
+        try:
+            chunk_stats.update(get_metric_stats_incremental(vrops, incremental_ids, metric_keys, sampleno, checkpoint,
+                                                            stat_timestamps))
+        except Exception as e:
+            print(f"Error getting new samples for {len(incremental_ids)} resources, collecting them in full: {str(e)}")
     
-    outdata = []
-    resources = vrops.get_resources(resourceKind=resourceknd, adapterKindKey=adapter)['resourceList']
+    full_ids = [rid for rid in resource_ids if rid not in chunk_stats]
+    fallback_ids = set()
+    if full_ids:
+        try:
+            chunk_stats.update(get_metric_stats_bulk(vrops, full_ids, metric_keys, sampleno, checkpoint, stat_timestamps))
+        except Exception as e:
+            if is_query_unsupported(e):
+                print(f"Error getting metrics for {len(full_ids)} resources, querying one by one: {str(e)}")
+                fallback_ids = set(full_ids)
+            else:
+                print(f"Error getting metrics for {len(full_ids)} resources, skipping their stats: {str(e)}")
     
+    # without configured property keys every property is collected, which only the per resource query can do
+    chunk_properties = None
+    if property_keys:
+        try:
+            chunk_properties = get_resource_properties_bulk(vrops, resource_ids, property_keys)
+        except Exception as e:
+            if is_query_unsupported(e):
+                print(f"Error getting properties for {len(resource_ids)} resources, querying one by one: {str(e)}")
+            else:
+                print(f"Error getting properties for {len(resource_ids)} resources, skipping them: {str(e)}")
+                chunk_properties = {}
+    
+    outdata = []
     for resource in resources:
-        resource_data = get_resource_data(vrops, resource, metric_keys, property_keys, sampleno)
+        stats = chunk_stats.get(resource['identifier'], {}) if resource['identifier'] not in fallback_ids else None
+        properties = chunk_properties.get(resource['identifier'], {}) if chunk_properties is not None else None
+        resource_data = get_resource_data(vrops, resource, metric_keys, property_keys, sampleno, stats, properties,
+                                          checkpoint, stat_timestamps)
         if resource_data:
             outdata.append(resource_data)
     
-    outstat = {
-        "allstats": outdata,
-        "timestamp": get_korean_timestamp(),
+    return outdata
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def iter_resource_pages(vrops, resourceknd, adapter, page_size, prefetch=True):
+    """Yield the inventory page by page, requesting the next page while the current one is collected"""
+    def get_page(page):
+        response = vrops.get_resources(resourceKind=resourceknd, adapterKindKey=adapter, page=page, pageSize=page_size)
+        resources = response.get('resourceList', [])
+        total = response.get('pageInfo', {}).get('totalCount')
+        has_more = len(resources) == page_size and (total is None or (page + 1) * page_size < total)
+        return resources, has_more
+    
+    with ThreadPoolExecutor(max_workers=1) as prefetcher:
+        page = 0
+        resources, has_more = get_page(page)
+        while True:
+            if has_more and prefetch:
+                next_page = prefetcher.submit(get_page, page + 1)
+            if resources:
+                yield resources
+            if not has_more:
+                break
+            page += 1
+            resources, has_more = next_page.result() if prefetch else get_page(page)
+
+def get_concurrency(server_config):
+    # number of resources fetched in parallel against one server, 1 keeps the sequential behaviour
+    return max(int(server_config.get("concurrency", DEFAULT_CONCURRENCY)), 1)
+
+def get_max_concurrency(server_config):
+    # the limiter starts at the configured concurrency and probes up to this, never below the start
+    return max(int(server_config.get("maxConcurrency", DEFAULT_MAX_CONCURRENCY)), get_concurrency(server_config))
+
+def get_vrops_connection(server_config, token_cache=None):
+    with _connections_lock:
+        vrops = _connections.get(server_config["name"])
+        if vrops is None:
+            passwd = base64.b64decode(server_config["password"].encode('utf-8')).decode('utf-8')
+            vrops = nagini.Nagini(
+                host=server_config["name"],
+                user_pass=(server_config["userid"], passwd),
+                maxConnections=get_max_concurrency(server_config),
+                # starts at the configured concurrency, raises it while calls succeed and backs off when the server
+                # answers 429/503
+                rateLimiter=nagini.AdaptiveRateLimiter(initial_limit=get_concurrency(server_config),
+                                                       max_limit=get_max_concurrency(server_config)),
+                # written to request-stats.json at the end of the run
+                instrumentation=nagini.RequestStats(recent_calls=int(server_config.get("recentCalls", 0))),
+                responseCache=_response_cache
+            )
+            
+            cached = (token_cache or {}).get(server_config["name"], {})
+            validity = cached.get("validity") or 0
+            if cached.get("userid") == server_config["userid"] and validity > time.time() * 1000 + TOKEN_EXPIRY_MARGIN:
+                vrops.set_acquired_token(cached["token"], validity)
+            
+            _connections[server_config["name"]] = vrops
+        return vrops
+
+def close_vrops_connections(token_cache):
+    """Close the shared clients and return the token cache updated with their tokens"""
+    with _connections_lock:
+        for name, vrops in _connections.items():
+            acquired = vrops.get_acquired_token()
+            if acquired["token"]:
+                token_cache[name] = {
+                    "userid": vrops.user_pass[0],
+                    "token": acquired["token"],
+                    "validity": acquired["validity"]
+                }
+            vrops.close()
+        _connections.clear()
+    return token_cache
+
+def save_request_stats(fullpath):
+    """Write the request statistics of the shared clients by server, and print a summary of them"""
+    with _connections_lock:
+        request_stats = {}
+        for name, vrops in _connections.items():
+            if vrops.instrumentation is not None:
+                request_stats[name] = vrops.instrumentation.to_dict()
+                print(f"Requests to {name}:\n{vrops.instrumentation.summary()}")
+    
+    with open(fullpath, 'w') as outfile:
+        json.dump(request_stats, outfile, indent=2)
+
+def open_response_cache(path, config):
+    """
+    config.json "responseCache": {"path": "response-cache.db", "ttl": {"get_resource": 3600, ...}, "maxBytes": ...}
+    ttl holds seconds by nagini method name, only the methods listed are cached (default: resources and properties).
+    Returns None when not configured.
+    """
+    cache_config = config.get("responseCache")
+    if not cache_config:
+        return None
+    cache_path = cache_config.get("path", "response-cache.db")
+    if not os.path.isabs(cache_path):
+        cache_path = path + "/" + cache_path
+    return nagini.ResponseCache(cache_path, ttl=cache_config.get("ttl"),
+                                max_bytes=int(cache_config.get("maxBytes", 256 * 1024 * 1024)))
+
+def close_response_cache():
+    global _response_cache
+    if _response_cache is not None:
+        print(_response_cache.summary())
+        _response_cache.close()
+        _response_cache = None
+
+def save_token_cache(fullpath, token_cache):
+    # the file holds live credentials, keep it readable by the owner only
+    fd = os.open(fullpath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    if hasattr(os, "fchmod"):
+        # the mode only applies to a new file, not to one written by an older version
+        os.fchmod(fd, 0o600)
+    with os.fdopen(fd, 'w') as outfile:
+        json.dump(token_cache, outfile)
+
+def process_configuration(collection, server_config, executor, writer, index, checkpoint=None, token_cache=None):
+    """Collect one collection, handing its resources to the writer in inventory order as they are collected"""
+    adapter = collection["adapterKind"]
+    resourceknd = collection["resourceKind"]
+    sampleno = collection["sampleno"]
+    batch_size = max(int(collection.get("batchSize", DEFAULT_BATCH_SIZE)), 1)
+    page_size = max(int(collection.get("pageSize", DEFAULT_PAGE_SIZE)), 1)
+    prefetch = collection.get("pagePrefetch", True)
+    metric_keys = collection.get("metricKeys", [])
+    property_keys = collection.get("propertyKeys", [])
+    
+    vrops = get_vrops_connection(server_config, token_cache)
+    
+    writer.begin_collection(index, {
         "resourceKind": resourceknd,
         "adapterKind": adapter,
         "metricKeys": metric_keys,
         "propertyKeys": property_keys,
+        "sampleno": int(sampleno),
         "server": server_config["name"]
-    }
+    })
+    
+    concurrency = get_concurrency(server_config)
+    max_concurrency = get_max_concurrency(server_config)
+    count = 0
+    pending = deque()
+    
+    for resources in iter_resource_pages(vrops, resourceknd, adapter, page_size, prefetch):
+        # small pages are split evenly so that every worker gets a chunk
+        chunk_size = min(batch_size, max(-(-len(resources) // concurrency), 1))
+        for chunk in chunked(resources, chunk_size):
+            pending.append(executor.submit(get_chunk_data, vrops, chunk, metric_keys, property_keys, sampleno,
+                                           checkpoint))
+        
+        # results are taken in submission order, so allstats is the same as a sequential run.
+        # waiting here also keeps the number of resources held in flight bounded
+        while len(pending) > 2 * max_concurrency:
+            outdata = pending.popleft().result()
+            writer.write_resources(index, outdata)
+            count += len(outdata)
+    
+    while pending:
+        outdata = pending.popleft().result()
+        writer.write_resources(index, outdata)
+        count += len(outdata)
     
-    return outstat
+    writer.end_collection(index, {"timestamp": get_korean_timestamp()})
+    
+    return count
+
+def get_collection_key(server_name, collection):
+    """
+    Checkpoint key of a collection (a config.json entry or a collected result): collections of the same kind
+    that differ in sampleno or metric keys store different stats, so they get checkpoints of their own
+    """
+    metric_keys = hashlib.sha1("\n".join(sorted(set(collection.get("metricKeys") or []))).encode("utf-8")).hexdigest()
+    return (f"{server_name}|{collection['adapterKind']}|{collection['resourceKind']}|{int(collection['sampleno'])}|"
+            f"{metric_keys[:12]}")
+
+def load_json_file(fullpath, default):
+    if not os.path.exists(fullpath):
+        return default
+    try:
+        with open(fullpath) as data_file:
+            return json.load(data_file)
+    except Exception as e:
+        print(f"Error reading {fullpath}, ignoring it: {str(e)}")
+        return default
+
+def get_checkpoint(collection, server_config, previous_checkpoints, previous_results):
+    """Checkpoint of an incremental collection, seeded with the previous run's timestamps and stats"""
+    key = get_collection_key(server_config["name"], collection)
+    previous = previous_checkpoints.get(key, {})
+    stored = {}
+    for result in previous_results:
+        if result.get("sampleno") is not None and get_collection_key(result["server"], result) == key:
+            stored = {item["identifier"]: item for item in result["allstats"]}
+    
+    return CollectionCheckpoint(collection["sampleno"], collection.get("metricKeys", []),
+                                previous.get("resources", {}), stored,
+                                collection.get("sampleInterval", DEFAULT_SAMPLE_INTERVAL))
+
+def run_collections(collections, servers, checkpoints, writer, token_cache=None):
+    """Run all collections in parallel and return the number of resources collected by each, in config order"""
+    # chunks are fetched on one pool per server, so the server's rate limiter caps its load
+    # no matter how many collections target it. the pool is as large as the limiter may grow
+    executors = {name: ThreadPoolExecutor(max_workers=get_max_concurrency(server)) for name, server in servers.items()}
+    try:
+        with ThreadPoolExecutor(max_workers=max(len(collections), 1)) as runner:
+            futures = [
+                runner.submit(process_configuration, collection, servers[collection["serverId"]],
+                              executors[collection["serverId"]], writer, index, checkpoint, token_cache)
+                for index, (collection, checkpoint) in enumerate(zip(collections, checkpoints))
+            ]
+            return [future.result() for future in futures]
+    finally:
+        for executor in executors.values():
+            executor.shutdown()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Collect metrics and properties from Aria Operations")
+    parser.add_argument("--config", help="config.json to use (default: config.json next to this script)")
+    parser.add_argument("--output-dir", help="directory for the collected data, checkpoints and token cache "
+                                             "(default: the directory of this script)")
+    parser.add_argument("--profile", action="store_true",
+                        help="record time, memory and hot functions per stage to profile-metric-collection.json")
+    return parser.parse_args()
 
 def main():
+    global _response_cache
     requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
     
-    path = get_script_path()
-    fullpath = path + "/" + "config.json"
+    args = parse_args()
+    path = os.path.abspath(args.output_dir) if args.output_dir else get_script_path()
+    fullpath = args.config or get_script_path() + "/" + "config.json"
+    checkpointpath = path + "/" + "metric-checkpoint.json"
+    tokencachepath = path + "/" + "token-cache.json"
+    requeststatspath = path + "/" + "request-stats.json"
+    profiler = PipelineProfiler("metric-collection", enabled=args.profile)
     
+    profiler.begin("load previous data")
     with open(fullpath) as data_file:
         config = json.load(data_file)
     
     # Create server lookup dictionary
     servers = {server["name"]: server for server in config["servers"]}
     
-    all_results = []
+    # "ndjson" streams every resource to disk as it is collected, "json" writes metric-data.json at the end,
+    # "columnar" stores multi-sample series as binary arrays in metric-data.col
+    output_format = config.get("outputFormat", "json")
+    outpath = get_output_path(path, output_format)
     
+    # incremental collections continue from the previous run's output and checkpoints
+    previous_checkpoints = {}
+    previous_results = []
+    if any(collection.get("incremental") for collection in config["collections"]):
+        previous_checkpoints = load_json_file(checkpointpath, {})
+        try:
+            previous_results = load_metric_data(outpath) if os.path.exists(outpath) else []
+        except Exception as e:
+            print(f"Error reading {outpath}, collecting in full: {str(e)}")
+    
+    collection_checkpoints = []
     for collection in config["collections"]:
-        server_config = servers[collection["serverId"]]
-        result = process_configuration(collection, server_config)
-        all_results.append(result)
+        checkpoint = None
+        if collection.get("incremental"):
+            checkpoint = get_checkpoint(collection, servers[collection["serverId"]], previous_checkpoints,
+                                        previous_results)
+        collection_checkpoints.append(checkpoint)
+    
+    token_cache = load_json_file(tokencachepath, {})
+    _response_cache = open_response_cache(path, config)
+    writer = open_writer(outpath, output_format)
+    # optional SQLite store keeping every run, for trends beyond the current output file
+    history_path = get_history_path(path, config)
+    if history_path:
+        writer = WriterGroup([writer, MetricHistoryStore(history_path)])
+    try:
+        profiler.begin("collect")
+        run_collections(config["collections"], servers, collection_checkpoints, writer, token_cache)
+        profiler.begin("write output")
+        writer.close()
+    finally:
+        profiler.begin("save state")
+        save_request_stats(requeststatspath)
+        save_token_cache(tokencachepath, close_vrops_connections(token_cache))
+        close_response_cache()
+    
+    checkpoints = {}
+    for collection, checkpoint in zip(config["collections"], collection_checkpoints):
+        if checkpoint is not None:
+            key = get_collection_key(servers[collection["serverId"]]["name"], collection)
+            checkpoints[key] = checkpoint.to_dict()
     
-    outpath = path + "/" + "metric-data.json"
+    # checkpoints are written after the data they describe, a run that dies in between re-collects in full
+    if checkpoints:
+        with open(checkpointpath, 'w') as outfile:
+            json.dump(checkpoints, outfile)
     
-    with open(outpath, 'w') as outfile:
-        json.dump(all_results, outfile, indent=2, ensure_ascii=False)
+    profiler.write(path)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/python
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from threading import Lock
+
+# output formats of metric-collection.py and the files they are written to
+OUTPUT_FILES = {
+    "json": "metric-data.json",
+    "ndjson": "metric-data.ndjson",
+    "columnar": "metric-data.col",
+}
+
+COLUMNAR_MAGIC = b"ARIACOL1"
+COLUMNAR_VERSION = 1
+
+def get_output_path(path, output_format):
+    if output_format not in OUTPUT_FILES:
+        raise ValueError(f"Invalid output format: {output_format}")
+    return path + "/" + OUTPUT_FILES[output_format]
+
+def find_metric_data(path):
+    """가장 최근에 수집된 메트릭 데이터 파일 경로 반환"""
+    candidates = [path + "/" + name for name in OUTPUT_FILES.values() if os.path.exists(path + "/" + name)]
+    if not candidates:
+        raise FileNotFoundError(f"No metric data found in {path}")
+    return max(candidates, key=os.path.getmtime)
+
+class JsonWriter:
+    """
+    Writes metric-data.json, a list with one entry per collection.
+    The whole file is only written by close(), in collection order.
+    """
+    def __init__(self, fullpath):
+        self.fullpath = fullpath
+        self.collections = {}
+        self._lock = Lock()
+
+    def begin_collection(self, index, meta):
+        with self._lock:
+            self.collections[index] = {"allstats": [], **meta}
+
+    def write_resources(self, index, resources):
+        with self._lock:
+            self.collections[index]["allstats"].extend(resources)
+
+    def end_collection(self, index, meta):
+        with self._lock:
+            self.collections[index].update(meta)
+
+    def close(self):
+        all_results = [self.collections[index] for index in sorted(self.collections)]
+        with open(self.fullpath, 'w') as outfile:
+            json.dump(all_results, outfile, indent=2, ensure_ascii=False)
+
+class NdjsonWriter:
+    """
+    Writes metric-data.ndjson, one JSON record per line, as soon as the data is collected:
+        {"type": "collection", "collection": <index>, ...collection fields}
+        {"type": "resource", "collection": <index>, ...resource data}
+        {"type": "end", "collection": <index>, "timestamp": ...}
+    Records of collections running in parallel are interleaved, the collection index tells them apart.
+    A collection without "end" record was interrupted, its resources up to that point are still readable.
+    """
+    def __init__(self, fullpath):
+        self.fullpath = fullpath
+        self._file = open(fullpath, 'w', encoding='utf-8')
+        self._lock = Lock()
+
+    def _write(self, records):
+        lines = "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
+        with self._lock:
+            self._file.write(lines)
+            self._file.flush()
+
+    def begin_collection(self, index, meta):
+        self._write([{"type": "collection", "collection": index, **meta}])
+
+    def write_resources(self, index, resources):
+        self._write([{"type": "resource", "collection": index, **resource} for resource in resources])
+
+    def end_collection(self, index, meta):
+        self._write([{"type": "end", "collection": index, **meta}])
+
+    def close(self):
+        self._file.close()
+
+class ColumnarWriter:
+    """
+    Writes metric-data.col, where every multi-sample series is stored as one int64 timestamp array
+    followed by one float64 value array. Layout:
+        magic | data blocks ... | footer JSON | footer length (uint64) | magic
+    Data blocks are the series arrays and one JSON segment per written chunk of resources, holding
+    identifier, name, properties and single-sample stats; a series is referenced from its segment as
+    {"$series": [offset, count]}. The footer lists the collections with the offsets of their segments.
+    Every block starts at a multiple of 8 bytes, so arrays can be used straight from a memory map.
+    The file is written next to the target and only renamed over it by close(), the previous file may
+    still be memory-mapped (incremental collection) and must not be truncated under its reader.
+    """
+    def __init__(self, fullpath):
+        self.fullpath = fullpath
+        self.collections = {}
+        self._file = open(fullpath + ".tmp", 'wb')
+        self._file.write(COLUMNAR_MAGIC)
+        self._offset = len(COLUMNAR_MAGIC)
+        self._lock = Lock()
+
+    def _append(self, data):
+        offset = self._offset
+        padding = -len(data) % 8
+        self._file.write(data + b"\0" * padding)
+        self._offset += len(data) + padding
+        return offset
+
+    def begin_collection(self, index, meta):
+        with self._lock:
+            self.collections[index] = {"segments": [], "count": 0, **meta}
+
+    def write_resources(self, index, resources):
+        with self._lock:
+            segment = []
+            for resource in resources:
+                stats = {}
+                for key, value in resource.get("stats", {}).items():
+                    if isinstance(value, (list, TimeSeries)):
+                        offset = self._append(array('q', [int(sample["timestamp"]) for sample in value]).tobytes())
+                        self._append(array('d', [float(sample["value"]) for sample in value]).tobytes())
+                        stats[key] = {"$series": [offset, len(value)]}
+                    else:
+                        stats[key] = value
+                segment.append({**resource, "stats": stats})
+            
+            data = json.dumps(segment, ensure_ascii=False).encode('utf-8')
+            self.collections[index]["segments"].append([self._append(data), len(data)])
+            self.collections[index]["count"] += len(resources)
+            self._file.flush()
+
+    def end_collection(self, index, meta):
+        with self._lock:
+            self.collections[index].update(meta)
+
+    def close(self):
+        footer = json.dumps({
+            "version": COLUMNAR_VERSION,
+            "byteorder": sys.byteorder,
+            "collections": [self.collections[index] for index in sorted(self.collections)]
+        }, ensure_ascii=False).encode('utf-8')
+        self._file.write(footer)
+        self._file.write(struct.pack("<Q", len(footer)))
+        self._file.write(COLUMNAR_MAGIC)
+        self._file.close()
+        os.replace(self.fullpath + ".tmp", self.fullpath)
+
+class WriterGroup:
+    """Passes collected data on to several writers, e.g. the output file and the history store"""
+    def __init__(self, writers):
+        self.writers = writers
+
+    def begin_collection(self, index, meta):
+        for writer in self.writers:
+            writer.begin_collection(index, meta)
+
+    def write_resources(self, index, resources):
+        for writer in self.writers:
+            writer.write_resources(index, resources)
+
+    def end_collection(self, index, meta):
+        for writer in self.writers:
+            writer.end_collection(index, meta)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+def open_writer(fullpath, output_format):
+    if output_format == "ndjson":
+        return NdjsonWriter(fullpath)
+    if output_format == "columnar":
+        return ColumnarWriter(fullpath)
+    return JsonWriter(fullpath)
+
+class LazyCollection(dict):
+    """
+    One collection of a lazily loaded metric data file (load_metric_data(..., lazy=True)). The other fields are
+    read up front, "allstats" is parsed from the file the first time it is used.
+    """
+    def __init__(self, meta, load_allstats):
+        super().__init__(meta)
+        self._load_allstats = load_allstats
+
+    @property
+    def loaded(self):
+        return self._load_allstats is None
+
+    def _materialize(self):
+        load_allstats, self._load_allstats = self._load_allstats, None
+        self["allstats"] = load_allstats()
+        return self["allstats"]
+
+    def __missing__(self, key):
+        if key == "allstats" and self._load_allstats is not None:
+            return self._materialize()
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key == "allstats" and self._load_allstats is not None:
+            return self._materialize()
+        return super().get(key, default)
+
+    def __contains__(self, key):
+        return (key == "allstats" and self._load_allstats is not None) or super().__contains__(key)
+
+def _map_file(fullpath):
+    with open(fullpath, 'rb') as infile:
+        return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+# JsonWriter output (json.dump with indent=2): collections start and end on lines with exactly two spaces of
+# indentation, their keys are indented by four. No other line looks like these, JSON strings cannot hold newlines.
+JSON_COLLECTION_START = b"\n  {"
+JSON_COLLECTION_END = b"\n  }"
+JSON_ALLSTATS_START = b'\n    "allstats": '
+JSON_ALLSTATS_END = b"\n    ]"
+
+def index_json(fullpath):
+    """
+    metric-data.json의 collection별 위치만 찾아서 LazyCollection 목록으로 반환 (allstats는 처음 사용할 때 파싱)
+    JsonWriter가 쓴 형식(indent=2)이 아니면 None
+    """
+    if os.path.getsize(fullpath) == 0:
+        return None
+    mapped = _map_file(fullpath)
+    if mapped[:4] != b"[" + JSON_COLLECTION_START[:3]:
+        return None
+
+    def load_span(start, end):
+        return lambda: json.loads(mapped[start:end])
+
+    collections = []
+    start = mapped.find(JSON_COLLECTION_START)
+    while start != -1:
+        end = mapped.find(JSON_COLLECTION_END, start)
+        if end == -1:
+            return None
+        end += len(JSON_COLLECTION_END)
+        allstats = mapped.find(JSON_ALLSTATS_START, start, end)
+        array_start = allstats + len(JSON_ALLSTATS_START)
+        if allstats == -1 or mapped[array_start:array_start + 2] == b"[]":
+            # nothing worth deferring
+            collections.append(json.loads(mapped[start:end]))
+        else:
+            array_end = mapped.find(JSON_ALLSTATS_END, array_start, end)
+            if array_end == -1:
+                return None
+            array_end += len(JSON_ALLSTATS_END)
+            meta = json.loads(mapped[start:array_start] + b"[]" + mapped[array_end:end])
+            del meta["allstats"]
+            collections.append(LazyCollection(meta, load_span(array_start, array_end)))
+        start = mapped.find(JSON_COLLECTION_START, end)
+    return collections
+
+# NdjsonWriter's resource records start with this, followed by the collection index
+NDJSON_RESOURCE_PREFIX = b'{"type": "resource", "collection": '
+
+def index_ndjson(fullpath):
+    """
+    metric-data.ndjson을 한 번 훑어서 collection 레코드만 파싱하고 resource 레코드는 위치만 기록,
+    LazyCollection 목록으로 반환 (resource 레코드는 해당 collection을 처음 사용할 때 파싱)
+    """
+    collections = {}
+    offsets = {}
+    offset = 0
+    with open(fullpath, 'rb') as infile:
+        for line in infile:
+            if line.startswith(NDJSON_RESOURCE_PREFIX):
+                index = int(line[len(NDJSON_RESOURCE_PREFIX):line.index(b",", len(NDJSON_RESOURCE_PREFIX))])
+                offsets.setdefault(index, array('q')).extend((offset, len(line)))
+            elif line.strip():
+                record = json.loads(line)
+                record_type = record.pop("type")
+                index = record.pop("collection")
+                if record_type == "collection":
+                    collections[index] = record
+                elif record_type == "end":
+                    collections[index].update(record)
+                elif record_type == "resource":
+                    # written with other separators, not by NdjsonWriter
+                    return None
+            offset += len(line)
+    if not offsets:
+        return [{"allstats": [], **collections[index]} for index in sorted(collections)]
+    mapped = _map_file(fullpath)
+
+    def load_records(positions):
+        def load():
+            allstats = []
+            for i in range(0, len(positions), 2):
+                record = json.loads(mapped[positions[i]:positions[i] + positions[i + 1]])
+                del record["type"], record["collection"]
+                allstats.append(record)
+            return allstats
+        return load
+
+    return [LazyCollection(collections[index], load_records(offsets.get(index, array('q'))))
+            for index in sorted(collections)]
+
+def iter_ndjson_records(fullpath):
+    with open(fullpath, encoding='utf-8') as infile:
+        for line in infile:
+            if line.strip():
+                yield json.loads(line)
+
+def load_ndjson(fullpath):
+    """NDJSON 레코드를 metric-data.json과 같은 구조(collection 목록)로 변환"""
+    collections = {}
+    for record in iter_ndjson_records(fullpath):
+        record_type = record.pop("type")
+        index = record.pop("collection")
+        if record_type == "collection":
+            collections[index] = {"allstats": [], **record}
+        elif record_type == "resource":
+            collections[index]["allstats"].append(record)
+        elif record_type == "end":
+            collections[index].update(record)
+    return [collections[index] for index in sorted(collections)]
+
+class TimeSeries:
+    """
+    Samples of one stat key read from metric-data.col. timestamps and values are memoryviews over the
+    memory-mapped file, nothing is built per sample unless it is indexed or iterated like the list of
+    {"value", "timestamp"} dicts stored in metric-data.json.
+    """
+    __slots__ = ("timestamps", "values")
+
+    def __init__(self, timestamps, values):
+        self.timestamps = timestamps
+        self.values = values
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return TimeSeries(self.timestamps[i], self.values[i])
+        return {"value": self.values[i], "timestamp": self.timestamps[i]}
+
+    def __iter__(self):
+        for timestamp, value in zip(self.timestamps, self.values):
+            yield {"value": value, "timestamp": timestamp}
+
+    def latest(self):
+        return self.values[-1] if len(self.values) else None
+
+def _columnar_array(buffer, typecode, offset, count, swap):
+    view = buffer[offset:offset + 8 * count].cast(typecode)
+    if not swap:
+        return view
+    # written on a machine of the other byte order, this is the one case where the data is copied
+    converted = array(typecode, view.tobytes())
+    converted.byteswap()
+    return memoryview(converted)
+
+def _columnar_allstats(buffer, segments, swap):
+    allstats = []
+    for offset, length in segments:
+        for resource in json.loads(bytes(buffer[offset:offset + length])):
+            for key, value in resource["stats"].items():
+                if isinstance(value, dict) and "$series" in value:
+                    series_offset, count = value["$series"]
+                    resource["stats"][key] = TimeSeries(
+                        _columnar_array(buffer, 'q', series_offset, count, swap),
+                        _columnar_array(buffer, 'd', series_offset + 8 * count, count, swap)
+                    )
+            allstats.append(resource)
+    return allstats
+
+def index_columnar(fullpath):
+    """metric-data.col의 footer만 읽어서 LazyCollection 목록으로 반환 (segment는 처음 사용할 때 파싱)"""
+    buffer = memoryview(_map_file(fullpath))
+    
+    trailer = len(COLUMNAR_MAGIC) + 8
+    if buffer[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC or buffer[-len(COLUMNAR_MAGIC):] != COLUMNAR_MAGIC:
+        raise ValueError(f"Invalid columnar metric data: {fullpath}")
+    footer_length = struct.unpack("<Q", buffer[-trailer:-len(COLUMNAR_MAGIC)])[0]
+    footer = json.loads(bytes(buffer[-trailer - footer_length:-trailer]))
+    if footer["version"] != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar metric data version: {footer['version']}")
+    swap = footer["byteorder"] != sys.byteorder
+    
+    def load_segments(segments):
+        return lambda: _columnar_allstats(buffer, segments, swap)
+
+    collections = []
+    for meta in footer["collections"]:
+        collection = {key: value for key, value in meta.items() if key not in ("segments", "count")}
+        collections.append(LazyCollection(collection, load_segments(meta["segments"])))
+    return collections
+
+def load_columnar(fullpath):
+    """metric-data.col을 memory map으로 열어 metric-data.json과 같은 구조(collection 목록)로 변환"""
+    return [{"allstats": collection["allstats"], **collection} for collection in index_columnar(fullpath)]
+
+def load_metric_data(fullpath, lazy=False):
+    """
+    수집된 메트릭 데이터를 파일 형식에 맞게 읽어서 collection 목록으로 반환
+    lazy=True이면 collection 위치만 색인하고 allstats는 처음 사용할 때 파싱 (형식이 맞지 않으면 전체를 읽음)
+    """
+    if lazy:
+        if fullpath.endswith(".col"):
+            return index_columnar(fullpath)
+        collections = index_ndjson(fullpath) if fullpath.endswith(".ndjson") else index_json(fullpath)
+        if collections is not None:
+            return collections
+    if fullpath.endswith(".ndjson"):
+        return load_ndjson(fullpath)
+    if fullpath.endswith(".col"):
+        return load_columnar(fullpath)
+    with open(fullpath, 'r') as file:
+        return json.load(file)
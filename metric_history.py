@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+import json
+import os
+import sqlite3
+import time
+from threading import Lock
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS resources (
+    server TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    resource_kind TEXT,
+    name TEXT,
+    PRIMARY KEY (server, resource_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples (
+    server TEXT NOT NULL,
+    resource_id TEXT NOT NULL,
+    stat_key TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    value REAL,
+    PRIMARY KEY (server, resource_id, stat_key, ts)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resources_kind_name ON resources (resource_kind, name);
+CREATE INDEX IF NOT EXISTS samples_stat_ts ON samples (stat_key, ts);
+"""
+
+def get_history_path(path, config):
+    """config.json의 "history" 경로 (상대 경로는 스크립트 디렉토리 기준), 설정이 없으면 None"""
+    history = config.get("history")
+    if not history:
+        return None
+    return history if os.path.isabs(history) else path + "/" + history
+
+def find_history(path):
+    """리포트용: config.json에 설정된 히스토리 DB가 있으면 열어서 반환, 없으면 None"""
+    try:
+        with open(path + "/" + "config.json") as data_file:
+            history_path = get_history_path(path, json.load(data_file))
+    except (OSError, ValueError):
+        return None
+    if history_path is None or not os.path.exists(history_path):
+        return None
+    return MetricHistoryStore(history_path)
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class MetricHistoryStore:
+    """
+    SQLite store that keeps the samples of every collection run, keyed by
+    (server, resource identifier, stat key, timestamp). Samples already stored are kept as they are,
+    so overlapping series of incremental runs are stored once.
+    Single-sample stats (sampleno 1) are stored at the timestamp of their sample ("statTimestamps" of the resource),
+    or at the start time of the collection when it is not known. Values that are no numbers are not stored.
+    Results of the queries are keyed by resource identifier, names are not unique across servers.
+
+    Has the writer interface of metric_data (begin_collection/write_resources/end_collection/close),
+    so metric-collection.py appends to it while collecting.
+    """
+    def __init__(self, fullpath):
+        self.fullpath = fullpath
+        self.collections = {}
+        # collections write from their own threads, every statement goes through the lock
+        self._conn = sqlite3.connect(fullpath, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = Lock()
+
+    def begin_collection(self, index, meta):
+        with self._lock:
+            self.collections[index] = {
+                "server": meta.get("server"),
+                "resourceKind": meta.get("resourceKind"),
+                "timestamp": int(time.time() * 1000),
+            }
+
+    def write_resources(self, index, resources):
+        collection = self.collections[index]
+        server = collection["server"]
+        resource_rows = []
+        sample_rows = []
+        for resource in resources:
+            resource_id = resource["identifier"]
+            resource_rows.append((server, resource_id, collection["resourceKind"], resource.get("name")))
+            timestamps = resource.get("statTimestamps") or {}
+            for key, value in (resource.get("stats") or {}).items():
+                if is_number(value):
+                    sample_rows.append((server, resource_id, key, int(timestamps.get(key, collection["timestamp"])),
+                                        value))
+                elif isinstance(value, (str, bytes, dict)) or not hasattr(value, "__iter__"):
+                    # None, text or anything else that is no series
+                    continue
+                else:
+                    sample_rows.extend((server, resource_id, key, int(sample["timestamp"]), sample["value"])
+                                       for sample in value
+                                       if isinstance(sample, dict) and is_number(sample.get("value"))
+                                       and sample.get("timestamp") is not None)
+
+        with self._lock:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO resources VALUES (?, ?, ?, ?)", resource_rows)
+                self._conn.executemany("INSERT OR IGNORE INTO samples VALUES (?, ?, ?, ?, ?)", sample_rows)
+
+    def end_collection(self, index, meta):
+        pass
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _query(self, sql, params):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get_series(self, server, resource_id, stat_key, begin=None, end=None):
+        """한 리소스의 메트릭 이력을 [(timestamp, value), ...]로 반환 (timestamp 오름차순)"""
+        return self._query(
+            "SELECT ts, value FROM samples WHERE server = ? AND resource_id = ? AND stat_key = ? "
+            "AND ts >= ? AND ts <= ? ORDER BY ts",
+            (server, resource_id, stat_key, begin or 0, end if end is not None else 2 ** 63 - 1))
+
+    def get_range(self, resource_kind, stat_key, begin=None, end=None, name=None):
+        """리소스 종류의 메트릭 이력을 {리소스 ID: [(timestamp, value), ...]}로 반환 (name을 주면 그 이름의 리소스만)"""
+        sql = ("SELECT s.resource_id, s.ts, s.value FROM samples s "
+               "JOIN resources r ON r.server = s.server AND r.resource_id = s.resource_id "
+               "WHERE s.stat_key = ? AND s.ts >= ? AND s.ts <= ? AND r.resource_kind = ?")
+        params = [stat_key, begin or 0, end if end is not None else 2 ** 63 - 1, resource_kind]
+        if name is not None:
+            sql += " AND r.name = ?"
+            params.append(name)
+
+        result = {}
+        for resource_id, ts, value in self._query(sql + " ORDER BY s.ts", params):
+            result.setdefault(resource_id, []).append((ts, value))
+        return result
+
+    def get_latest(self, resource_kind, stat_key):
+        """리소스 종류의 리소스별 최신 메트릭 값을 {리소스 ID: (timestamp, value)}로 반환"""
+        rows = self._query(
+            "SELECT r.resource_id, s.ts, s.value FROM resources r "
+            "JOIN samples s ON s.server = r.server AND s.resource_id = r.resource_id AND s.stat_key = ? "
+            "AND s.ts = (SELECT MAX(ts) FROM samples WHERE server = r.server AND resource_id = r.resource_id "
+            "AND stat_key = ?) WHERE r.resource_kind = ?",
+            (stat_key, stat_key, resource_kind))
+        return {resource_id: (ts, value) for resource_id, ts, value in rows}
+
+    def get_resources(self, resource_kind):
+        """리소스 종류의 리소스를 {리소스 ID: (server, 이름)}으로 반환"""
+        rows = self._query("SELECT resource_id, server, name FROM resources WHERE resource_kind = ?", (resource_kind,))
+        return {resource_id: (server, name) for resource_id, server, name in rows}
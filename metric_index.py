@@ -0,0 +1,450 @@
+#!/usr/bin/python
+
+import json
+import mmap
+import operator
+import os
+import pickle
+import struct
+from itertools import compress, repeat
+
+class _Missing:
+    def __repr__(self):
+        return "MISSING"
+
+    def __reduce__(self):
+        # unpickled as the module's MISSING, the columns are compared against it by identity
+        return "MISSING"
+
+# placeholder of a resource that has no value for a key, so columns stay aligned with the rows
+# (None is a value: a property reported as null)
+MISSING = _Missing()
+
+class ResourceTable:
+    """
+    Column index over the allstats of one collection, built once by VSphereMetricsHandler.
+    Row i is allstats[i] (items, None once loaded from an IndexSnapshot); every stat/property key has a dense column with MISSING where the resource has no value,
+    and names/identifiers/servers map back to row positions.
+    """
+    def __init__(self, items, servers=None):
+        self.items = items
+        self.servers = servers if servers is not None else [None] * len(items)
+        self.rows_by_server = {}
+        for row, server in enumerate(self.servers):
+            self.rows_by_server.setdefault(server, []).append(row)
+        self.names = [item.get('name') for item in items]
+        self.identifiers = [item.get('identifier') for item in items]
+        # names are not unique (e.g. the same VM name on two servers), identifiers are
+        self.rows_by_name = {}
+        for row, name in enumerate(self.names):
+            self.rows_by_name.setdefault(name, []).append(row)
+        self.rows_by_identifier = {identifier: row for row, identifier in enumerate(self.identifiers)}
+        # section ('stats' / 'properties') -> key -> column
+        self.columns = {section: self._build_columns(items, section) for section in ('stats', 'properties')}
+        # keys every row has a value for, their columns are returned as they are
+        self.complete = {section: {key for key, column in columns.items()
+                                   if not any(value is MISSING for value in column)}
+                         for section, columns in self.columns.items()}
+        # masks are ints with one byte (0 or 1) per row, little endian: & and | combine whole columns at once
+        self.all_rows = int.from_bytes(b"\x01" * len(items), "little")
+        self._masks = {}
+
+    @classmethod
+    def from_collections(cls, collections):
+        """
+        One table over the allstats of several collections of the same resource kind, e.g. one per vCenter.
+        A resource collected twice (the same identifier) is kept once, from the first collection.
+        """
+        items = []
+        servers = []
+        seen = set()
+        for collection in collections:
+            server = collection.get('server')
+            for item in collection.get('allstats', []):
+                identifier = item.get('identifier')
+                if identifier is not None:
+                    if identifier in seen:
+                        continue
+                    seen.add(identifier)
+                items.append(item)
+                servers.append(server)
+        return cls(items, servers)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getstate__(self):
+        # the masks are cheap to compute again and only a few are ever used. the rows are not kept either,
+        # the columns hold the same values and unpickling one dict per resource would cost most of the load time
+        state = self.__dict__.copy()
+        state["_masks"] = {}
+        state["items"] = None
+        return state
+
+    def item(self, row):
+        """allstats entry of a row, put together from the columns for a table loaded from a snapshot"""
+        if self.items is not None:
+            return self.items[row]
+        return {
+            "identifier": self.identifiers[row],
+            "name": self.names[row],
+            "stats": {key: column[row] for key, column in self.columns["stats"].items() if column[row] is not MISSING},
+            "properties": {key: column[row] for key, column in self.columns["properties"].items()
+                           if column[row] is not MISSING},
+        }
+
+    @staticmethod
+    def _build_columns(items, section):
+        columns = {}
+        for row, item in enumerate(items):
+            for key, value in (item.get(section) or {}).items():
+                column = columns.get(key)
+                if column is None:
+                    column = columns[key] = [MISSING] * len(items)
+                column[row] = value
+        return columns
+
+    def column(self, section, key):
+        """Dense column of key, None if no row has it"""
+        return self.columns[section].get(key)
+
+    def values(self, section, key, rows=None):
+        """Values of key in the given rows (all rows if None), skipping the rows without one"""
+        column = self.columns[section].get(key)
+        if column is None:
+            return []
+        if rows is None:
+            if key in self.complete[section]:
+                return column[:]
+            return [value for value in column if value is not MISSING]
+        return [column[row] for row in rows if column[row] is not MISSING]
+
+    def find_rows(self, name):
+        return self.rows_by_name.get(name, [])
+
+    def find_row(self, identifier):
+        return self.rows_by_identifier.get(identifier)
+
+    def rows_mask(self, rows):
+        mask = bytearray(len(self.names))
+        for row in rows:
+            mask[row] = 1
+        return int.from_bytes(mask, "little")
+
+    def mask_rows(self, mask):
+        """Row numbers set in a mask"""
+        return list(compress(range(len(self.names)), mask.to_bytes(len(self.names), "little")))
+
+    def _cached_mask(self, name, section, key, test):
+        mask = self._masks.get((name, section, key))
+        if mask is None:
+            column = self.columns[section].get(key) or ()
+            mask = self._masks[(name, section, key)] = int.from_bytes(bytes(map(test, column)), "little")
+        return mask
+
+    def missing_mask(self, section, key):
+        """Rows without a value for key"""
+        if key not in self.columns[section]:
+            return self.all_rows
+        return self._cached_mask("missing", section, key, lambda value: value is MISSING)
+
+    def numeric_mask(self, key):
+        """Rows with a single number for the stat key (not a series)"""
+        return self._cached_mask("numeric", "stats", key,
+                                 lambda value: isinstance(value, (int, float)))
+
+    def numbers(self, key):
+        """The stat column with 0 in place of anything but a number, to compare whole columns with map()"""
+        numbers = self._masks.get(("numbers", key))
+        if numbers is None:
+            numbers = self._masks[("numbers", key)] = [
+                value if isinstance(value, (int, float)) else 0 for value in self.columns["stats"].get(key, ())]
+        return numbers
+
+    def compare_mask(self, key, op, threshold):
+        """Rows whose stat key is a number for which op(value, threshold) holds"""
+        if key not in self.columns["stats"]:
+            return 0
+        matches = int.from_bytes(bytes(map(op, self.numbers(key), repeat(threshold))), "little")
+        return matches & self.numeric_mask(key)
+
+    def equal_mask(self, section, key, value):
+        """Rows whose value of key equals value"""
+        column = self.columns[section].get(key)
+        if column is None:
+            return 0
+        matches = int.from_bytes(bytes(map(operator.eq, column, repeat(value))), "little")
+        return matches & (self.all_rows ^ self.missing_mask(section, key))
+
+    def select(self, predicate):
+        """Row numbers matching a predicate (see compile_filters)"""
+        return self.mask_rows(predicate.mask(self))
+
+
+# snapshots -------------------------------------------------------------------------------------------------------
+
+SNAPSHOT_MAGIC = b"ARIAIDX1"
+# bump when ResourceTable or the way the report builds it changes, older snapshots are then rebuilt
+SNAPSHOT_VERSION = 1
+
+def get_snapshot_path(fullpath):
+    return fullpath + ".idx"
+
+class IndexSnapshot:
+    """
+    Binary snapshot of the ResourceTables built from one metric data file, kept next to it as <file>.idx so that
+    regenerating the report does not parse and index the same data again. Layout:
+        magic | header length (uint64) | header JSON | one pickled ResourceTable per resource kind ...
+    with the header giving the offset (from the end of the header) and length of every kind's table.
+    The header holds the source file's size and mtime and SNAPSHOT_VERSION; on any mismatch the snapshot is ignored
+    and written again. A table is only unpickled when the report asks for its kind.
+    Tables hold the resources as loaded, so metric-data.col (memory-mapped series) is not snapshotted.
+    """
+    def __init__(self, source, rebuild=False):
+        self.source = source
+        self.path = get_snapshot_path(source)
+        stat = os.stat(source)
+        self.key = {"version": SNAPSHOT_VERSION, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+        self.tables = {}
+        self._blobs = {}
+        self._mapped = None
+        # kinds built in this run, the others are copied from the current snapshot as they are
+        self._built = set()
+        if not rebuild:
+            self._open()
+
+    def _open(self):
+        try:
+            with open(self.path, 'rb') as infile:
+                mapped = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return
+        start = len(SNAPSHOT_MAGIC) + 8
+        try:
+            if mapped[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+                raise ValueError("not a snapshot")
+            header_length = struct.unpack("<Q", mapped[len(SNAPSHOT_MAGIC):start])[0]
+            header = json.loads(mapped[start:start + header_length])
+        except (ValueError, struct.error) as e:
+            print(f"Ignoring index snapshot {self.path}: {str(e)}")
+            mapped.close()
+            return
+        if header.get("key") != self.key:
+            # the data was collected again (or the format changed)
+            mapped.close()
+            return
+        self._mapped = mapped
+        base = start + header_length
+        self._blobs = {kind: (base + offset, length) for kind, (offset, length) in header["kinds"].items()}
+
+    def load(self, kind):
+        """ResourceTable of kind from the snapshot, None if it has none"""
+        table = self.tables.get(kind)
+        if table is None and kind in self._blobs:
+            offset, length = self._blobs[kind]
+            try:
+                table = pickle.loads(self._mapped[offset:offset + length])
+            except Exception as e:
+                print(f"Ignoring index snapshot of {kind}: {str(e)}")
+                return None
+            self.tables[kind] = table
+        return table
+
+    def store(self, kind, table):
+        self.tables[kind] = table
+        self._built.add(kind)
+
+    def save(self):
+        """Write the snapshot again if tables were built that it did not have, kinds never loaded are kept as they are"""
+        if not self._built:
+            return
+        blobs = {kind: self._mapped[offset:offset + length] for kind, (offset, length) in self._blobs.items()}
+        for kind in self._built:
+            blobs[kind] = pickle.dumps(self.tables[kind], protocol=pickle.HIGHEST_PROTOCOL)
+        self.close()
+
+        kinds = {}
+        offset = 0
+        for kind, blob in blobs.items():
+            kinds[kind] = [offset, len(blob)]
+            offset += len(blob)
+        header = json.dumps({"key": self.key, "kinds": kinds}).encode('utf-8')
+
+        with open(self.path + ".tmp", 'wb') as outfile:
+            outfile.write(SNAPSHOT_MAGIC)
+            outfile.write(struct.pack("<Q", len(header)))
+            outfile.write(header)
+            for blob in blobs.values():
+                outfile.write(blob)
+        os.replace(self.path + ".tmp", self.path)
+        self._built = set()
+
+    def close(self):
+        if self._mapped is not None:
+            self._mapped.close()
+            self._mapped = None
+        self._blobs = {}
+
+
+# filters ---------------------------------------------------------------------------------------------------------
+# Conditions on a ResourceTable, evaluated as a mask over all rows at once. A resource without a value for the key
+# of a condition passes it, as in the filters of the report so far.
+
+COMPARE_OPERATORS = {
+    '>': operator.gt,
+    '>=': operator.ge,
+    '<': operator.lt,
+    '<=': operator.le,
+    '==': operator.eq,
+}
+
+class Predicate:
+    def mask(self, table):
+        raise NotImplementedError
+
+    def restrict(self, table, mask):
+        """The rows of mask that also match"""
+        return mask & self.mask(table)
+
+    def __and__(self, other):
+        return And(self, other)
+
+    def __or__(self, other):
+        return Or(self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+class Name(Predicate):
+    """Resources named value"""
+    def __init__(self, value):
+        self.value = value
+
+    def mask(self, table):
+        return table.rows_mask(table.find_rows(self.value))
+
+class Server(Predicate):
+    """Resources collected from the server value (config.json servers[].name)"""
+    def __init__(self, value):
+        self.value = value
+
+    def mask(self, table):
+        return table.rows_mask(table.rows_by_server.get(self.value, []))
+
+class Compare(Predicate):
+    """Stat key compared to a threshold: Compare('cpu|usage_average', '>', 80). Series (sampleno > 1) never match."""
+    def __init__(self, key, op, threshold):
+        if op not in COMPARE_OPERATORS:
+            raise ValueError(f"Invalid operator: {op}")
+        self.key = key
+        self.op = op
+        self.threshold = threshold
+
+    def mask(self, table):
+        return table.compare_mask(self.key, COMPARE_OPERATORS[self.op], self.threshold) | \
+            table.missing_mask("stats", self.key)
+
+class Range(Predicate):
+    """low <= stat key <= high"""
+    def __init__(self, key, low, high):
+        self.key = key
+        self.low = low
+        self.high = high
+
+    def mask(self, table):
+        return (table.compare_mask(self.key, operator.ge, self.low) &
+                table.compare_mask(self.key, operator.le, self.high)) | table.missing_mask("stats", self.key)
+
+class Equals(Predicate):
+    """Stat or property key equal to value"""
+    def __init__(self, key, value, section="properties"):
+        self.key = key
+        self.value = value
+        self.section = section
+
+    def mask(self, table):
+        return table.equal_mask(self.section, self.key, self.value) | table.missing_mask(self.section, self.key)
+
+class Invalid(Predicate):
+    """A stat condition that could not be parsed, an error once it is checked against a resource with the stat"""
+    def __init__(self, key, error):
+        self.key = key
+        self.error = error
+
+    def mask(self, table):
+        return self.restrict(table, table.all_rows)
+
+    def restrict(self, table, mask):
+        if mask & (table.all_rows ^ table.missing_mask("stats", self.key)):
+            raise self.error
+        return mask
+
+class And(Predicate):
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def mask(self, table):
+        mask = table.all_rows
+        for predicate in self.predicates:
+            mask = predicate.restrict(table, mask)
+            if not mask:
+                break
+        return mask
+
+class Or(Predicate):
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def mask(self, table):
+        mask = 0
+        for predicate in self.predicates:
+            mask |= predicate.mask(table)
+        return mask
+
+class Not(Predicate):
+    def __init__(self, predicate):
+        self.predicate = predicate
+
+    def mask(self, table):
+        return table.all_rows ^ self.predicate.mask(table)
+
+def parse_condition(key, value):
+    """
+    Stat condition of a filter string: '>50', '<=30', '==5', or '50..80' for a range (inclusive).
+    Other operators do not filter anything.
+    """
+    if '..' in value:
+        low, _, high = value.partition('..')
+        try:
+            return Range(key, float(low), float(high))
+        except ValueError as e:
+            return Invalid(key, e)
+    op = ''.join(c for c in value if not c.isdigit() and c != '.')
+    try:
+        threshold = float(''.join(c for c in value if c.isdigit() or c == '.'))
+    except ValueError as e:
+        return Invalid(key, e)
+    if op not in COMPARE_OPERATORS:
+        return None
+    return Compare(key, op, threshold)
+
+def compile_filters(filters):
+    """
+    Predicate of the report's filters dict, e.g. {'name': 'vm-01', 'cpu|usage_average': '>50'}: all entries must hold.
+    'name' matches the resource name, a string is a condition on the stat (parse_condition), anything else must equal
+    the stat, and a property of the key must equal the value. A Predicate is returned as it is.
+    """
+    if isinstance(filters, Predicate):
+        return filters
+    predicates = []
+    for key, value in filters.items():
+        if key == 'name':
+            predicates.append(Name(value))
+        if isinstance(value, str):
+            condition = parse_condition(key, value)
+            if condition is not None:
+                predicates.append(condition)
+        else:
+            predicates.append(Equals(key, value, "stats"))
+        predicates.append(Equals(key, value, "properties"))
+    return And(*predicates)
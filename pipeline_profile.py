@@ -0,0 +1,152 @@
+#!/usr/bin/python
+
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, max RSS is reported as 0 there
+    resource = None
+
+# number of functions listed per stage
+DEFAULT_TOP_FUNCTIONS = 15
+
+class PipelineProfiler:
+    """
+    --profile mode of set-config.py, metric-collection.py and create_report_01.py.
+    Records per stage: wall time, CPU time of the process, peak traced memory (tracemalloc),
+    max RSS so far and the functions with the most own time (cProfile).
+    Stages run one after the other, begin() ends the current one:
+        profiler.begin("collect") ... profiler.begin("write output") ... profiler.end()
+    or with profiler.stage("collect"): ...
+    Threads started during a stage are profiled as well, function times are then added up over the threads
+    (time spent waiting for locks or sockets included).
+    A disabled profiler does nothing, so the scripts can call it unconditionally.
+    """
+    def __init__(self, script, enabled=True, top=DEFAULT_TOP_FUNCTIONS):
+        self.script = script
+        self.enabled = enabled
+        self.top = top
+        self.stages = []
+        self._current = None
+        self._started = time.perf_counter()
+
+    def begin(self, name):
+        if not self.enabled:
+            return
+        self.end()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        self._current = {
+            "name": name,
+            "wall": time.perf_counter(),
+            "cpu": time.process_time(),
+            "profile": profile,
+            "thread_profiles": [],
+        }
+        if sys.version_info < (3, 12):
+            # before 3.12 a profiler only sees the thread that enabled it, new threads enable their own
+            threading.setprofile(self._start_thread_profile(self._current["thread_profiles"]))
+        profile.enable()
+
+    @staticmethod
+    def _start_thread_profile(thread_profiles):
+        def start(frame, event, arg):
+            thread_profile = cProfile.Profile()
+            thread_profiles.append(thread_profile)
+            # replaces this function as the profiler of the thread
+            thread_profile.enable()
+        return start
+
+    def end(self):
+        if not self.enabled or self._current is None:
+            return
+        current, self._current = self._current, None
+        current["profile"].disable()
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        wall = time.perf_counter() - current["wall"]
+        cpu = time.process_time() - current["cpu"]
+        self.stages.append({
+            "stage": current["name"],
+            "wall_seconds": wall,
+            "cpu_seconds": cpu,
+            "peak_memory_bytes": tracemalloc.get_traced_memory()[1],
+            "max_rss_bytes": get_max_rss(),
+            "top_functions": get_top_functions([current["profile"]] + current["thread_profiles"], self.top),
+        })
+
+    @contextmanager
+    def stage(self, name):
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def to_dict(self):
+        return {
+            "script": self.script,
+            "python": sys.version.split()[0],
+            "total_wall_seconds": time.perf_counter() - self._started,
+            "stages": self.stages,
+        }
+
+    def summary(self):
+        lines = [f"Profile of {self.script}"]
+        lines.append(f"{'stage':<24} {'wall(s)':>9} {'cpu(s)':>9} {'peak(MB)':>9} {'rss(MB)':>9}")
+        for stage in self.stages:
+            lines.append(f"{stage['stage']:<24} {stage['wall_seconds']:>9.3f} {stage['cpu_seconds']:>9.3f} "
+                         f"{stage['peak_memory_bytes'] / 1024 / 1024:>9.1f} {stage['max_rss_bytes'] / 1024 / 1024:>9.1f}")
+        for stage in self.stages:
+            lines.append("")
+            lines.append(f"[{stage['stage']}] top functions by own time")
+            for function in stage["top_functions"]:
+                lines.append(f"  {function['own_seconds']:>8.3f}s {function['cumulative_seconds']:>8.3f}s cum "
+                             f"{function['calls']:>9} calls  {function['function']}")
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write profile-<script>.json and profile-<script>.txt to path and print the summary"""
+        if not self.enabled:
+            return
+        self.end()
+        tracemalloc.stop()
+        fullpath = path + "/" + f"profile-{self.script}"
+        with open(fullpath + ".json", 'w') as outfile:
+            json.dump(self.to_dict(), outfile, indent=2)
+        summary = self.summary()
+        with open(fullpath + ".txt", 'w') as outfile:
+            outfile.write(summary + "\n")
+        print(summary)
+        print(f"\nProfile saved to {fullpath}.json")
+
+def get_max_rss():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+def get_top_functions(profiles, top):
+    stats = pstats.Stats(*profiles)
+    functions = []
+    for (filename, line, name), (_, calls, own, cumulative, _) in stats.stats.items():
+        functions.append({
+            "function": f"{name} ({os.path.basename(filename)}:{line})" if line else name,
+            "calls": calls,
+            "own_seconds": own,
+            "cumulative_seconds": cumulative,
+        })
+    functions.sort(key=lambda function: function["own_seconds"], reverse=True)
+    return functions[:top]
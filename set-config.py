@@ -2,7 +2,14 @@
 
 import json
 import base64
+import argparse
 import os, sys
+from pipeline_profile import PipelineProfiler
+
+# defaults offered for servers[].concurrency and collections[].batchSize, the same as metric-collection.py uses
+# when they are not set
+DEFAULT_CONCURRENCY = 8
+DEFAULT_BATCH_SIZE = 100
 
 def get_script_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
@@ -14,22 +21,29 @@ def get_keys(key_type):
         keys.append(input(f"Enter the {key_type} key: "))
     return keys
 
+def get_int_input(prompt, default):
+    value = input(f"{prompt} (default {default}): ")
+    return int(value) if value.strip() else default
+
 def get_server_config():
     servername = input("Enter Server IP/FQDN: ")
     serveruid = input("Please enter user id: ")
     serverpasswd = input("Please enter vRops password: ")
     encryptedvar = base64.b64encode(serverpasswd.encode('utf-8')).decode('utf-8')
+    concurrency = get_int_input("Please enter the number of concurrent requests", DEFAULT_CONCURRENCY)
     
     return {
         "name": servername,
         "userid": serveruid,
-        "password": encryptedvar
+        "password": encryptedvar,
+        "concurrency": concurrency if concurrency >= 1 else 1
     }
 
 def get_collection_config(existing_servers):
     adapterkind = input("Please enter Adapter Kind: ")
     resourceKind = input("Please enter Resource Kind: ")
     maxsamples = input("Please enter the maximum number of samples to collect: ")
+    batchsize = get_int_input("Please enter the number of resources per bulk query", DEFAULT_BATCH_SIZE)
 
     # Show available servers
     print("\nAvailable servers:")
@@ -56,6 +70,7 @@ def get_collection_config(existing_servers):
         "adapterKind": adapterkind,
         "resourceKind": resourceKind,
         "sampleno": int(maxsamples) if int(maxsamples) >= 1 else 1,
+        "batchSize": batchsize if batchsize >= 1 else 1,
         "serverId": server_id,
         "metricKeys": metricKeys,
         "propertyKeys": propertyKeys
@@ -79,16 +94,28 @@ def get_the_inputs():
         "collections": collections
     }
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create config.json for metric-collection.py")
+    parser.add_argument("--profile", action="store_true",
+                        help="record time, memory and hot functions per stage to profile-set-config.json")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
     path = get_script_path()
     fullpath = path + "/" + "config.json"
+    profiler = PipelineProfiler("set-config", enabled=args.profile)
 
+    # mostly time spent waiting for the user's input
+    profiler.begin("inputs")
     final_data = get_the_inputs()
 
+    profiler.begin("write config")
     with open(fullpath, 'w') as outfile:
         json.dump(final_data, outfile, indent=2)
 
     print(f"\nConfiguration saved to {fullpath}")
+    profiler.write(path)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,173 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "vcops-python"))
+sys.path.insert(0, os.path.join(ROOT, "benchmark"))
+
+from metric_data import TimeSeries, get_output_path, load_metric_data, open_writer
+from mock_suite_api import SAMPLE_INTERVAL_MS, SyntheticInventory
+
+try:
+    # the script's file name is no module name
+    spec = importlib.util.spec_from_file_location("metric_collection", os.path.join(ROOT, "metric-collection.py"))
+    metric_collection = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(metric_collection)
+except ImportError as e:
+    metric_collection = None
+    import_error = str(e)
+else:
+    import_error = None
+
+
+class InventoryClient:
+    """The REST calls of metric-collection.py answered from a SyntheticInventory, the way the mock server does"""
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.calls = []
+        self.queries = []
+
+    def query_latest_stats_of_resources(self, query):
+        self.calls.append("query_latest_stats_of_resources")
+        return {"values": [{"resourceId": resource_id,
+                            "stat-list": self.inventory.stat_list(resource_id, query.get("statKey"),
+                                                                  query.get("maxSamples", 1))}
+                           for resource_id in query["resourceId"]]}
+
+    def get_stats_for_resources(self, query):
+        self.calls.append("get_stats_for_resources")
+        self.queries.append(query)
+        return {"values": [{"resourceId": resource_id,
+                            "stat-list": self.inventory.stat_list(resource_id, query.get("statKey"),
+                                                                  begin=query["begin"], end=query["end"],
+                                                                  latest_max_samples=query.get("latestMaxSamples"))}
+                           for resource_id in query["resourceId"]]}
+
+    def query_latest_properties_of_resources(self, query):
+        self.calls.append("query_latest_properties_of_resources")
+        return {"values": [{"resourceId": resource_id, "property-contents": {"property-content": [
+            {"statKey": key, "timestamps": [self.inventory.now], "values": [value]}
+            for key, value in self.inventory.properties(resource_id, query["propertyKeys"]).items()]}}
+            for resource_id in query["resourceIds"]]}
+
+
+def plain(allstats):
+    return [dict(item, stats={key: list(value) if isinstance(value, TimeSeries) else value
+                              for key, value in item["stats"].items()})
+            for item in allstats]
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class IncrementalCollectionTest(unittest.TestCase):
+    """A collection merged from the previous run and the newer samples equals a full collection"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.inventory = SyntheticInventory(12)
+        self.server_config = {"name": "vc1"}
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def collection(self, sampleno, metric_keys=None):
+        return {"serverId": "vc1", "adapterKind": "VMWARE", "resourceKind": "VirtualMachine", "sampleno": sampleno,
+                "metricKeys": metric_keys or self.inventory.stat_keys[:2], "propertyKeys": ["config|name"],
+                "incremental": True}
+
+    def collect(self, collection, checkpoint, output_format="json"):
+        client = InventoryClient(self.inventory)
+        self.output = io.StringIO()
+        with contextlib.redirect_stdout(self.output):
+            outdata = metric_collection.get_chunk_data(client, self.inventory.resources, collection["metricKeys"],
+                                                       collection["propertyKeys"], collection["sampleno"], checkpoint)
+        self.client = client
+        fullpath = get_output_path(self.workdir, output_format)
+        writer = open_writer(fullpath, output_format)
+        meta = {key: collection[key] for key in ("resourceKind", "adapterKind", "metricKeys", "propertyKeys")}
+        writer.begin_collection(0, dict(meta, sampleno=int(collection["sampleno"]), server="vc1"))
+        writer.write_resources(0, outdata)
+        writer.end_collection(0, {})
+        writer.close()
+        return client.calls, load_metric_data(fullpath)
+
+    def next_run(self, collection, checkpoint, results, previous_collection=None):
+        key = metric_collection.get_collection_key("vc1", previous_collection or collection)
+        checkpoints = json.loads(json.dumps({key: checkpoint.to_dict()}))
+        return metric_collection.get_checkpoint(collection, self.server_config, checkpoints, results)
+
+    def round_trip(self, sampleno, output_format="json", intervals=2, incremental=True):
+        collection = self.collection(sampleno)
+        # the newer samples are asked for up to the current time, the first run sees an older inventory
+        now = self.inventory.now
+        self.inventory.now -= intervals * SAMPLE_INTERVAL_MS
+        first = metric_collection.get_checkpoint(collection, self.server_config, {}, [])
+        calls, results = self.collect(collection, first, output_format)
+        self.assertNotIn("get_stats_for_resources", calls)
+
+        self.inventory.now = now
+        second = self.next_run(collection, first, results)
+        calls, merged = self.collect(collection, second, output_format)
+        if incremental:
+            self.assertIn("get_stats_for_resources", calls)
+            self.assertNotIn("query_latest_stats_of_resources", calls)
+            self.assertEqual({query["latestMaxSamples"] for query in self.client.queries}, {sampleno})
+        else:
+            # the latest query returns no more than an incremental one
+            self.assertNotIn("get_stats_for_resources", calls)
+            self.assertIn("query_latest_stats_of_resources", calls)
+        self.assertEqual(self.output.getvalue(), "")
+
+        _, full = self.collect(collection, None, output_format)
+        self.assertEqual(plain(merged[0]["allstats"]), plain(full[0]["allstats"]))
+        return second
+
+    def test_series_round_trip(self):
+        self.round_trip(3)
+
+    def test_single_sample_is_collected_in_full(self):
+        checkpoint = self.round_trip(1, incremental=False)
+        self.assertEqual(set(checkpoint.current[self.inventory.resources[0]["identifier"]]),
+                         set(self.inventory.stat_keys[:2]))
+
+    def test_columnar_round_trip(self):
+        self.round_trip(4, "columnar")
+
+    def test_stale_checkpoints_are_collected_in_full(self):
+        # 10 sample intervals since the last run, more than the 3 samples kept
+        self.round_trip(3, intervals=10, incremental=False)
+
+    def test_empty_checkpoints_are_collected_in_full(self):
+        resource_id = self.inventory.resources[0]["identifier"]
+        for metric_keys in ([], ["cpu|usage_average"]):
+            checkpoint = metric_collection.CollectionCheckpoint(3, metric_keys, {resource_id: {}},
+                                                                {resource_id: {"stats": {}}})
+            self.assertFalse(checkpoint.is_incremental(resource_id))
+
+        collection = self.collection(3)
+        previous = {resource["identifier"]: {} for resource in self.inventory.resources}
+        stored = {resource["identifier"]: {"stats": {}} for resource in self.inventory.resources}
+        checkpoint = metric_collection.CollectionCheckpoint(3, [], previous, stored)
+        calls, _ = self.collect(collection, checkpoint)
+        self.assertNotIn("get_stats_for_resources", calls)
+        self.assertEqual(self.output.getvalue(), "")
+
+    def test_changed_collection_is_collected_in_full(self):
+        collection = self.collection(3)
+        first = metric_collection.get_checkpoint(collection, self.server_config, {}, [])
+        _, results = self.collect(collection, first)
+        for changed in (self.collection(2), self.collection(3, self.inventory.stat_keys)):
+            checkpoint = self.next_run(changed, first, results, collection)
+            self.assertFalse(checkpoint.previous)
+            self.assertFalse(checkpoint.stored)
+
+
+if __name__ == "__main__":
+    unittest.main()
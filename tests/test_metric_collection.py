@@ -0,0 +1,326 @@
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "vcops-python"))
+
+from metric_data import get_output_path, load_metric_data, open_writer
+
+
+def load_script(name):
+    # the scripts' file names are no module names
+    spec = importlib.util.spec_from_file_location(name.replace("-", "_"), os.path.join(ROOT, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+try:
+    metric_collection = load_script("metric-collection")
+    import nagini
+except ImportError as e:
+    metric_collection = None
+    import_error = str(e)
+else:
+    import_error = None
+
+
+def make_resources(count, prefix="vm"):
+    return [{"identifier": "%s-%03d" % (prefix, i),
+             "resourceKey": {"name": "%s-%03d" % (prefix, i), "adapterKindKey": "VMWARE",
+                             "resourceKindKey": "VirtualMachine"}}
+            for i in range(count)]
+
+
+class StubClient:
+    """
+    The REST calls of metric-collection.py for a fixed inventory. delay(resource ids) is slept before a stats
+    query is answered, to make chunks finish in another order than they were submitted. errors holds the
+    exception raised by a method instead of answering.
+    """
+    def __init__(self, resources, delay=None, errors=None):
+        self.resources = resources
+        self.delay = delay
+        self.errors = errors or {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _called(self, name):
+        with self._lock:
+            self.calls.append(name)
+        if name in self.errors:
+            raise self.errors[name]
+
+    def get_resources(self, resourceKind, adapterKindKey, page, pageSize):
+        self._called("get_resources")
+        return {"pageInfo": {"totalCount": len(self.resources), "page": page, "pageSize": pageSize},
+                "resourceList": self.resources[page * pageSize:(page + 1) * pageSize]}
+
+    def query_latest_stats_of_resources(self, query):
+        self._called("query_latest_stats_of_resources")
+        if self.delay:
+            time.sleep(self.delay(query["resourceId"]))
+        return {"values": [{"resourceId": resource_id, "stat-list": {"stat": [
+            {"statKey": {"key": "cpu|usage_average"}, "timestamps": [1000], "data": [float(len(resource_id))]}]}}
+            for resource_id in query["resourceId"]]}
+
+    def get_latest_stats(self, resourceId, maxSamples, id, statKey=None):
+        self._called("get_latest_stats")
+        return {"values": [{"resourceId": resourceId, "stat-list": {"stat": [
+            {"statKey": {"key": "cpu|usage_average"}, "timestamps": [1000], "data": [float(len(resourceId))]}]}}]}
+
+    def get_resource_properties(self, resourceId, id):
+        self._called("get_resource_properties")
+        return {"resourceId": resourceId, "property": [{"name": "config|name", "value": resourceId}]}
+
+    def query_latest_properties_of_resources(self, query):
+        self._called("query_latest_properties_of_resources")
+        return {"values": [{"resourceId": resource_id, "property-contents": {"property-content": [
+            {"statKey": "config|name", "timestamps": [1000], "values": [resource_id]}]}}
+            for resource_id in query["resourceIds"]]}
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.collections = {}
+        self._lock = threading.Lock()
+
+    def begin_collection(self, index, meta):
+        with self._lock:
+            self.collections[index] = []
+
+    def write_resources(self, index, resources):
+        with self._lock:
+            self.collections[index].extend(resource["identifier"] for resource in resources)
+
+    def end_collection(self, index, meta):
+        pass
+
+    def close(self):
+        pass
+
+
+def make_collection(server_id="vc1", **kwargs):
+    return dict({"serverId": server_id, "adapterKind": "VMWARE", "resourceKind": "VirtualMachine", "sampleno": 1,
+                 "metricKeys": ["cpu|usage_average"], "propertyKeys": ["config|name"]}, **kwargs)
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class ConfigDefaultsTest(unittest.TestCase):
+
+    def test_set_config_offers_the_collector_defaults(self):
+        set_config = load_script("set-config")
+        self.assertEqual(set_config.DEFAULT_CONCURRENCY, metric_collection.DEFAULT_CONCURRENCY)
+        self.assertEqual(set_config.DEFAULT_BATCH_SIZE, metric_collection.DEFAULT_BATCH_SIZE)
+        self.assertEqual(metric_collection.get_concurrency({"name": "vc1"}), metric_collection.DEFAULT_CONCURRENCY)
+
+    def test_limiter_ceiling_is_never_below_the_start(self):
+        self.assertEqual(metric_collection.get_max_concurrency({"name": "vc1"}),
+                         metric_collection.DEFAULT_MAX_CONCURRENCY)
+        self.assertEqual(metric_collection.get_max_concurrency({"concurrency": 4, "maxConcurrency": 12}), 12)
+        self.assertEqual(metric_collection.get_max_concurrency({"concurrency": 40}), 40)
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class ChunkOrderTest(unittest.TestCase):
+    """Resources are written in inventory order, whichever chunk finishes first"""
+
+    def test_chunks_finishing_out_of_order(self):
+        resources = make_resources(40)
+        # the first chunks take the longest
+        client = StubClient(resources, delay=lambda ids: 0.002 * (40 - int(ids[0][-3:])))
+        writer = RecordingWriter()
+        server_config = {"name": "vc1", "concurrency": 4}
+        with mock.patch.object(metric_collection, "get_vrops_connection", return_value=client), \
+                ThreadPoolExecutor(max_workers=4) as executor:
+            count = metric_collection.process_configuration(make_collection(batchSize=3, pageSize=7),
+                                                            server_config, executor, writer, 0)
+        self.assertEqual(count, 40)
+        self.assertEqual(writer.collections[0], [resource["identifier"] for resource in resources])
+        self.assertEqual(client.calls.count("get_resources"), 6)
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class BulkStatsFallbackTest(unittest.TestCase):
+    """Only a bulk query the server does not support is replaced by one query per resource"""
+
+    def collect(self, error):
+        resources = make_resources(10)
+        client = StubClient(resources, errors={"query_latest_stats_of_resources": error})
+        with contextlib.redirect_stdout(io.StringIO()):
+            outdata = metric_collection.get_chunk_data(client, resources, ["cpu|usage_average"], ["config|name"], 1)
+        return client.calls, outdata
+
+    def test_unsupported_query_falls_back_to_one_query_per_resource(self):
+        for status in (400, 404, 405):
+            calls, outdata = self.collect(nagini.ClientSideException(status, "Not Found"))
+            self.assertEqual(calls.count("get_latest_stats"), 10)
+            self.assertEqual(outdata[0]["stats"], {"cpu|usage_average": 6.0})
+
+    def test_failing_server_gets_no_more_calls(self):
+        for error in (nagini.ServerSideException(503, "Service Unavailable"),
+                      nagini.ClientSideException(429, "Too Many Requests"),
+                      nagini.AuthException(401, "Unauthorized"),
+                      nagini.NaginiException(ConnectionError("connection reset"))):
+            calls, outdata = self.collect(error)
+            self.assertEqual(calls, ["query_latest_stats_of_resources", "query_latest_properties_of_resources"])
+            # the resources are kept, without stats
+            self.assertEqual([item["stats"] for item in outdata], [{}] * 10)
+            self.assertEqual(outdata[0]["properties"], {"config|name": "vm-000"})
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class BulkPropertiesFallbackTest(unittest.TestCase):
+    """Only a bulk property query the server does not support is replaced by one query per resource"""
+
+    def collect(self, error):
+        resources = make_resources(10)
+        client = StubClient(resources, errors={"query_latest_properties_of_resources": error})
+        with contextlib.redirect_stdout(io.StringIO()):
+            outdata = metric_collection.get_chunk_data(client, resources, ["cpu|usage_average"], ["config|name"], 1)
+        return client.calls, outdata
+
+    def test_unsupported_query_falls_back_to_one_query_per_resource(self):
+        calls, outdata = self.collect(nagini.ClientSideException(405, "Method Not Allowed"))
+        self.assertEqual(calls.count("get_resource_properties"), 10)
+        self.assertEqual(outdata[3]["properties"], {"config|name": "vm-003"})
+
+    def test_failing_server_gets_no_more_calls(self):
+        for error in (nagini.ServerSideException(500, "Internal Server Error"),
+                      nagini.ClientSideException(429, "Too Many Requests"),
+                      nagini.NaginiException(ConnectionError("connection reset"))):
+            calls, outdata = self.collect(error)
+            self.assertEqual(calls, ["query_latest_stats_of_resources", "query_latest_properties_of_resources"])
+            self.assertEqual([item["properties"] for item in outdata], [{}] * 10)
+            self.assertEqual(outdata[0]["stats"], {"cpu|usage_average": 6.0})
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class CollectionOrderTest(unittest.TestCase):
+    """The output holds the collections in config order, whichever server or collection finishes first"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def test_collections_finishing_out_of_order(self):
+        inventories = {"vc1": make_resources(12, "vc1"), "vc2": make_resources(5, "vc2")}
+        # vc1 answers slower, and its first collection slower than its second
+        delays = {"vc1-000": 0.02, "vc1-001": 0.02, "vc2-000": 0.0}
+        clients = {name: StubClient(resources, delay=lambda ids: delays.get(ids[0], 0.005))
+                   for name, resources in inventories.items()}
+        collections = [make_collection("vc1", batchSize=2), make_collection("vc2"),
+                       make_collection("vc1", resourceKind="HostSystem"), make_collection("vc2", batchSize=1)]
+        servers = {name: {"name": name, "concurrency": 3} for name in inventories}
+
+        for output_format in ("json", "ndjson"):
+            with self.subTest(output_format=output_format):
+                fullpath = get_output_path(self.workdir, output_format)
+                writer = open_writer(fullpath, output_format)
+                with mock.patch.object(metric_collection, "get_vrops_connection",
+                                       side_effect=lambda server_config, token_cache=None:
+                                       clients[server_config["name"]]):
+                    counts = metric_collection.run_collections(collections, servers, [None] * len(collections),
+                                                               writer)
+                writer.close()
+
+                self.assertEqual(counts, [12, 5, 12, 5])
+                results = load_metric_data(fullpath)
+                self.assertEqual([(result["server"], result["resourceKind"]) for result in results],
+                                 [(collection["serverId"], collection["resourceKind"]) for collection in collections])
+                for collection, result in zip(collections, results):
+                    self.assertEqual([item["identifier"] for item in result["allstats"]],
+                                     [resource["identifier"] for resource in inventories[collection["serverId"]]])
+
+
+class StubNagini:
+    """Stands in for nagini.Nagini in get_vrops_connection, remembers the token it was given"""
+    def __init__(self, host, user_pass, **kwargs):
+        self.host = host
+        self.user_pass = user_pass
+        self.kwargs = kwargs
+        self.instrumentation = kwargs.get("instrumentation")
+        self.token = {"token": "", "validity": None}
+        self.closed = False
+
+    def set_acquired_token(self, token, validity=None):
+        self.token = {"token": token, "validity": validity}
+
+    def get_acquired_token(self):
+        return self.token
+
+    def close(self):
+        self.closed = True
+
+
+@unittest.skipIf(metric_collection is None, "metric-collection.py cannot be imported: %s" % import_error)
+class SharedConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.patch = mock.patch.object(metric_collection.nagini, "Nagini", StubNagini)
+        self.patch.start()
+        metric_collection._connections.clear()
+
+    def tearDown(self):
+        metric_collection._connections.clear()
+        self.patch.stop()
+        shutil.rmtree(self.workdir)
+
+    def server(self, name="vc1", userid="admin"):
+        return {"name": name, "userid": userid, "password": "c2VjcmV0"}
+
+    def cached_token(self, userid="admin", valid_for=3600 * 1000):
+        return {"vc1": {"userid": userid, "token": "cached-token", "validity": int(time.time() * 1000) + valid_for}}
+
+    def test_one_client_per_server(self):
+        first = metric_collection.get_vrops_connection(self.server())
+        self.assertIs(metric_collection.get_vrops_connection(self.server()), first)
+        self.assertIsNot(metric_collection.get_vrops_connection(self.server("vc2")), first)
+        self.assertEqual(first.user_pass, ("admin", "secret"))
+
+    def test_cached_token_is_reused(self):
+        vrops = metric_collection.get_vrops_connection(self.server(), self.cached_token())
+        self.assertEqual(vrops.token["token"], "cached-token")
+
+    def test_cached_token_of_another_user_is_not_reused(self):
+        vrops = metric_collection.get_vrops_connection(self.server(), self.cached_token(userid="other"))
+        self.assertEqual(vrops.token["token"], "")
+
+    def test_cached_token_expiring_within_the_margin_is_not_reused(self):
+        token_cache = self.cached_token(valid_for=metric_collection.TOKEN_EXPIRY_MARGIN - 1000)
+        vrops = metric_collection.get_vrops_connection(self.server(), token_cache)
+        self.assertEqual(vrops.token["token"], "")
+
+    def test_tokens_are_saved_readable_by_the_owner_only(self):
+        vrops = metric_collection.get_vrops_connection(self.server())
+        vrops.set_acquired_token("new-token", 12345)
+        token_cache = metric_collection.close_vrops_connections({})
+        self.assertTrue(vrops.closed)
+        self.assertEqual(token_cache, {"vc1": {"userid": "admin", "token": "new-token", "validity": 12345}})
+
+        fullpath = os.path.join(self.workdir, "token-cache.json")
+        with open(fullpath, "w") as outfile:
+            outfile.write("{}")
+        os.chmod(fullpath, 0o644)
+        metric_collection.save_token_cache(fullpath, token_cache)
+        self.assertEqual(stat.S_IMODE(os.stat(fullpath).st_mode), 0o600)
+        with open(fullpath) as data_file:
+            self.assertEqual(json.load(data_file), token_cache)
+
+
+if __name__ == "__main__":
+    unittest.main()
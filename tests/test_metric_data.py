@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from metric_data import OUTPUT_FILES, TimeSeries, WriterGroup, get_output_path, load_metric_data, open_writer
+
+
+def make_resource(index, sampleno):
+    stats = {}
+    for key in ("cpu|usage_average", "mem|usage_average"):
+        if sampleno == 1:
+            stats[key] = float(index)
+        else:
+            stats[key] = [{"value": float(index + i), "timestamp": 1000 * i} for i in range(sampleno)]
+    return {"identifier": "id-%d" % index, "name": "vm-%d" % index, "stats": stats,
+            "properties": {"config|name": "vm-%d" % index, "summary|guest|fullName": "Linux"}}
+
+
+def plain(collections):
+    """collections with their series as lists of dicts, the way metric-data.json holds them"""
+    result = []
+    for collection in collections:
+        collection = dict(collection, allstats=[dict(item) for item in collection["allstats"]])
+        for item in collection["allstats"]:
+            item["stats"] = {key: list(value) if isinstance(value, TimeSeries) else value
+                             for key, value in item["stats"].items()}
+        result.append(collection)
+    return result
+
+
+class WriterRoundTripTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.metas = [
+            {"resourceKind": "VirtualMachine", "adapterKind": "VMWARE", "sampleno": 3, "server": "vc1",
+             "metricKeys": ["cpu|usage_average", "mem|usage_average"]},
+            {"resourceKind": "HostSystem", "adapterKind": "VMWARE", "sampleno": 1, "server": "vc1",
+             "metricKeys": ["cpu|usage_average", "mem|usage_average"]},
+            {"resourceKind": "Datastore", "adapterKind": "VMWARE", "sampleno": 2, "server": "vc2",
+             "metricKeys": []},
+        ]
+        self.resources = [[make_resource(i, 3) for i in range(5)], [make_resource(i, 1) for i in range(4)], []]
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write(self, output_format):
+        fullpath = get_output_path(self.workdir, output_format)
+        writer = open_writer(fullpath, output_format)
+        for index, meta in enumerate(self.metas):
+            writer.begin_collection(index, meta)
+        # collections are written from their own threads, their chunks interleave
+        for start in range(0, 5, 2):
+            for index in reversed(range(len(self.metas))):
+                if self.resources[index][start:start + 2]:
+                    writer.write_resources(index, self.resources[index][start:start + 2])
+        for index in range(len(self.metas)):
+            writer.end_collection(index, {"timestamp": "2026-01-01 00:00:00"})
+        writer.close()
+        return fullpath
+
+    def expected(self):
+        return [{"allstats": resources, **meta, "timestamp": "2026-01-01 00:00:00"}
+                for meta, resources in zip(self.metas, self.resources)]
+
+    def test_formats_load_the_same_data(self):
+        for output_format in OUTPUT_FILES:
+            with self.subTest(output_format=output_format):
+                fullpath = self.write(output_format)
+                self.assertEqual(plain(load_metric_data(fullpath)), self.expected())
+
+    def test_lazy_loading_matches_eager_loading(self):
+        for output_format in OUTPUT_FILES:
+            with self.subTest(output_format=output_format):
+                fullpath = self.write(output_format)
+                collections = load_metric_data(fullpath, lazy=True)
+                self.assertEqual([collection["resourceKind"] for collection in collections],
+                                 [meta["resourceKind"] for meta in self.metas])
+                # only the collection used is parsed
+                self.assertEqual(len(collections[1]["allstats"]), 4)
+                self.assertFalse(getattr(collections[0], "loaded", False))
+                self.assertEqual(plain(collections), self.expected())
+
+    def test_columnar_series(self):
+        collections = load_metric_data(self.write("columnar"))
+        series = collections[0]["allstats"][2]["stats"]["cpu|usage_average"]
+        self.assertIsInstance(series, TimeSeries)
+        self.assertEqual(series.latest(), 4.0)
+        self.assertEqual(series[-1], {"value": 4.0, "timestamp": 2000})
+        self.assertFalse(os.path.exists(get_output_path(self.workdir, "columnar") + ".tmp"))
+
+    def test_writer_group(self):
+        json_path = get_output_path(self.workdir, "json")
+        ndjson_path = get_output_path(self.workdir, "ndjson")
+        writer = WriterGroup([open_writer(json_path, "json"), open_writer(ndjson_path, "ndjson")])
+        writer.begin_collection(0, self.metas[1])
+        writer.write_resources(0, self.resources[1])
+        writer.end_collection(0, {"timestamp": "2026-01-01 00:00:00"})
+        writer.close()
+        self.assertEqual(load_metric_data(json_path), load_metric_data(ndjson_path))
+
+
+if __name__ == "__main__":
+    unittest.main()
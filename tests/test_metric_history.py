@@ -0,0 +1,55 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from metric_history import MetricHistoryStore
+
+
+class MetricHistoryStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.store = MetricHistoryStore(os.path.join(self.workdir, "history.db"))
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree(self.workdir)
+
+    def collect(self, index, server, resources):
+        meta = {"server": server, "resourceKind": "VirtualMachine"}
+        self.store.begin_collection(index, meta)
+        self.store.write_resources(index, resources)
+        self.store.end_collection(index, meta)
+
+    def test_single_samples_keep_their_timestamps(self):
+        self.collect(0, "vc1", [{"identifier": "a", "name": "vm", "stats": {"cpu|usage_average": 10.0},
+                                 "statTimestamps": {"cpu|usage_average": 1000}}])
+        self.assertEqual(self.store.get_series("vc1", "a", "cpu|usage_average"), [(1000, 10.0)])
+
+    def test_non_numeric_values_are_skipped(self):
+        self.collect(0, "vc1", [{"identifier": "a", "name": "vm", "stats": {
+            "none": None,
+            "text": "12",
+            "flag": True,
+            "series": [{"timestamp": 1, "value": 1.0}, {"timestamp": 2, "value": None},
+                       {"timestamp": 3, "value": "x"}],
+        }}])
+        for key in ("none", "text", "flag"):
+            self.assertEqual(self.store.get_series("vc1", "a", key), [])
+        self.assertEqual(self.store.get_series("vc1", "a", "series"), [(1, 1.0)])
+
+    def test_same_names_on_two_servers_are_kept_apart(self):
+        self.collect(0, "vc1", [{"identifier": "a", "name": "vm", "stats": {"cpu": 1.0}, "statTimestamps": {"cpu": 5}}])
+        self.collect(1, "vc2", [{"identifier": "b", "name": "vm", "stats": {"cpu": 2.0}, "statTimestamps": {"cpu": 5}}])
+        self.assertEqual(self.store.get_range("VirtualMachine", "cpu"), {"a": [(5, 1.0)], "b": [(5, 2.0)]})
+        self.assertEqual(self.store.get_range("VirtualMachine", "cpu", name="vm").keys(), {"a", "b"})
+        self.assertEqual(self.store.get_latest("VirtualMachine", "cpu"), {"a": (5, 1.0), "b": (5, 2.0)})
+        self.assertEqual(self.store.get_resources("VirtualMachine"), {"a": ("vc1", "vm"), "b": ("vc2", "vm")})
+
+
+if __name__ == "__main__":
+    unittest.main()
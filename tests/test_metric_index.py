@@ -0,0 +1,191 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from metric_index import (MISSING, IndexSnapshot, Compare, Name, Range, ResourceTable, compile_filters,
+                          get_snapshot_path)
+
+
+def check_filters(item, filters):
+    """The per-resource filter check of the report before compile_filters, the reference for its results"""
+    for key, value in filters.items():
+        if key == 'name' and item.get('name') != value:
+            return False
+        if key in item.get('stats', {}):
+            stat_value = item['stats'][key]
+            if isinstance(value, str):
+                operator = ''.join(c for c in value if not c.isdigit() and c != '.')
+                threshold = float(''.join(c for c in value if c.isdigit() or c == '.'))
+                if operator == '>':
+                    if not stat_value > threshold:
+                        return False
+                elif operator == '>=':
+                    if not stat_value >= threshold:
+                        return False
+                elif operator == '<':
+                    if not stat_value < threshold:
+                        return False
+                elif operator == '<=':
+                    if not stat_value <= threshold:
+                        return False
+                elif operator == '==':
+                    if not stat_value == threshold:
+                        return False
+            else:
+                if stat_value != value:
+                    return False
+        if key in item.get('properties', {}) and item['properties'][key] != value:
+            return False
+    return True
+
+
+def outcome(function):
+    try:
+        return function()
+    except ValueError as e:
+        return type(e)
+
+
+STAT_KEYS = ['a', 'b', 'c']
+PROPERTY_KEYS = ['a', 'p', 'q']
+VALUES = ['>50', '<=30', '>=10.5', '<50', '==50', '50', 'x', 'abc', 5, 50, None, True, 'y']
+
+
+def make_items(rnd, count):
+    items = []
+    for i in range(count):
+        stats = {key: rnd.choice([rnd.randint(0, 100), rnd.random() * 100, 50])
+                 for key in STAT_KEYS if rnd.random() < 0.7}
+        properties = {key: rnd.choice(['x', 'y', None, True, 5]) for key in PROPERTY_KEYS if rnd.random() < 0.7}
+        items.append({'identifier': 'id%d' % i, 'name': rnd.choice(['n1', 'n2', 'v%d' % i]), 'stats': stats,
+                      'properties': properties})
+    return items
+
+
+class CompileFiltersTest(unittest.TestCase):
+
+    def test_same_rows_as_the_per_resource_check(self):
+        rnd = random.Random(1)
+        for _ in range(200):
+            items = make_items(rnd, rnd.randint(0, 30))
+            table = ResourceTable(items)
+            for _ in range(10):
+                filters = {}
+                for _ in range(rnd.randint(1, 3)):
+                    key = rnd.choice(STAT_KEYS + PROPERTY_KEYS + ['name', 'zz'])
+                    filters[key] = rnd.choice(VALUES + ['n1', 'n2'])
+                expected = outcome(lambda: [row for row, item in enumerate(items) if check_filters(item, filters)])
+                self.assertEqual(outcome(lambda: table.select(compile_filters(filters))), expected, filters)
+
+    def test_predicates(self):
+        items = [{'identifier': 'id%d' % i, 'name': 'vm-%d' % (i % 3), 'stats': {'cpu': float(i)}, 'properties': {}}
+                 for i in range(10)]
+        items.append({'identifier': 'series', 'name': 'vm-0', 'stats': {'cpu': [{'value': 1.0, 'timestamp': 0}]},
+                      'properties': {}})
+        table = ResourceTable(items)
+        self.assertEqual(table.select(Range('cpu', 2, 4)), [2, 3, 4])
+        self.assertEqual(table.select(Compare('cpu', '>', 7) & Name('vm-2')), [8])
+        self.assertEqual(table.select(Name('vm-0') & ~Compare('cpu', '>', 1)), [0, 10])
+        self.assertEqual(table.select(Compare('cpu', '<', 1) | Compare('cpu', '>=', 9)), [0, 9])
+
+
+class ResourceTableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.items = [
+            {'identifier': 'id0', 'name': 'vm-a', 'stats': {'cpu': 10.0, 'mem': 1.0}, 'properties': {'os': 'Linux'}},
+            {'identifier': 'id1', 'name': 'vm-b', 'stats': {'cpu': 20.0}, 'properties': {'os': None}},
+            {'identifier': 'id2', 'name': 'vm-a', 'stats': {'cpu': 30.0, 'mem': 3.0}, 'properties': {}},
+        ]
+        self.table = ResourceTable(self.items)
+
+    def test_columns_stay_aligned_with_the_rows(self):
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(self.table.column('stats', 'mem'), [1.0, MISSING, 3.0])
+        self.assertEqual(self.table.column('properties', 'os'), ['Linux', None, MISSING])
+        self.assertIsNone(self.table.column('stats', 'disk'))
+        self.assertEqual([self.table.item(row) for row in range(3)], self.items)
+
+    def test_values(self):
+        self.assertEqual(self.table.values('stats', 'cpu'), [10.0, 20.0, 30.0])
+        self.assertEqual(self.table.values('stats', 'mem'), [1.0, 3.0])
+        self.assertEqual(self.table.values('stats', 'mem', rows=[1, 2]), [3.0])
+        # a null property is a value
+        self.assertEqual(self.table.values('properties', 'os'), ['Linux', None])
+        self.assertEqual(self.table.values('stats', 'disk'), [])
+        # the column itself is not handed out
+        self.table.values('stats', 'cpu').append(40.0)
+        self.assertEqual(self.table.column('stats', 'cpu'), [10.0, 20.0, 30.0])
+
+    def test_lookups(self):
+        self.assertEqual(self.table.find_rows('vm-a'), [0, 2])
+        self.assertEqual(self.table.find_rows('vm-c'), [])
+        self.assertEqual(self.table.find_row('id1'), 1)
+        self.assertIsNone(self.table.find_row('id9'))
+
+
+class IndexSnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.workdir, 'metric-data.json')
+        self.items = make_items(random.Random(2), 20)
+        self.write_source(self.items)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def write_source(self, items):
+        with open(self.source, 'w') as outfile:
+            json.dump([{'resourceKind': 'VirtualMachine', 'allstats': items}], outfile)
+
+    def save(self, **kwargs):
+        snapshot = IndexSnapshot(self.source, **kwargs)
+        snapshot.store('VirtualMachine', ResourceTable(self.items))
+        snapshot.save()
+        snapshot.close()
+
+    def load(self, **kwargs):
+        snapshot = IndexSnapshot(self.source, **kwargs)
+        try:
+            return snapshot.load('VirtualMachine')
+        finally:
+            snapshot.close()
+
+    def test_table_is_read_back(self):
+        self.save()
+        table = self.load()
+        self.assertIsNotNone(table)
+        self.assertEqual([table.item(row) for row in range(len(table))], self.items)
+        self.assertEqual(table.select(compile_filters({'a': '>50'})),
+                         ResourceTable(self.items).select(compile_filters({'a': '>50'})))
+
+    def test_rebuilt_after_the_data_file_changes(self):
+        self.save()
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(self.load())
+
+        self.save()
+        self.assertIsNotNone(self.load())
+        mtime = os.stat(self.source).st_mtime_ns
+        self.write_source(self.items[:5])
+        os.utime(self.source, ns=(mtime, mtime))
+        self.assertIsNone(self.load())
+
+    def test_rebuild_and_corrupt_snapshots_are_ignored(self):
+        self.save()
+        self.assertIsNone(self.load(rebuild=True))
+        with open(get_snapshot_path(self.source), 'r+b') as outfile:
+            outfile.write(b'garbage!')
+        self.assertIsNone(self.load())
+
+
+if __name__ == '__main__':
+    unittest.main()
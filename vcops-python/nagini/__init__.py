@@ -1 +1,3 @@
 from .nagini import *
+from .async_nagini import AsyncNagini
+from .response_cache import ResponseCache
@@ -0,0 +1,344 @@
+__author__ = 'VMware'
+
+import asyncio
+import json
+import logging
+import re
+import ssl
+import time
+
+from .nagini import __version__, NaginiException, load_methods_index, _install_method, _method_doc, _prepare_request, _request_headers, \
+    _check_response, _plan_headers, _request_plan, _RequestPlan, _token_expiring, AuthException, PATH_PARAM_REGEX, \
+    _token_refresh_due, NON_JSON_RESPONSE_APIS, TOKEN_REFRESH_MARGIN
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# root logger.
+logger = logging.getLogger(__name__)
+
+
+class AsyncNagini(object):
+    """
+        asyncio client for accessing VMware vRealize Operations Manager REST API. Every method of Nagini generated from
+        methods.json is available as a coroutine (looked up on first use), token handling and exceptions are the same as in Nagini.
+        Requires the aiohttp package. Use it as "async with AsyncNagini(...) as client:" or await close() when done.
+        Unlike Nagini it has no rate limiter (maxConnections is the only bound on requests in flight), does not retry
+        throttled (429/503) or failed calls, and does not use a ResponseCache: every call is sent to the server once and
+        errors are raised to the caller.
+        verify=False: will not verify server certificate, verify='pem file path': will verify server certificate using certificate at file path
+        ignoreHostName=True: ignore host and certificate host name match, ignoreHostName=False: enforce host and certificate host name match
+        maxConnections=100: number of connections kept open to the server, i.e. requests in flight
+        instrumentation=None: RequestStats (or an object with its on_* methods) told about every call and token refresh
+        tokenRefreshMargin=60: seconds before the token's validity ends at which a new one is acquired
+    """
+
+    def __init__(self, host, user_pass=None, refresh_token=None, refresh_token_host=None, api_version='1.70',
+                 verify=False, ignoreHostName=True, useInternalApis=False, enableForwardsCompatibility=False,
+                 proxies=None, generateLinks=False, enableCompression=False, maxConnections=100,
+                 instrumentation=None, tokenRefreshMargin=TOKEN_REFRESH_MARGIN):
+        if aiohttp is None:
+            raise NaginiException("AsyncNagini requires the aiohttp package")
+
+        self._path_regex = PATH_PARAM_REGEX
+        self._api_url_regex = re.compile('https://.+?(?=/)')
+        self._base_url = '%s://%s/suite-api' % ('https', host)
+        self.nonJSONResponseAPIs = set(NON_JSON_RESPONSE_APIS)
+
+        logger.debug("Base url is : %s", self._base_url)
+        self._api_version = api_version
+        self._gen_links = generateLinks
+        self._enable_compression = enableCompression
+        self._acquire_token_in_progress = None
+        self._client_acquired_token = ''
+        self._client_token_validity = None
+        # time.monotonic() of the last failed token renewal, None once one succeeded
+        self._token_refresh_failed_at = None
+        # created on first use, they have to belong to the running event loop
+        self._lock = None
+        self._session = None
+
+        self._verify = verify
+        self._ignore_host_name = ignoreHostName
+        self._max_connections = maxConnections
+        self._proxies = proxies or {}
+        self.instrumentation = instrumentation
+        self._token_refresh_margin = tokenRefreshMargin
+
+        self.headers = {
+            'User-Agent': 'Nagini ' + __version__,
+            'X-vRealizeOps-API-version': api_version,
+            'Accept': 'application/json',
+        }
+
+        if useInternalApis:
+            self.headers['X-vRealizeOps-API-use-unsupported'] = 'yes'
+
+        if enableForwardsCompatibility:
+            self.headers['X-vRealizeOps-API-version-lax'] = 'yes'
+
+        self.user_pass = user_pass
+        self.refresh_token = refresh_token
+        self.refresh_token_host = refresh_token_host
+        self.is_saas = not user_pass and refresh_token is not None and refresh_token_host is not None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _ssl_context(self):
+        if not self._verify:
+            return False
+        context = ssl.create_default_context(cafile=self._verify if isinstance(self._verify, str) else None)
+        context.check_hostname = not self._ignore_host_name
+        return context
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(limit=self._max_connections, ssl=self._ssl_context())
+            self._session = aiohttp.ClientSession(connector=connector, headers=self.headers)
+        return self._session
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def _acquire_token(self, old_token):
+        # this mean that this task is already acquiring token, or that a new one has already been acquired.
+        # other tasks wait on the lock below and pick up the token acquired by the first one.
+        if self._acquire_token_in_progress is asyncio.current_task() or old_token != self._client_acquired_token or \
+                not self.user_pass:
+            return
+
+        async with self._get_lock():
+            if old_token != self._client_acquired_token:
+                return
+            started = time.monotonic()
+            success = False
+            try:
+                self._acquire_token_in_progress = asyncio.current_task()
+                request_body = {'username': self.user_pass[0], 'password': self.user_pass[1]}
+                response = await self.acquire_token(request_body)
+                self._client_token_validity = response.get('validity')
+                self._client_acquired_token = response['token']
+                success = True
+            finally:
+                self._acquire_token_in_progress = None
+                if self.instrumentation is not None:
+                    self.instrumentation.on_token_refresh(time.monotonic() - started, success)
+
+    async def _acquire_token_saas(self, old_token):
+        # this mean that this task is already acquiring token, or that a new one has already been acquired
+        if self._acquire_token_in_progress is asyncio.current_task() or old_token != self._client_acquired_token or \
+                not self.refresh_token or not self.refresh_token_host:
+            return
+
+        headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded'}
+        body = {'api_token': self.refresh_token}
+        async with self._get_lock():
+            if old_token != self._client_acquired_token:
+                return
+            started = time.monotonic()
+            success = False
+            try:
+                self._acquire_token_in_progress = asyncio.current_task()
+                url = '{}://{}/csp/gateway/am/api/auth/api-tokens/authorize'.format('https', self.refresh_token_host)
+                async with aiohttp.ClientSession() as session:
+                    async with session.post(url, headers=headers, data=body,
+                                            proxy=self._proxies.get('https')) as response:
+                        text = await response.text()
+                        if response.status != 200:
+                            raise NaginiException('Failed to authenticate. got response {}. message: {}'.format(
+                                response.status, text))
+                response_obj = json.loads(text)
+                logger.info('authentication successful')
+                if 'expires_in' in response_obj:
+                    self._client_token_validity = int((time.time() + response_obj['expires_in']) * 1000)
+                else:
+                    self._client_token_validity = None
+                self._client_acquired_token = response_obj['access_token']
+                success = True
+            finally:
+                self._acquire_token_in_progress = None
+                if self.instrumentation is not None:
+                    self.instrumentation.on_token_refresh(time.monotonic() - started, success)
+
+    async def _acquire_token_if_necessary(self):
+        if not self._client_acquired_token:
+            if self.is_saas:
+                await self._acquire_token_saas('')
+            else:
+                await self._acquire_token('')
+        elif _token_refresh_due(self._client_token_validity, self._token_refresh_margin,
+                                self._token_refresh_failed_at):
+            old_token = self._client_acquired_token
+            try:
+                await self._reacquire_token(old_token)
+                self._token_refresh_failed_at = None
+            except NaginiException as e:
+                # the current token may still do for a while, it is only given up once it expired. until then
+                # renewing is not tried on every call
+                self._token_refresh_failed_at = time.monotonic()
+                if _token_expiring(self._client_token_validity, 0):
+                    raise e
+                logger.warning('Could not renew the token before it expires: %s', e)
+
+    async def _reacquire_token(self, old_token):
+        if self.is_saas:
+            await self._acquire_token_saas(old_token)
+        else:
+            await self._acquire_token(old_token)
+        return self._client_acquired_token
+
+    async def _rest_request(self, rest_method, params={}, content=None, binary=False):
+        plan = _request_plan(rest_method)
+        templated_url, http_method, encoded_params, data, binary, files, api_url = \
+            _prepare_request(self, plan, params, content, binary)
+
+        return await self._do_safe_request(templated_url, http_method, encoded_params, data, binary, files, api_url,
+                                           plan.is_acquire_token, plan)
+
+    async def do_request(self, url, http_method='GET', params=None, data=None, binary=False, files=None, api_url=None):
+        return await self._do_safe_request(url, http_method, params, data, binary, files, api_url, False)
+
+    async def _do_safe_request(self, url, http_method, params, data, binary, files, api_url, is_acquire_token,
+                               plan=None):
+        if not is_acquire_token:
+            await self._acquire_token_if_necessary()
+            token = self._client_acquired_token
+        else:
+            token = ''
+
+        try:
+            return await self._do_request(url, http_method, params, data, binary, files, api_url, token, plan)
+        except AuthException as e:
+            # only a rejected token is worth a new one, retrying anything else adds load to a struggling server
+            if e.error_code == 401 and not is_acquire_token:
+                new_token = await self._reacquire_token(token)
+                if new_token and new_token != token:
+                    return await self._do_request(url, http_method, params, data, binary, files, api_url, new_token,
+                                                  plan)
+            raise e
+
+    async def _do_request(self, url, http_method, params, data, binary, files, api_url, token, plan=None):
+        sent = time.monotonic()
+        status_code = None
+        body = b''
+        error = None
+        try:
+            # aiohttp merges these into the session headers
+            if plan is not None:
+                headers = _plan_headers(self, plan, binary, token)
+            else:
+                headers = _request_headers(self, {}, binary, api_url, token)
+
+            # aiohttp takes repeated query parameters as a list of pairs
+            query = []
+            for (k, v) in list((params or {}).items()):
+                if isinstance(v, list):
+                    query.extend((k, value) for value in v)
+                else:
+                    query.append((k, '%s' % v))
+
+            if files:
+                form = aiohttp.FormData()
+                for (k, v) in list((data or {}).items()):
+                    form.add_field(k, v)
+                for (k, v) in list(files.items()):
+                    if isinstance(v, tuple):
+                        form.add_field(k, v[1], filename=v[0], content_type=v[2] if len(v) > 2 else None)
+                    else:
+                        form.add_field(k, v)
+                data = form
+
+            async with self._get_session().request(http_method, url, params=query, data=data, headers=headers,
+                                                   proxy=self._proxies.get('https')) as result:
+                status_code = result.status
+                body = await result.read()
+                content_type = result.headers.get('Content-Type')
+                response_obj = None
+                if content_type and "application/json" not in content_type:
+                    response_obj = body
+                else:
+                    try:
+                        response_obj = json.loads(body)
+                    except Exception as e:
+                        pass
+
+                return _check_response(result.status, result.reason, response_obj)
+        except Exception as e:
+            if status_code is None:
+                error = e
+            if isinstance(e, NaginiException):
+                raise e
+            else:
+                raise NaginiException(e)
+        finally:
+            if self.instrumentation is not None:
+                endpoint = '%s %s' % (http_method, plan.api_url if plan is not None else api_url or url)
+                self.instrumentation.on_request(endpoint, url, status_code, time.monotonic() - sent,
+                                                len(data) if isinstance(data, (str, bytes)) else 0, len(body), error)
+
+    async def fetch_links(self, link):
+        """
+            Utility method to fetch contents of a link.
+            :param 'link' Can be either a string or a link object or a collection of both.
+        """
+
+        async def _get_link(l):
+            if isinstance(l, dict):
+                l = l['href']
+            l = l.replace('/suite-api', '')
+            return await self.do_request("%s%s" % (self._base_url, l))
+
+        if isinstance(link, (list, set)):
+            return await asyncio.gather(*map(_get_link, link))
+        else:
+            return await _get_link(link)
+
+    @staticmethod
+    def _make_method(rest_method):
+        plan = _RequestPlan(rest_method)
+
+        async def new_method(self, *args, **kwargs):
+            return await self._rest_request(plan, params=kwargs, content=args)
+
+        new_method.__doc__ = _method_doc(rest_method)
+        new_method.__name__ = str(rest_method['name'])
+        new_method.__dict__['method_info'] = rest_method
+        new_method.__dict__['request_plan'] = plan
+        return new_method
+
+    def __getattr__(self, name):
+        # only called for names not found otherwise: REST methods are installed on the class when first used
+        return _install_method(type(self), name, self._make_method).__get__(self, type(self))
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(load_methods_index()))
+
+    async def close(self):
+        """
+            Dispose the REST client.
+        """
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def get_acquired_token(self):
+        """
+            Token acquired by the client and its validity in epoch milliseconds (None if unknown), e.g. to cache it between runs.
+        """
+        return {'token': self._client_acquired_token, 'validity': self._client_token_validity}
+
+    def set_acquired_token(self, token, validity=None):
+        """
+            Use a token acquired earlier (see get_acquired_token) instead of authenticating again.
+            A new token is still acquired if the server rejects this one.
+        """
+        self._client_acquired_token = token
+        self._client_token_validity = validity
@@ -1,20 +1,41 @@
 __author__ = 'VMware'
 __version__ = '1.70'
 
+import copy
+import hashlib
 import json
 import logging
+import marshal
+import os
+import random
 import re
+import sys
+import time
+from bisect import bisect_left
+from collections import deque
+from email.utils import parsedate_to_datetime
 from io import IOBase
 from pprint import pformat
 
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.poolmanager import PoolManager
-from threading import Lock
+from threading import Condition, Lock, get_ident, local
 
 # root logger.
 logger = logging.getLogger(__name__)
 
+# http status codes telling the client to slow down
+THROTTLE_STATUS_CODES = (429, 503)
+# http status codes (besides throttling) worth retrying an idempotent call for
+TRANSIENT_STATUS_CODES = (502, 504)
+# longest Retry-After honoured, in seconds
+MAX_RETRY_AFTER = 300
+# tokens are renewed this many seconds before the validity reported by the server runs out
+TOKEN_REFRESH_MARGIN = 60
+# after a failed renewal the still valid token is used for this many seconds before renewing is tried again
+TOKEN_REFRESH_RETRY_INTERVAL = 10
+
 
 def pp(obj):
     print(json.dumps(obj, indent=2))
@@ -31,25 +52,84 @@ class IgnoreHostNameHttpAdapter(HTTPAdapter):
     #    return super(IgnoreHostNameHttpAdapter, self).cert_verify(conn, url, verify, cert)
 
 
+def _struct_value(value):
+    if isinstance(value, dict):
+        return Struct.view(value)
+    elif isinstance(value, list):
+        # a real list as before, only its objects are views; they wrap their own members when accessed
+        return [_struct_value(item) for item in value]
+    return value
+
+
 class Struct(object):
+    """
+        Read-only attribute view of a decoded JSON object, e.g. Struct(**response).resourceList[0].identifier.
+        Nested objects are only wrapped when they are accessed, nothing is copied or converted up front.
+        Lists are returned as lists of views. Keys that are no identifiers ("stat-list") can be read with
+        struct['stat-list'].
+    """
+    __slots__ = ('_entries',)
+
     def __init__(self, **entries):
-        def convert_value(value):
-            print("convert_value called with : %s, %s" % (type(value), value))
-            if isinstance(value, dict):
-                print("Current item is dict.")
-                return Struct(**value)
-            elif isinstance(value, list):
-                print("current item is list, calling map to resolve items")
-                if len(value) == 0:
-                    return value
-                else:
-                    return list(map(convert_value, value))
-            else:
-                return value
+        object.__setattr__(self, '_entries', entries)
+
+    @classmethod
+    def view(cls, entries):
+        """
+            View of an existing dict, without the copy made by Struct(**entries).
+        """
+        struct = cls.__new__(cls)
+        object.__setattr__(struct, '_entries', entries)
+        return struct
+
+    def __getattr__(self, name):
+        # also reached for _entries itself while copy/pickle build an instance without calling __init__
+        if name == '_entries':
+            raise AttributeError(name)
+        try:
+            return _struct_value(self._entries[name])
+        except KeyError:
+            raise AttributeError("'Struct' object has no attribute '%s'" % name) from None
 
-        for (k, v) in list(entries.items()):
-            print('evaluating (%s, %s)' % (k, v))
-            setattr(self, k, convert_value(v))
+    def __getitem__(self, key):
+        return _struct_value(self._entries[key])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("'Struct' object is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("'Struct' object is read-only")
+
+    def __reduce__(self):
+        return type(self).view, (self._entries,)
+
+    def __copy__(self):
+        # another view of the same dict
+        return type(self).view(self._entries)
+
+    def __deepcopy__(self, memo):
+        return type(self).view(copy.deepcopy(self._entries, memo))
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __dir__(self):
+        return sorted(set(object.__dir__(self)) | set(k for k in self._entries if isinstance(k, str)))
+
+    def __repr__(self):
+        return 'Struct(%r)' % (self._entries,)
+
+    def to_dict(self):
+        """
+            The viewed dict itself, not a copy.
+        """
+        return self._entries
 
 
 # use 2.7 BaseException, ie .message deprecated
@@ -112,29 +192,488 @@ class AuthException(ClientSideException):
     pass
 
 
+class AdaptiveRateLimiter(object):
+    """
+        Client side limit of the requests in flight, adapted AIMD style to what the server tolerates.
+        Every successful call raises the limit by 1/limit (about one per round trip), a throttled call (429/503)
+        multiplies it by decrease_factor, at most once per round of calls. A Retry-After sent by the server pauses
+        all calls until it passed.
+    """
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=64, decrease_factor=0.5, base_backoff=0.5,
+                 max_backoff=30.0):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self._in_flight = 0
+        self._blocked_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = Condition()
+
+    def acquire(self):
+        """
+            Blocks until a call may be sent, returns its start time to be passed to release.
+        """
+        with self._condition:
+            while True:
+                wait = self._blocked_until - time.monotonic()
+                if wait <= 0 and self._in_flight < int(self.limit):
+                    break
+                self._condition.wait(wait if wait > 0 else None)
+            self._in_flight += 1
+            return time.monotonic()
+
+    def release(self, started, throttled=False, retry_after=None):
+        with self._condition:
+            self._in_flight -= 1
+            if throttled:
+                # calls already in flight when the limit was lowered report the same overload, count it once
+                if started >= self._last_decrease:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease_factor)
+                    self._last_decrease = time.monotonic()
+                    logger.info('Server is throttling, lowering the concurrency limit to %d', int(self.limit))
+                if retry_after:
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + retry_after)
+            else:
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+            self._condition.notify_all()
+
+    def backoff(self, attempt):
+        return _backoff_delay(attempt, self.base_backoff, self.max_backoff)
+
+
+class RequestStats(object):
+    """
+        Instrumentation hook collecting per-endpoint latency histograms, bytes sent and received, retries and token
+        refreshes, and optionally the last recent_calls calls (without bodies) in a ring buffer.
+        Pass it as Nagini(..., instrumentation=RequestStats()); any object with the same on_* methods will do.
+        Endpoints are the method urls with their template params, e.g. 'GET /suite-api/api/resources/{id}/stats/latest'.
+    """
+    # upper bounds of the latency histogram buckets, in seconds
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self, recent_calls=0):
+        self.endpoints = {}
+        self.token_refreshes = 0
+        self.token_refresh_failures = 0
+        self.recent = deque(maxlen=recent_calls) if recent_calls else None
+        self._lock = Lock()
+
+    def _endpoint(self, endpoint):
+        stats = self.endpoints.get(endpoint)
+        if stats is None:
+            stats = self.endpoints[endpoint] = {
+                'calls': 0, 'errors': 0, 'retries': 0, 'cache_hits': 0, 'status': {}, 'bytes_sent': 0,
+                'bytes_received': 0,
+                'total_seconds': 0.0, 'max_seconds': 0.0, 'histogram': [0] * len(self.LATENCY_BUCKETS)
+            }
+        return stats
+
+    def on_request(self, endpoint, url, status_code, elapsed, bytes_sent, bytes_received, error=None):
+        """
+            One call sent to the server. status_code is None when no response came back, error tells why.
+        """
+        with self._lock:
+            stats = self._endpoint(endpoint)
+            stats['calls'] += 1
+            if status_code is None or status_code >= 400:
+                stats['errors'] += 1
+            status = str(status_code) if status_code is not None else 'error'
+            stats['status'][status] = stats['status'].get(status, 0) + 1
+            stats['bytes_sent'] += bytes_sent
+            stats['bytes_received'] += bytes_received
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['histogram'][bisect_left(self.LATENCY_BUCKETS, elapsed)] += 1
+            if self.recent is not None:
+                self.recent.append({'time': time.time(), 'endpoint': endpoint, 'url': url, 'status': status_code,
+                                    'seconds': elapsed, 'bytes_sent': bytes_sent, 'bytes_received': bytes_received,
+                                    'error': str(error) if error is not None else None})
+
+    def on_cache_hit(self, endpoint, url):
+        """
+            One call answered from the response cache, without the server.
+        """
+        with self._lock:
+            self._endpoint(endpoint)['cache_hits'] += 1
+            if self.recent is not None:
+                self.recent.append({'time': time.time(), 'endpoint': endpoint, 'url': url, 'status': None,
+                                    'seconds': 0.0, 'bytes_sent': 0, 'bytes_received': 0, 'error': None,
+                                    'cached': True})
+
+    def on_retry(self, endpoint, delay):
+        with self._lock:
+            self._endpoint(endpoint)['retries'] += 1
+
+    def on_token_refresh(self, elapsed, success):
+        with self._lock:
+            self.token_refreshes += 1
+            if not success:
+                self.token_refresh_failures += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'latency_buckets': [str(bucket) for bucket in self.LATENCY_BUCKETS],
+                'endpoints': {endpoint: dict(stats, status=dict(stats['status']), histogram=list(stats['histogram']))
+                              for endpoint, stats in self.endpoints.items()},
+                'token_refreshes': self.token_refreshes,
+                'token_refresh_failures': self.token_refresh_failures,
+                'recent_calls': list(self.recent) if self.recent is not None else [],
+            }
+
+    def summary(self):
+        """
+            One line per endpoint: calls, errors, retries, cache hits, mean/max latency and bytes.
+        """
+        lines = []
+        with self._lock:
+            for endpoint, stats in sorted(self.endpoints.items()):
+                lines.append('%s: %d calls, %d errors, %d retries, %d cache hits, %.3fs mean, %.3fs max, '
+                             '%d bytes sent, %d received' % (
+                    endpoint, stats['calls'], stats['errors'], stats['retries'], stats['cache_hits'],
+                    stats['total_seconds'] / stats['calls'] if stats['calls'] else 0.0, stats['max_seconds'],
+                    stats['bytes_sent'], stats['bytes_received']))
+            lines.append('token refreshes: %d (%d failed)' % (self.token_refreshes, self.token_refresh_failures))
+        return '\n'.join(lines)
+
+
+def _backoff_delay(attempt, base_backoff=0.5, max_backoff=30.0):
+    """
+        Exponential backoff with full jitter, in seconds, before retry number attempt (counted from 0).
+    """
+    return random.uniform(0, min(max_backoff, base_backoff * (2 ** attempt)))
+
+
+def _parse_retry_after(value):
+    """
+        Retry-After header in seconds, it is either a number of seconds or a http date.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER)
+
+
+METHODS_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)), "methods.json")
+
+_methods_index = None
+_methods_index_lock = Lock()
+
+
+def _methods_cache_path(digest):
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    # marshal data is only readable by the python version that wrote it
+    return os.path.join(cache_home, 'nagini', 'methods-%s-py%d%d.marshal' % ((digest,) + sys.version_info[:2]))
+
+
+def _read_methods_index():
+    try:
+        with open(METHODS_PATH, 'rb') as file:
+            raw = file.read()
+    except Exception as e:
+        logger.error(e)
+        return {}
+
+    cache_path = _methods_cache_path(hashlib.sha256(raw).hexdigest()[:32])
+    try:
+        with open(cache_path, 'rb') as file:
+            return marshal.load(file)
+    except Exception:
+        pass
+
+    try:
+        index = {method['name']: method for method in json.loads(raw.decode('UTF-8'))['methods']}
+    except Exception as e:
+        logger.error(e)
+        return {}
+
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temp_path = '%s.%d.tmp' % (cache_path, os.getpid())
+        with open(temp_path, 'wb') as file:
+            marshal.dump(index, file)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.debug('Could not cache the method table: %s', e)
+    return index
+
+
+def load_methods_index():
+    """
+        Method table of the REST API by method name. methods.json is only parsed when there is no marshalled copy of
+        it in the user cache directory (keyed by the hash of the file), and only once per process.
+    """
+    global _methods_index
+    if _methods_index is None:
+        with _methods_index_lock:
+            if _methods_index is None:
+                _methods_index = _read_methods_index()
+    return _methods_index
+
+
+def load_methods():
+    """
+        Method table of the REST API, as shipped in methods.json next to this module.
+    """
+    return {"methods": list(load_methods_index().values())}
+
+
+def _install_method(cls, name, make_method):
+    """
+        Looks up a REST method by name and installs it on the client class, so it is only built on first use.
+    """
+    rest_method = None if name.startswith('_') else load_methods_index().get(name)
+    if rest_method is None:
+        raise AttributeError("'%s' object has no attribute '%s'" % (cls.__name__, name))
+    method = make_method(rest_method)
+    setattr(cls, name, method)
+    return method
+
+
+def _method_doc(rest_method):
+    doc = "\nDocumentation for: %s %s\n\n%s\n" % (
+        rest_method['http_method'], rest_method['url'], rest_method['doc'])
+    query_params = rest_method.get('query_params', [])
+    template_params = rest_method.get('template_params', [])
+
+    def param_to_string(param):
+        optional = 'optional' if param.get('optional', False) else 'mandatory'
+        return "  :param '%s': (%s) %s" % (param['name'], optional, param['doc'])
+
+    doc += '\n'.join(map(param_to_string, template_params + query_params))
+    return doc
+
+
+# a template parameter in a method url, e.g. {id}
+PATH_PARAM_REGEX = re.compile('\\{([a-zA-Z_]+)\\}')
+# calls whose response is not JSON, so any content type is accepted
+NON_JSON_RESPONSE_APIS = frozenset(['/suite-api/api/reports/{id}/download'])
+
+
+class _RequestPlan(object):
+    """
+        Everything about a REST method that does not depend on the arguments of a call, worked out once when the
+        method is installed: the url split at its template params, the parameter tables and the headers.
+    """
+    __slots__ = ('name', 'http_method', 'client_method', 'url', 'url_parts', 'api_url', 'template_params',
+                 'map_params', 'required_params', 'binary', 'is_acquire_token', 'headers')
+
+    def __init__(self, rest_method):
+        self.name = rest_method.get('name')
+        self.http_method = rest_method['http_method']
+        self.client_method = self.http_method.lower()
+        self.url = rest_method['url']
+        # literals at even, template param names at odd positions: '/resources/{id}/stats' -> ['/resources/', 'id', '/stats']
+        self.url_parts = tuple(PATH_PARAM_REGEX.split(self.url))
+        self.api_url = '/suite-api' + self.url
+        self.template_params = tuple(p['name'] for p in rest_method.get('template_params', []))
+        query_params = rest_method.get('query_params', [])
+        self.map_params = frozenset(p['name'] for p in query_params if p['type'] == 'map')
+        self.required_params = tuple(p['name'] for p in query_params if not p['optional'])
+        # hacking in headers for describeupload until methods.json has headers set
+        self.binary = self.url == "/internal/adapterkinds/describeupload"
+        self.is_acquire_token = self.name == 'acquire_token'
+        # the session headers are merged in by requests/aiohttp, only what differs from them is sent here
+        self.headers = {}
+        if not self.binary:
+            self.headers['content-type'] = 'application/json'
+        if self.api_url in NON_JSON_RESPONSE_APIS:
+            self.headers['Accept'] = '*/*'
+
+
+def _request_plan(rest_method):
+    return rest_method if isinstance(rest_method, _RequestPlan) else _RequestPlan(rest_method)
+
+
+def _encode_params(plan, params):
+    encoded_params = {}
+    for (k, v) in params.items():
+        if isinstance(v, (int, bool, str)):
+            encoded_params[k] = '%s' % v
+        elif isinstance(v, (list, tuple, set)):
+            encoded_params[k] = ['%s' % value for value in v]
+        elif k in plan.map_params:
+            for (subkey, subvalue) in list(v.items()):
+                logger.info("Adding Key %s[%s], Value %s" % (k, subkey, subvalue))
+                encoded_params[k + "[" + subkey + "]"] = subvalue
+        else:
+            encoded_params[k] = v
+    return encoded_params
+
+
+def _prepare_request(client, rest_method, params, content, binary):
+    """
+        Translates a call of a REST method (a _RequestPlan, or its methods.json entry) into url, query params and body.
+        Shared by the blocking and the asyncio clients, returns
+        (templated_url, http_method, encoded_params, data, binary, files, api_url).
+    """
+    plan = _request_plan(rest_method)
+    binary = binary or plan.binary
+    encoded_params = _encode_params(plan, params)
+
+    # fill in and remove the template params
+    url_parts = list(plan.url_parts)
+    try:
+        for i in range(1, len(url_parts), 2):
+            url_parts[i] = str(encoded_params[url_parts[i]])
+    except KeyError as e:
+        raise NaginiException("Missing template parameter: [%s]" % e.args)
+    templated_url = client._base_url + ''.join(url_parts)
+    for template_param in plan.template_params:
+        del encoded_params[template_param]
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Going to call %s with params %s', templated_url, encoded_params)
+
+    for param in plan.required_params:
+        if param not in encoded_params:
+            logger.warning("Warning: %s required, but not provided by user." % param)
+
+    # add _no_links query parameter with a value of true to encoded_params dictionary
+    if not client._gen_links:
+        encoded_params['_no_links'] = 'true'
+
+    if client._enable_compression:
+        encoded_params['compression'] = 'enabled'
+
+    # request body translation
+    data = None
+    files = None
+    if content and content[0]:
+        if isinstance(content[0], IOBase):
+            data = content[0].read()
+        elif isinstance(content[0], dict):
+            if not binary:
+                data = json.dumps(content[0])
+            else:
+                data = content[0].get('data')
+                files = content[0].get('files')
+        elif isinstance(content[0], str):
+            data = content[0]
+        else:
+            raise 'Cannot convert %s to json' % (type(content[0]))
+
+    return templated_url, plan.http_method, encoded_params, data, binary, files, plan.api_url
+
+
+def _auth_header(client, token):
+    if client.is_saas:
+        return 'CSPToken %s' % token
+    return 'vRealizeOpsToken %s' % token
+
+
+def _request_headers(client, headers, binary, api_url, token):
+    if not binary:
+        headers.update({'content-type': 'application/json'})
+
+    if api_url is not None and api_url in client.nonJSONResponseAPIs:
+        headers.update({'Accept': '*/*'})
+
+    if token:
+        headers.update({'Authorization': _auth_header(client, token)})
+    return headers
+
+
+def _plan_headers(client, plan, binary, token):
+    """
+        Headers of a call to a planned method: the plan's prebuilt ones plus the token, without going over the
+        session headers again.
+    """
+    if binary != plan.binary or client.nonJSONResponseAPIs != NON_JSON_RESPONSE_APIS:
+        return _request_headers(client, {}, binary, plan.api_url, token)
+    if not token:
+        return plan.headers
+    headers = plan.headers.copy()
+    headers['Authorization'] = _auth_header(client, token)
+    return headers
+
+
+def _token_expiring(validity, margin):
+    """
+        True when a token valid until validity (epoch milliseconds, None if unknown) expires within margin seconds.
+    """
+    return validity is not None and validity - margin * 1000 <= time.time() * 1000
+
+
+def _token_refresh_due(validity, margin, failed_at):
+    """
+        True when a token valid until validity is to be renewed before the next call: it expires within margin
+        seconds, and it either expired already or the last failed renewal (time.monotonic() of it, None if the last
+        one succeeded) is at least TOKEN_REFRESH_RETRY_INTERVAL seconds ago.
+    """
+    if not _token_expiring(validity, margin):
+        return False
+    return failed_at is None or time.monotonic() - failed_at >= TOKEN_REFRESH_RETRY_INTERVAL or \
+        _token_expiring(validity, 0)
+
+
+def _check_response(status_code, reason, response_obj):
+    """
+        Returns the decoded response of a successful call, raises the matching NaginiHttpException otherwise.
+    """
+    if status_code >= 500:
+        raise ServerSideException(status_code, reason, response_obj)
+    elif 400 <= status_code <= 499:
+        if status_code in [401, 402, 403, 407]:
+            raise AuthException(status_code, reason, response_obj)
+        else:
+            raise ClientSideException(status_code, reason, response_obj)
+    elif 200 <= status_code < 300:
+        return response_obj
+    else:
+        raise NaginiHttpException(status_code, reason, response_obj)
+
+
 class Nagini(object):
     """
         Default Python client for accessing VMware vRealize Operations Manager REST API.
         verify=False: will not verify server certificate, verify='pem file path': will verify server certificate using certificate at file path
         ignoreHostName=True: ignore host and certificate host name match, ignoreHostName=False: enforce host and certificate host name match
+        maxConnections=10: size of the keep-alive connection pool, set it to the number of threads sharing the client
+        rateLimiter=None: AdaptiveRateLimiter shared by the calls of this client, None sends calls as they come
+        maxRetries=3: retries of throttled (429/503) calls, and of idempotent (GET) calls that hit a gateway error or lost the connection
+        instrumentation=None: RequestStats (or an object with its on_* methods) told about every call, cache hit, retry and token refresh
+        tokenRefreshMargin=60: seconds before the token's validity ends at which a new one is acquired
+        responseCache=None: ResponseCache serving read-only calls from disk for a while, None always asks the server
     """
 
     def __init__(self, host, user_pass=None, refresh_token=None, refresh_token_host=None, api_version='1.70',
                  verify=False, ignoreHostName=True, useInternalApis=False, enableForwardsCompatibility=False,
-                 certs=False, proxies=None, generateLinks=False, enableCompression=False):
-        self._add_methods()
-        self._path_regex = re.compile('\{([a-zA-Z_]+)\}')
+                 certs=False, proxies=None, generateLinks=False, enableCompression=False, maxConnections=10,
+                 rateLimiter=None, maxRetries=3, instrumentation=None, tokenRefreshMargin=TOKEN_REFRESH_MARGIN,
+                 responseCache=None):
+        self._path_regex = PATH_PARAM_REGEX
         self._api_url_regex = re.compile('https://.+?(?=/)')
         self._base_url = '%s://%s/suite-api' % ('https', host)
-        self.nonJSONResponseAPIs = set(['/suite-api/api/reports/{id}/download'])
+        self.nonJSONResponseAPIs = set(NON_JSON_RESPONSE_APIS)
 
         logger.debug("Base url is : %s", self._base_url)
         self._api_version = api_version
         self._gen_links = generateLinks
         self._enable_compression = enableCompression
-        self._acquire_token_in_progress = False
+        self._acquire_token_in_progress = None
         self._client_acquired_token = ''
+        # epoch milliseconds, None when the server did not tell
+        self._client_token_validity = None
+        # time.monotonic() of the last failed token renewal, None once one succeeded
+        self._token_refresh_failed_at = None
         self._lock = Lock()
+        self._local = local()
+        self._rate_limiter = rateLimiter
+        self._max_retries = maxRetries
+        self.instrumentation = instrumentation
+        self._token_refresh_margin = tokenRefreshMargin
+        self._response_cache = responseCache
 
         # TODO: proxies are ignored for now.
         self._certs = certs
@@ -149,7 +688,9 @@ class Nagini(object):
 
         # TODO: could be done by Https
         if ignoreHostName:
-            self.client.mount('https://', IgnoreHostNameHttpAdapter())
+            self.client.mount('https://', IgnoreHostNameHttpAdapter(pool_maxsize=maxConnections))
+        else:
+            self.client.mount('https://', HTTPAdapter(pool_maxsize=maxConnections))
 
         if useInternalApis:
             self.client.headers['X-vRealizeOps-API-use-unsupported'] = 'yes'
@@ -163,44 +704,73 @@ class Nagini(object):
         self.refresh_token_host = refresh_token_host
         self.is_saas = not user_pass and refresh_token is not None and refresh_token_host is not None
 
+    @property
+    def previous_api_call(self):
+        # kept per thread, so concurrent callers sharing the client do not overwrite each other
+        return getattr(self._local, 'previous_api_call', None)
+
+    @previous_api_call.setter
+    def previous_api_call(self, value):
+        self._local.previous_api_call = value
+
     def _acquire_token(self, old_token):
-        # this mean that we are already acquiring token, or have already acquired a new one
-        if self._acquire_token_in_progress or old_token != self._client_acquired_token or not self.user_pass:
+        # this mean that this thread is already acquiring token, or that a new one has already been acquired.
+        # other threads wait on the lock below and pick up the token acquired by the first one.
+        if self._acquire_token_in_progress == get_ident() or old_token != self._client_acquired_token or \
+                not self.user_pass:
             return
 
         with self._lock:
             # checking again in case if some other thread somehow passed check above
             if old_token != self._client_acquired_token:
                 return
+            started = time.monotonic()
+            success = False
             try:
-                self._acquire_token_in_progress = True
+                self._acquire_token_in_progress = get_ident()
                 request_body = {'username': self.user_pass[0], 'password': self.user_pass[1]}
                 response = self.acquire_token(request_body)
+                self._client_token_validity = response.get('validity')
                 self._client_acquired_token = response['token']
+                success = True
             finally:
-                self._acquire_token_in_progress = False
+                self._acquire_token_in_progress = None
+                if self.instrumentation is not None:
+                    self.instrumentation.on_token_refresh(time.monotonic() - started, success)
 
 
     def _acquire_token_saas(self, old_token):
-        # this mean that we are already acquiring token, or have already acquired a new one
-        if self._acquire_token_in_progress or old_token != self._client_acquired_token or \
+        # this mean that this thread is already acquiring token, or that a new one has already been acquired
+        if self._acquire_token_in_progress == get_ident() or old_token != self._client_acquired_token or \
                 not self.refresh_token or not self.refresh_token_host:
             return
 
         headers = {'Accept': 'application/json', 'Content-Type': 'application/x-www-form-urlencoded'}
         body = {'api_token': self.refresh_token}
         with self._lock:
+            if old_token != self._client_acquired_token:
+                return
+            started = time.monotonic()
+            success = False
             try:
-                self._acquire_token_in_progress = True
+                self._acquire_token_in_progress = get_ident()
                 response = requests.post('{}://{}/csp/gateway/am/api/auth/api-tokens/authorize'.format('https', self.refresh_token_host),
                                  headers=headers, data=body)
                 if response.status_code != 200:
                     raise NaginiException('Failed to authenticate. got response {}. message: {}'.format(response.status_code, response.text))
-                token = json.loads(response.text)['access_token']
+                response_obj = json.loads(response.text)
+                token = response_obj['access_token']
                 print('authentication successful')
+                if 'expires_in' in response_obj:
+                    self._client_token_validity = int((time.time() + response_obj['expires_in']) * 1000)
+                else:
+                    self._client_token_validity = None
                 self._client_acquired_token = token
+                success = True
             finally:
-                self._acquire_token_in_progress = False
+                self._acquire_token_in_progress = None
+                if self.instrumentation is not None:
+                    self.instrumentation.on_token_refresh(time.monotonic() - started, success)
 
     def _acquire_token_if_necessary(self):
         if not self._client_acquired_token:
@@ -208,6 +778,19 @@ class Nagini(object):
                 self._acquire_token_saas('')
             else:
                 self._acquire_token('')
+        elif _token_refresh_due(self._client_token_validity, self._token_refresh_margin,
+                                self._token_refresh_failed_at):
+            old_token = self._client_acquired_token
+            try:
+                self._reacquire_token(old_token)
+                self._token_refresh_failed_at = None
+            except NaginiException as e:
+                # the current token may still do for a while, it is only given up once it expired. until then
+                # renewing is not tried on every call, which would add an auth call to each of them
+                self._token_refresh_failed_at = time.monotonic()
+                if _token_expiring(self._client_token_validity, 0):
+                    raise e
+                logger.warning('Could not renew the token before it expires: %s', e)
 
     def _reacquire_token(self, old_token):
         if self.is_saas:
@@ -217,89 +800,41 @@ class Nagini(object):
         return self._client_acquired_token
 
     def _rest_request(self, rest_method, params={}, content=None, binary=False):
-        # hacking in headers for describeupload until methods.json has headers set
-        if rest_method.get('url') == "/internal/adapterkinds/describeupload":
-            logger.debug('Assuming content-type != json')
-            binary = True
-
-        map_params = []
-        for param in [p['name'] for p in rest_method['query_params'] if p['type'] == 'map']:
-            map_params.append(param)
-
-        encoded_params = {}
-        for (k, v) in list(params.items()):
-            logger.debug('Received %s => %s as param', k, v)
-            if isinstance(v, (int, bool, str)):
-                encoded_params[k] = '%s' % v
-            elif isinstance(v, (list, tuple, set)):
-                encoded_params[k] = ['%s' % value for value in v]
-            elif k in map_params:
-                for (subkey, subvalue) in list(v.items()):
-                    logger.info("Adding Key %s[%s], Value %s" % (k, subkey, subvalue))
-                    encoded_params[k + "[" + subkey + "]"] = subvalue
-            else:
-                encoded_params[k] = v
-
-        # find and replace params.
-        raw_url = '%s%s' % (self._base_url, rest_method['url'])
-        try:
-            templated_url = self._path_regex.sub(lambda m: str(encoded_params[m.group(1)]), raw_url)
-            logger.debug('Going to call %s' % templated_url)
-        except KeyError as e:
-            raise NaginiException("Missing template parameter: [%s]" % e.args)
-            return None
-
-        try:
-            api_url = self._api_url_regex.sub(lambda m: "", raw_url)
-            logger.debug('API URL is %s' % api_url)
-        except KeyError as e:
-            pass
-
-        # remove all template params from the final param map.
-        for template_param in rest_method['template_params']:
-            del encoded_params[template_param['name']]
-
-        for param in [p['name'] for p in rest_method['query_params'] if not p['optional']]:
-            if param not in encoded_params:
-                logger.warning("Warning: %s required, but not provided by user." % param)
-
-        # add _no_links query parameter with a value of true to encoded_params dictionary
-        if not self._gen_links:
-            encoded_params['_no_links'] = 'true'
+        plan = _request_plan(rest_method)
+        templated_url, http_method, encoded_params, data, binary, files, api_url = \
+            _prepare_request(self, plan, params, content, binary)
 
-        if self._enable_compression:
-            encoded_params['compression'] = 'enabled'
-
-        client_method = getattr(self.client, rest_method['http_method'].lower())
+        client_method = getattr(self.client, plan.client_method)
         if not client_method:
-            raise "Method %s is not supported" % rest_method['http_method']
-
-        # request body translation
-        data = None
-        files = None
-        if content and content[0]:
-            if isinstance(content[0], IOBase):
-                data = content[0].read()
-            elif isinstance(content[0], dict):
-                if not binary:
-                    data = json.dumps(content[0])
-                else:
-                    data = content[0].get('data')
-                    files = content[0].get('files')
-            elif isinstance(content[0], str):
-                data = content[0]
-            else:
-                raise 'Cannot convert %s to json' % (type(content[0]))
-        logger.debug('body has been passed to this api %s', data)
+            raise "Method %s is not supported" % plan.http_method
+
+        cached = None
+        if self._response_cache is not None and not plan.is_acquire_token:
+            cached = self._response_cache.begin_call(self._cache_namespace(), plan.name, plan.http_method,
+                                                     templated_url, encoded_params, data)
+            # a fresh response needs neither the server nor a token
+            if cached is not None and cached.fresh():
+                # instrumentation written before the cache existed may not know about hits
+                on_cache_hit = getattr(self.instrumentation, 'on_cache_hit', None)
+                if on_cache_hit is not None:
+                    on_cache_hit('%s %s' % (plan.http_method, plan.api_url), templated_url)
+                return cached.hit()
 
         return self._do_safe_request(templated_url, client_method, encoded_params, data, binary, files, api_url,
-                                     'name' in rest_method and rest_method['name'] == 'acquire_token')
+                                     plan.is_acquire_token, plan, cached)
+
+    def _cache_namespace(self):
+        # different users may be allowed to see different resources
+        if self.is_saas:
+            return 'csp:%s' % self.refresh_token_host
+        return self.user_pass[0] if self.user_pass else ''
 
     def do_request(self, url, client_method, params=None, data=None, binary=False, files=None, api_url=None, *args,
                    **kwargs):
         return self._do_safe_request(url, client_method, params, data, binary, files, api_url, False)
 
-    def _do_safe_request(self, url, client_method, params, data, binary, files, api_url, is_acquire_token):
+    def _do_safe_request(self, url, client_method, params, data, binary, files, api_url, is_acquire_token, plan=None,
+                         cached=None):
         if not is_acquire_token:
             self._acquire_token_if_necessary()
             token = self._client_acquired_token
@@ -307,14 +842,64 @@ class Nagini(object):
             token = ''
 
         try:
-            return self._do_request(url, client_method, params, data, binary, files, api_url, token)
-        except NaginiException as e:
-            if self._reacquire_token(token):
-                token = self._client_acquired_token
-                return self._do_request(url, client_method, params, data, binary, files, api_url, token)
+            return self._do_request(url, client_method, params, data, binary, files, api_url, token, plan, cached)
+        except AuthException as e:
+            # only a rejected token is worth a new one, retrying anything else adds load to a struggling server
+            if e.error_code == 401 and not is_acquire_token:
+                new_token = self._reacquire_token(token)
+                if new_token and new_token != token:
+                    return self._do_request(url, client_method, params, data, binary, files, api_url, new_token,
+                                            plan, cached)
             raise e
 
-    def _do_request(self, url, client_method, params, data, binary, files, api_url, token):
+    def _do_request(self, url, client_method, params, data, binary, files, api_url, token, plan=None, cached=None):
+        # a throttled call was rejected before being processed, so it is retried whatever its method. after a lost
+        # connection or a gateway error only idempotent calls are retried, anything else might be applied twice
+        idempotent = getattr(client_method, '__name__', '') == 'get'
+        endpoint = None
+        if self.instrumentation is not None:
+            endpoint = '%s %s' % (plan.http_method, plan.api_url) if plan is not None else \
+                '%s %s' % (getattr(client_method, '__name__', '').upper(), api_url or url)
+        attempt = 0
+        while True:
+            started = self._rate_limiter.acquire() if self._rate_limiter else None
+            sent = time.monotonic()
+            throttled = False
+            retry_after = None
+            result = None
+            error = None
+            try:
+                result = self._send_request(url, client_method, params, data, binary, files, api_url, token, plan,
+                                            cached)
+                throttled = result.status_code in THROTTLE_STATUS_CODES
+                if throttled:
+                    retry_after = _parse_retry_after(result.headers.get('Retry-After'))
+            except NaginiException as e:
+                # the connection failed, there is no response to look at
+                error = e
+                if attempt >= self._max_retries or not idempotent:
+                    raise e
+            finally:
+                if self._rate_limiter:
+                    self._rate_limiter.release(started, throttled, retry_after)
+                if self.instrumentation is not None:
+                    self._record_call(endpoint, url, result, time.monotonic() - sent, error)
+
+            if result is not None:
+                retryable = throttled or (idempotent and result.status_code in TRANSIENT_STATUS_CODES)
+                if attempt >= self._max_retries or not retryable:
+                    return self._handle_response(result, cached)
+
+            if retry_after is None:
+                retry_after = self._rate_limiter.backoff(attempt) if self._rate_limiter else _backoff_delay(attempt)
+            logger.info('Retrying %s in %.1f seconds (retry %d of %d)', url, retry_after, attempt + 1,
+                        self._max_retries)
+            if self.instrumentation is not None:
+                self.instrumentation.on_retry(endpoint, retry_after)
+            time.sleep(retry_after)
+            attempt += 1
+
+    def _send_request(self, url, client_method, params, data, binary, files, api_url, token, plan=None, cached=None):
         try:
             self.previous_api_call = {
                 "params": params,
@@ -324,22 +909,45 @@ class Nagini(object):
             # if data:
             #   print(passed content is: %s" % data)
 
-            headers = self.client.headers.copy()
-            if not binary:
-                headers.update({'content-type': 'application/json'})
-
-            if api_url is not None and api_url in self.nonJSONResponseAPIs:
-                headers.update({'Accept': '*/*'})
-
-            if token:
-                if self.is_saas:
-                    headers.update({'Authorization': 'CSPToken %s' % token})
-                else:
-                    headers.update({'Authorization': 'vRealizeOpsToken %s' % token})
+            # requests merges these into the session headers
+            if plan is not None:
+                headers = _plan_headers(self, plan, binary, token)
+            else:
+                headers = _request_headers(self, {}, binary, api_url, token)
+            if cached is not None:
+                # a stale cached response is revalidated: the server answers 304 if it still holds
+                conditional_headers = cached.conditional_headers()
+                if conditional_headers:
+                    headers = dict(headers, **conditional_headers)
 
             result = client_method(url, data=data, params=params, headers=headers, files=files, allow_redirects=True,
                                    verify=self._verify)
-            self.previous_api_call['response'] = result
+            # only the outcome, keeping the response here would pin its body until the next call
+            self.previous_api_call['status_code'] = result.status_code
+            self.previous_api_call['reason'] = result.reason
+            return result
+        except Exception as e:
+            raise NaginiException(e)
+
+    def _record_call(self, endpoint, url, result, elapsed, error):
+        status_code = None
+        bytes_sent = 0
+        bytes_received = 0
+        if result is not None:
+            status_code = result.status_code
+            body = result.request.body
+            bytes_sent = len(body) if body else 0
+            bytes_received = len(result.content)
+        self.instrumentation.on_request(endpoint, url, status_code, elapsed, bytes_sent, bytes_received, error)
+
+    def _handle_response(self, result, cached=None):
+        if cached is not None:
+            if result.status_code == 304 and cached.entry is not None:
+                return cached.not_modified()
+            if 200 <= result.status_code < 300:
+                cached.store(result.headers.get('Content-Type'), result.content, result.headers.get('ETag'),
+                             result.headers.get('Last-Modified'))
+        try:
             response_obj = None
             if "Content-Type" in result.headers and "application/json" not in result.headers["Content-Type"]:
                 response_obj = result.content
@@ -350,17 +958,7 @@ class Nagini(object):
                     # print(e)
                     pass
 
-            if result.status_code >= 500:
-                raise ServerSideException(result.status_code, result.reason, response_obj)
-            elif 400 <= result.status_code <= 499:
-                if result.status_code in [401, 402, 403, 407]:
-                    raise AuthException(result.status_code, result.reason, response_obj)
-                else:
-                    raise ClientSideException(result.status_code, result.reason, response_obj)
-            elif 200 <= result.status_code < 300:
-                return response_obj
-            else:
-                raise NaginiHttpException(result.status_code, result.reason, response_obj)
+            return _check_response(result.status_code, result.reason, response_obj)
         except Exception as e:
             if isinstance(e, NaginiException):
                 raise e
@@ -384,41 +982,22 @@ class Nagini(object):
         else:
             return _get_link(link)
 
-    def _add_methods(self):
-        def load_methods():
-            try:
-                import json, os
-                dir_name = os.path.dirname(os.path.realpath(__file__))
-                file = open(os.path.join(dir_name, "methods.json"),encoding='UTF-8')
-                return json.load(file)
-            except Exception as e:
-                logger.error(e)
-                return {"methods": []}
-
-        def make_method(rest_method):
-            new_method = lambda self, *args, **kwargs: self._rest_request(rest_method, params=kwargs, content=args)
-            doc = "\nDocumentation for: %s %s\n\n%s\n" % (
-                rest_method['http_method'], rest_method['url'], rest_method['doc'])
-            query_params = rest_method.get('query_params', [])
-            template_params = rest_method.get('template_params', [])
-
-            def param_to_string(param):
-                optional = 'optional' if param.get('optional', False) else 'mandatory'
-                return "  :param '%s': (%s) %s" % (param['name'], optional, param['doc'])
-
-            doc += '\n'.join(map(param_to_string, template_params + query_params))
-            new_method.__doc__ = doc
-            new_method.__name__ = str(rest_method['name'])
-            new_method.__dict__['method_info'] = rest_method
-            return new_method
-
-        if not hasattr(self.__class__, "__rest_methods_initialized"):
-            available_apis = load_methods()
-            for method in available_apis['methods']:
-                setattr(self.__class__, method['name'], make_method(method))
-            setattr(self.__class__, "__rest_methods_initialized", True)
-        else:
-            logger.debug('Client already initialized with methods...')
+    @staticmethod
+    def _make_method(rest_method):
+        plan = _RequestPlan(rest_method)
+        new_method = lambda self, *args, **kwargs: self._rest_request(plan, params=kwargs, content=args)
+        new_method.__doc__ = _method_doc(rest_method)
+        new_method.__name__ = str(rest_method['name'])
+        new_method.__dict__['method_info'] = rest_method
+        new_method.__dict__['request_plan'] = plan
+        return new_method
+
+    def __getattr__(self, name):
+        # only called for names not found otherwise: REST methods are installed on the class when first used
+        return _install_method(type(self), name, self._make_method).__get__(self, type(self))
+
+    def __dir__(self):
+        return sorted(set(super().__dir__()) | set(load_methods_index()))
 
     # BEGIN - Composite APIs for resource find/create
     def build_resource_key(self, resourceName, resourceKindKey, adapterKindKey, resourceIdentifiers):
@@ -520,6 +1099,21 @@ class Nagini(object):
         """
         self.client.close()
 
+    def get_acquired_token(self):
+        """
+            Token acquired by the client and its validity in epoch milliseconds (None if unknown), e.g. to cache it between runs.
+        """
+        return {'token': self._client_acquired_token, 'validity': self._client_token_validity}
+
+    def set_acquired_token(self, token, validity=None):
+        """
+            Use a token acquired earlier (see get_acquired_token) instead of authenticating again.
+            A new token is still acquired if the server rejects this one.
+        """
+        with self._lock:
+            self._client_acquired_token = token
+            self._client_token_validity = validity
+
     def set_auth_token(self, token):
         """
             Set auth token for future REST calls. Can be either str or dict with 'token' property.
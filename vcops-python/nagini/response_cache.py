@@ -0,0 +1,233 @@
+__author__ = 'VMware'
+
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+# seconds a response is served from the cache, by REST method name. Only these methods are cached.
+# Paged listings such as get_resources are left out: every page is a call of its own and would be cached on its own,
+# so one listing could be put together from pages of different ages.
+DEFAULT_TTLS = {
+    'get_resource': 3600,
+    'get_resource_properties': 3600,
+    'query_latest_properties_of_resources': 3600,
+}
+
+# POST methods that only read, their responses may be cached (keyed by the request body)
+READ_ONLY_POST_METHODS = frozenset([
+    'query_latest_properties_of_resources',
+    'query_latest_stats_of_resources',
+    'get_stats_for_resources',
+    'query_property_changes_of_resources',
+    'query_alert_definitions',
+    'query_alert',
+    'query_symptoms',
+])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    method TEXT NOT NULL,
+    url TEXT NOT NULL,
+    content_type TEXT,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    expires_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+"""
+
+
+class CachedResponse(object):
+    """
+        A response read from the cache.
+    """
+    __slots__ = ('content_type', 'body', 'etag', 'last_modified', 'expires_at')
+
+    def __init__(self, content_type, body, etag, last_modified, expires_at):
+        self.content_type = content_type
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return self.expires_at > time.time()
+
+    def decode(self):
+        # the same as Nagini._handle_response does with a live response
+        if self.content_type and "application/json" not in self.content_type:
+            return self.body
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+class CachedCall(object):
+    """
+        One call of a cacheable method: its cache key and what the cache holds for it, if anything.
+    """
+    __slots__ = ('cache', 'key', 'method', 'url', 'ttl', 'entry')
+
+    def __init__(self, cache, key, method, url, ttl, entry):
+        self.cache = cache
+        self.key = key
+        self.method = method
+        self.url = url
+        self.ttl = ttl
+        self.entry = entry
+
+    def fresh(self):
+        return self.entry is not None and self.entry.fresh
+
+    def hit(self):
+        self.cache.count('hits')
+        return self.entry.decode()
+
+    def conditional_headers(self):
+        """
+            Headers asking the server to answer 304 if the stale cached response is still current.
+        """
+        headers = {}
+        if self.entry is not None:
+            if self.entry.etag:
+                headers['If-None-Match'] = self.entry.etag
+            if self.entry.last_modified:
+                headers['If-Modified-Since'] = self.entry.last_modified
+        return headers
+
+    def not_modified(self):
+        """
+            The server confirmed the cached response (304), serve it for another ttl.
+        """
+        self.cache.refresh(self.key, self.ttl)
+        self.cache.count('revalidated')
+        return self.entry.decode()
+
+    def store(self, content_type, body, etag=None, last_modified=None):
+        if self.cache.store(self.key, self.method, self.url, content_type, body, etag, last_modified, self.ttl):
+            self.cache.count('stored')
+
+
+class ResponseCache(object):
+    """
+        Opt-in on-disk cache of responses of read-only REST methods, shared by any number of clients and threads:
+        Nagini(..., responseCache=ResponseCache('response-cache.db')).
+        Responses are keyed by method, url, query params and request body, and served for the TTL configured for the
+        method name. After that the server is asked again, conditionally when it sent an ETag or Last-Modified.
+        The least recently used responses are evicted when the bodies exceed max_bytes, a body larger than max_bytes
+        is not stored at all.
+        ttl: {method name: seconds}, DEFAULT_TTLS if None. GET methods, and POST methods in read_only_posts, can be cached.
+    """
+
+    def __init__(self, path, ttl=None, max_bytes=256 * 1024 * 1024, read_only_posts=READ_ONLY_POST_METHODS):
+        self.path = path
+        self.ttl = DEFAULT_TTLS if ttl is None else ttl
+        self.max_bytes = max_bytes
+        self.read_only_posts = read_only_posts
+        self._lock = Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._size = self._conn.execute("SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses").fetchone()[0]
+        self.counts = {'hits': 0, 'revalidated': 0, 'stored': 0, 'evicted': 0, 'too_large': 0}
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counts[name] += n
+
+    def ttl_for(self, method_name, http_method):
+        """
+            Seconds responses of this method are cached, 0 if they are not.
+        """
+        if http_method != 'GET' and method_name not in self.read_only_posts:
+            return 0
+        return self.ttl.get(method_name, 0)
+
+    def begin_call(self, namespace, method_name, http_method, url, params, data):
+        """
+            CachedCall for a call of a cacheable method, None if the method is not cached.
+            namespace separates the responses seen by different users.
+        """
+        ttl = self.ttl_for(method_name, http_method)
+        if not ttl:
+            return None
+        if isinstance(data, bytes):
+            data = data.decode('utf-8', 'replace')
+        key = hashlib.sha256(json.dumps([namespace, http_method, url, params, data], sort_keys=True,
+                                        default=str).encode('utf-8')).hexdigest()
+        return CachedCall(self, key, method_name, url, ttl, self.lookup(key))
+
+    def lookup(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_type, body, etag, last_modified, expires_at FROM responses WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+        return CachedResponse(*row)
+
+    def store(self, key, method, url, content_type, body, etag, last_modified, ttl):
+        """
+            Stores a response, False if its body alone is larger than max_bytes (a stale one of the same key is dropped).
+        """
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                old = self._conn.execute("SELECT LENGTH(body) FROM responses WHERE key = ?", (key,)).fetchone()
+                if len(body) > self.max_bytes:
+                    if old:
+                        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        self._size -= old[0]
+                    self.counts['too_large'] += 1
+                    return False
+                self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (key, method, url, content_type, body, etag, last_modified, now + ttl, now))
+                self._size += len(body) - (old[0] if old else 0)
+                if self._size > self.max_bytes:
+                    self._evict(key)
+        return True
+
+    def _evict(self, keep):
+        # oldest first until the bodies fit again, never the row just stored: it fits by itself
+        for key, size in self._conn.execute(
+                "SELECT key, LENGTH(body) FROM responses WHERE key != ? ORDER BY last_access", (keep,)).fetchall():
+            if self._size <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._size -= size
+            self.counts['evicted'] += 1
+        logger.debug('Response cache evicted down to %d bytes', self._size)
+
+    def refresh(self, key, ttl):
+        now = time.time()
+        with self._lock:
+            with self._conn:
+                self._conn.execute("UPDATE responses SET expires_at = ?, last_access = ? WHERE key = ?",
+                                   (now + ttl, now, key))
+
+    def summary(self):
+        return ('Response cache: %(hits)d hits, %(revalidated)d revalidated, %(stored)d stored, %(evicted)d evicted, '
+                '%(too_large)d too large' % self.counts)
+
+    def clear(self):
+        with self._lock:
+            with self._conn:
+                self._conn.execute("DELETE FROM responses")
+            self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
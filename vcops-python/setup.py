@@ -18,4 +18,5 @@ setup(
     include_package_data=True,
     package_data={"nagini": ["methods.json"]},
     packages=["nagini"],
+    extras_require={"async": ["aiohttp>=3.8"]},
 )
@@ -0,0 +1,82 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(os.path.dirname(ROOT), 'benchmark'))
+
+from nagini.nagini import METHODS_PATH, Nagini, RequestStats
+from nagini.async_nagini import AsyncNagini, aiohttp
+
+
+@unittest.skipIf(aiohttp is None, 'AsyncNagini requires aiohttp')
+@unittest.skipUnless(os.path.exists(METHODS_PATH), 'methods.json is not installed next to nagini.py')
+@unittest.skipIf(shutil.which('openssl') is None, 'the mock server certificate is made with openssl')
+class AsyncNaginiMockTest(unittest.TestCase):
+    """
+        AsyncNagini and Nagini against benchmark/mock_suite_api.py give the same results.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        from collection_benchmark import make_certificate
+        from mock_suite_api import MockSuiteApiServer, SyntheticInventory
+
+        cls.workdir = tempfile.mkdtemp()
+        certfile, keyfile = make_certificate(cls.workdir)
+        cls.inventory = SyntheticInventory(25)
+        cls.server = MockSuiteApiServer(('127.0.0.1', 0), cls.inventory, certfile, keyfile)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.workdir)
+
+    def calls(self):
+        resource_ids = [resource['identifier'] for resource in self.inventory.resources]
+        stat_keys = self.inventory.stat_keys[:2]
+        return [
+            ('get_resources', (), {'resourceKind': 'VirtualMachine', 'adapterKindKey': 'VMWARE', 'page': 1,
+                                   'pageSize': 10}),
+            ('get_latest_stats', (), {'resourceId': resource_ids[3], 'maxSamples': 2, 'statKey': stat_keys,
+                                      'id': resource_ids[3]}),
+            ('get_resource_properties', (), {'resourceId': resource_ids[4], 'id': resource_ids[4]}),
+            ('query_latest_stats_of_resources', ({'resourceId': resource_ids, 'maxSamples': 3,
+                                                  'statKey': stat_keys},), {}),
+            ('get_stats_for_resources', ({'resourceId': resource_ids[:5], 'begin': self.inventory.now - 3600000,
+                                          'statKey': stat_keys},), {}),
+            ('query_latest_properties_of_resources', ({'resourceIds': resource_ids[:5],
+                                                       'propertyKeys': self.inventory.property_keys},), {}),
+        ]
+
+    def threaded_results(self, stats):
+        client = Nagini(self.server.host, user_pass=('admin', 'admin'), verify=False, instrumentation=stats)
+        return [getattr(client, name)(*args, **kwargs) for name, args, kwargs in self.calls()]
+
+    async def async_results(self, stats):
+        async with AsyncNagini(self.server.host, user_pass=('admin', 'admin'), verify=False,
+                               instrumentation=stats) as client:
+            return await asyncio.gather(*[getattr(client, name)(*args, **kwargs)
+                                          for name, args, kwargs in self.calls()])
+
+    def test_same_results_as_nagini(self):
+        threaded_stats = RequestStats()
+        async_stats = RequestStats()
+        expected = self.threaded_results(threaded_stats)
+        results = asyncio.run(self.async_results(async_stats))
+        self.assertEqual(len(results), len(expected))
+        for (name, _, _), result, expected_result in zip(self.calls(), results, expected):
+            self.assertEqual(result, expected_result, name)
+        self.assertTrue(expected[0]['resourceList'])
+        self.assertEqual({endpoint: stats['calls'] for endpoint, stats in async_stats.to_dict()['endpoints'].items()},
+                         {endpoint: stats['calls'] for endpoint, stats in threaded_stats.to_dict()['endpoints'].items()})
+
+
+if __name__ == '__main__':
+    unittest.main()
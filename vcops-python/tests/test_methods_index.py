@@ -0,0 +1,94 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini import nagini
+from nagini.nagini import Nagini
+
+
+def rest_method(name, url):
+    return {'name': name, 'http_method': 'GET', 'url': url, 'doc': 'Looks up %s' % url,
+            'template_params': [], 'query_params': []}
+
+
+class MethodsIndexTest(unittest.TestCase):
+    """load_methods_index parses methods.json once and keeps a marshalled copy in the user cache directory"""
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.methods_path = os.path.join(self.workdir, 'methods.json')
+        self.cache_dir = os.path.join(self.workdir, 'cache')
+        self.write_methods([rest_method('get_resources', '/api/resources')])
+        mock.patch.dict(os.environ, {'XDG_CACHE_HOME': self.cache_dir}).start()
+        mock.patch.object(nagini, 'METHODS_PATH', self.methods_path).start()
+        mock.patch.object(nagini, '_methods_index', None).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def write_methods(self, methods):
+        with open(self.methods_path, 'w') as file:
+            json.dump({'methods': methods}, file)
+
+    def load(self):
+        # what a new process would see
+        nagini._methods_index = None
+        return nagini.load_methods_index()
+
+    def cache_files(self):
+        cache_dir = os.path.join(self.cache_dir, 'nagini')
+        return sorted(os.listdir(cache_dir)) if os.path.isdir(cache_dir) else []
+
+    def test_cache_is_reused(self):
+        index = self.load()
+        self.assertEqual(list(index), ['get_resources'])
+        self.assertEqual(len(self.cache_files()), 1)
+        self.assertIs(nagini.load_methods_index(), index)
+
+        with mock.patch.object(nagini.json, 'loads', side_effect=AssertionError('methods.json parsed again')):
+            self.assertEqual(self.load(), index)
+        self.assertEqual(len(self.cache_files()), 1)
+
+    def test_changed_methods_invalidate_the_cache(self):
+        self.load()
+        self.write_methods([rest_method('get_resources', '/api/resources'),
+                            rest_method('get_adapter_kinds', '/api/adapterkinds')])
+        self.assertEqual(sorted(self.load()), ['get_adapter_kinds', 'get_resources'])
+        self.assertEqual(len(self.cache_files()), 2)
+
+    def test_unreadable_cache_is_rebuilt(self):
+        self.load()
+        cache_path = os.path.join(self.cache_dir, 'nagini', self.cache_files()[0])
+        with open(cache_path, 'wb') as file:
+            file.write(b'not marshal data')
+        self.assertEqual(list(self.load()), ['get_resources'])
+        self.assertEqual(list(self.load()), ['get_resources'])
+
+    def test_methods_are_installed_on_first_use(self):
+        # installed methods stay on the class, keep them off Nagini itself
+        class Client(Nagini):
+            pass
+
+        self.load()
+        client = Client('vrops.example.com', user_pass=('admin', 'secret'))
+        self.assertNotIn('get_resources', Client.__dict__)
+        self.assertIn('get_resources', dir(client))
+        method = client.get_resources
+        self.assertEqual(method.__name__, 'get_resources')
+        self.assertIn('/api/resources', method.__doc__)
+        self.assertIn('get_resources', Client.__dict__)
+
+        with self.assertRaises(AttributeError):
+            client.get_resource_kinds
+        with self.assertRaises(AttributeError):
+            client._get_resources
+        self.assertFalse(hasattr(client, 'get_adapter_kinds'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import AdaptiveRateLimiter, Nagini, NaginiException, RequestStats, ServerSideException
+
+
+class AdaptiveRateLimiterTest(unittest.TestCase):
+
+    def test_success_raises_the_limit_up_to_max(self):
+        limiter = AdaptiveRateLimiter(initial_limit=2, max_limit=3)
+        for _ in range(20):
+            limiter.release(limiter.acquire())
+        self.assertEqual(limiter.limit, 3.0)
+
+    def test_throttle_lowers_the_limit_once_per_round(self):
+        limiter = AdaptiveRateLimiter(initial_limit=8, min_limit=1)
+        started = [limiter.acquire() for _ in range(4)]
+        # every call of the round reports the same overload
+        for start in started:
+            limiter.release(start, throttled=True)
+        self.assertEqual(limiter.limit, 4.0)
+        # a call sent after the decrease counts again
+        limiter.release(limiter.acquire(), throttled=True)
+        self.assertEqual(limiter.limit, 2.0)
+        for _ in range(3):
+            limiter.release(limiter.acquire(), throttled=True)
+        self.assertEqual(limiter.limit, 1.0)
+
+    def test_calls_in_flight_are_bounded(self):
+        limiter = AdaptiveRateLimiter(initial_limit=2, max_limit=2)
+        first = limiter.acquire()
+        limiter.acquire()
+        acquired = threading.Event()
+        waiter = threading.Thread(target=lambda: (limiter.acquire(), acquired.set()))
+        waiter.start()
+        self.assertFalse(acquired.wait(0.1))
+        limiter.release(first)
+        self.assertTrue(acquired.wait(1))
+        waiter.join()
+
+    def test_retry_after_pauses_all_calls(self):
+        limiter = AdaptiveRateLimiter(initial_limit=4)
+        limiter.release(limiter.acquire(), throttled=True, retry_after=0.2)
+        begin = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - begin, 0.15)
+
+
+class FakeResponse(object):
+    def __init__(self, status_code, headers=None, body=b'{}'):
+        self.status_code = status_code
+        self.reason = 'status %d' % status_code
+        self.headers = dict({'Content-Type': 'application/json'}, **(headers or {}))
+        self.content = body
+        self.request = mock.Mock(body=None)
+
+    def json(self):
+        return {} if self.content == b'{}' else {'body': self.content.decode()}
+
+
+def fake_method(name, outcomes):
+    """A requests session method answering with outcomes in turn: a FakeResponse, or an exception to raise"""
+    calls = []
+
+    def method(url, **kwargs):
+        outcome = outcomes[min(len(calls), len(outcomes) - 1)]
+        calls.append(url)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    method.__name__ = name
+    method.calls = calls
+    return method
+
+
+class RetryTest(unittest.TestCase):
+    """Nagini._do_request: which calls are retried, how long it waits and when it gives up"""
+
+    def setUp(self):
+        self.stats = RequestStats()
+        self.client = Nagini('vrops.example.com', user_pass=('admin', 'secret'), maxRetries=2,
+                             instrumentation=self.stats)
+        self.sleep = mock.patch('nagini.nagini.time.sleep').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def request(self, method):
+        return self.client._do_request('https://vrops.example.com/suite-api/api/resources', method, {}, None, False,
+                                       None, '/api/resources', 'token')
+
+    def retries(self):
+        return sum(stats['retries'] for stats in self.stats.to_dict()['endpoints'].values())
+
+    def test_throttled_call_waits_for_retry_after(self):
+        method = fake_method('post', [FakeResponse(429, {'Retry-After': '7'}), FakeResponse(200, body=b'"ok"')])
+        self.assertEqual(self.request(method), {'body': '"ok"'})
+        self.assertEqual(len(method.calls), 2)
+        self.sleep.assert_called_once_with(7.0)
+        self.assertEqual(self.retries(), 1)
+
+    def test_throttled_call_pauses_the_limiter(self):
+        self.client._rate_limiter = limiter = AdaptiveRateLimiter(initial_limit=4)
+        method = fake_method('get', [FakeResponse(503, {'Retry-After': '0.2'}), FakeResponse(200)])
+        self.request(method)
+        self.assertEqual(limiter.limit, 2.0 + 1.0 / 2.0)
+        self.assertGreater(limiter._blocked_until, 0)
+
+    def test_gateway_errors_are_not_retried_for_other_methods_than_get(self):
+        for name in ('post', 'put', 'delete'):
+            method = fake_method(name, [FakeResponse(502), FakeResponse(200)])
+            with self.assertRaises(ServerSideException):
+                self.request(method)
+            self.assertEqual(len(method.calls), 1)
+        method = fake_method('post', [ConnectionError('reset'), FakeResponse(200)])
+        with self.assertRaises(NaginiException):
+            self.request(method)
+        self.assertEqual(len(method.calls), 1)
+        self.sleep.assert_not_called()
+
+    def test_gateway_errors_and_lost_connections_are_retried_for_get(self):
+        method = fake_method('get', [FakeResponse(504), ConnectionError('reset'), FakeResponse(200)])
+        self.assertEqual(self.request(method), {})
+        self.assertEqual(len(method.calls), 3)
+        self.assertEqual(self.retries(), 2)
+
+    def test_retries_give_up_after_max_retries(self):
+        method = fake_method('get', [FakeResponse(503)])
+        with self.assertRaises(ServerSideException) as raised:
+            self.request(method)
+        self.assertEqual(raised.exception.error_code, 503)
+        self.assertEqual(len(method.calls), 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+        method = fake_method('get', [ConnectionError('reset')])
+        with self.assertRaises(NaginiException):
+            self.request(method)
+        self.assertEqual(len(method.calls), 3)
+
+    def test_client_errors_are_not_retried(self):
+        method = fake_method('get', [FakeResponse(404), FakeResponse(200)])
+        with self.assertRaises(NaginiException):
+            self.request(method)
+        self.assertEqual(len(method.calls), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
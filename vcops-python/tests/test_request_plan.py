@@ -0,0 +1,179 @@
+import io
+import json
+import os
+import re
+import sys
+import unittest
+from io import IOBase
+
+from requests.structures import CaseInsensitiveDict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import Nagini, NaginiException, _RequestPlan
+
+GET_STATS = {
+    'name': 'get_stats_of_resource', 'http_method': 'GET', 'url': '/api/resources/{id}/stats', 'doc': '',
+    'template_params': [{'name': 'id', 'doc': '', 'optional': False}],
+    'query_params': [{'name': 'statKey', 'type': 'list', 'doc': '', 'optional': True},
+                     {'name': 'begin', 'type': 'long', 'doc': '', 'optional': True},
+                     {'name': 'resourceId', 'type': 'map', 'doc': '', 'optional': True},
+                     {'name': 'rollUpType', 'type': 'string', 'doc': '', 'optional': False}],
+}
+QUERY_STATS = {
+    'name': 'get_stats_of_resources', 'http_method': 'POST', 'url': '/api/resources/stats/query', 'doc': '',
+    'template_params': [],
+    'query_params': [{'name': '_no_links', 'type': 'boolean', 'doc': '', 'optional': True}],
+}
+DESCRIBE_UPLOAD = {
+    'name': 'describe_upload', 'http_method': 'POST', 'url': '/internal/adapterkinds/describeupload', 'doc': '',
+    'template_params': [], 'query_params': [],
+}
+DOWNLOAD_REPORT = {
+    'name': 'download_report', 'http_method': 'GET', 'url': '/api/reports/{id}/download', 'doc': '',
+    'template_params': [{'name': 'id', 'doc': '', 'optional': False}],
+    'query_params': [{'name': 'format', 'type': 'string', 'doc': '', 'optional': True}],
+}
+
+
+def reference_request(client, rest_method, params={}, content=None, binary=False, token=None):
+    """
+        The request _rest_request and _do_request built before methods were compiled into plans, as
+        (method, url, params, data, files, headers).
+    """
+    if rest_method.get('url') == "/internal/adapterkinds/describeupload":
+        binary = True
+
+    map_params = [p['name'] for p in rest_method['query_params'] if p['type'] == 'map']
+
+    encoded_params = {}
+    for (k, v) in list(params.items()):
+        if isinstance(v, (int, bool, str)):
+            encoded_params[k] = '%s' % v
+        elif isinstance(v, (list, tuple, set)):
+            encoded_params[k] = ['%s' % value for value in v]
+        elif k in map_params:
+            for (subkey, subvalue) in list(v.items()):
+                encoded_params[k + "[" + subkey + "]"] = subvalue
+        else:
+            encoded_params[k] = v
+
+    raw_url = '%s%s' % (client._base_url, rest_method['url'])
+    try:
+        templated_url = re.compile('\\{([a-zA-Z_]+)\\}').sub(lambda m: str(encoded_params[m.group(1)]), raw_url)
+    except KeyError as e:
+        raise NaginiException("Missing template parameter: [%s]" % e.args)
+    api_url = re.compile('https://.+?(?=/)').sub(lambda m: "", raw_url)
+
+    for template_param in rest_method['template_params']:
+        del encoded_params[template_param['name']]
+
+    if not client._gen_links:
+        encoded_params['_no_links'] = 'true'
+    if client._enable_compression:
+        encoded_params['compression'] = 'enabled'
+
+    data = None
+    files = None
+    if content and content[0]:
+        if isinstance(content[0], IOBase):
+            data = content[0].read()
+        elif isinstance(content[0], dict):
+            if not binary:
+                data = json.dumps(content[0])
+            else:
+                data = content[0].get('data')
+                files = content[0].get('files')
+        elif isinstance(content[0], str):
+            data = content[0]
+
+    headers = client.client.headers.copy()
+    if not binary:
+        headers.update({'content-type': 'application/json'})
+    if api_url is not None and api_url in client.nonJSONResponseAPIs:
+        headers.update({'Accept': '*/*'})
+    if token:
+        headers.update({'Authorization': 'vRealizeOpsToken %s' % token})
+
+    return rest_method['http_method'], templated_url, encoded_params, data, files, headers
+
+
+class FakeResponse(object):
+    status_code = 200
+    reason = 'OK'
+    headers = {'Content-Type': 'application/json'}
+    content = b'{}'
+
+    def json(self):
+        return {}
+
+
+class RequestPlanTest(unittest.TestCase):
+    """A call through a compiled request plan sends what the uncompiled _rest_request sent"""
+
+    def setUp(self):
+        self.client = Nagini('vrops.example.com', user_pass=('admin', 'secret'), useInternalApis=True)
+        # a token that never expires, so no call goes out to acquire one
+        self.client._client_acquired_token = 'token'
+        self.client._client_token_validity = None
+        self.sent = []
+        for name in ('get', 'post', 'put', 'delete'):
+            setattr(self.client.client, name, self.recorder(name))
+
+    def recorder(self, name):
+        def method(url, data=None, params=None, headers=None, files=None, **kwargs):
+            # requests merges the call's headers into the session headers
+            merged = CaseInsensitiveDict(self.client.client.headers)
+            merged.update(headers or {})
+            self.sent.append((name.upper(), url, params, data, files, merged))
+            return FakeResponse()
+        method.__name__ = name
+        return method
+
+    def assert_same_request(self, rest_method, *args, **kwargs):
+        method = Nagini._make_method(rest_method)
+        self.assertIsInstance(method.request_plan, _RequestPlan)
+        method(self.client, *args, **kwargs)
+        if args and isinstance(args[0], IOBase):
+            # the body is read from the stream, read it again for the reference
+            args[0].seek(0)
+        expected = reference_request(self.client, rest_method, kwargs, args, token='token')
+        http_method, url, params, data, files, headers = self.sent.pop()
+        self.assertEqual((http_method, url, params, data, files), expected[:5])
+        self.assertEqual(headers, CaseInsensitiveDict(expected[5]))
+
+    def test_get_with_path_parameter(self):
+        self.assert_same_request(GET_STATS, id='8d1c3b6e', statKey=['cpu|usage_average', 'mem|usage_average'],
+                                 begin=1700000000000, resourceId={'a': 'b'}, rollUpType='AVG')
+        self.assertEqual(self.sent, [])
+
+    def test_missing_path_parameter(self):
+        with self.assertRaises(NaginiException):
+            Nagini._make_method(GET_STATS)(self.client, rollUpType='AVG')
+        with self.assertRaises(NaginiException):
+            reference_request(self.client, GET_STATS, {'rollUpType': 'AVG'})
+
+    def test_post_with_body(self):
+        body = {'resourceId': ['8d1c3b6e', '9e2d4c7f'], 'statKey': ['cpu|usage_average'], 'latestMaxSamples': 3}
+        self.assert_same_request(QUERY_STATS, body)
+        self.assert_same_request(QUERY_STATS, json.dumps(body))
+        self.assert_same_request(QUERY_STATS, io.StringIO(json.dumps(body)))
+
+    def test_binary_api(self):
+        upload = {'data': {'name': 'adapter'}, 'files': {'file': ('describe.xml', b'<AdapterKind/>')}}
+        self.assert_same_request(DESCRIBE_UPLOAD, upload)
+
+    def test_non_json_response_api(self):
+        self.assert_same_request(DOWNLOAD_REPORT, id='3f6a9d20', format='pdf')
+
+    def test_settings_of_the_client(self):
+        self.client._gen_links = True
+        self.client._enable_compression = True
+        self.assert_same_request(GET_STATS, id='8d1c3b6e', rollUpType='AVG')
+        # a client that changed its non-JSON APIs does not get the prebuilt headers
+        self.client.nonJSONResponseAPIs.add('/suite-api/api/resources/{id}/stats')
+        self.assert_same_request(GET_STATS, id='8d1c3b6e', rollUpType='AVG')
+
+
+if __name__ == '__main__':
+    unittest.main()
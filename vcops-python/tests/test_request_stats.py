@@ -0,0 +1,88 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import RequestStats
+
+STATS = 'GET /suite-api/api/resources/{id}/stats'
+QUERY = 'POST /suite-api/api/resources/stats/query'
+
+
+class RequestStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = RequestStats(recent_calls=3)
+        self.stats.on_request(STATS, 'https://h/suite-api/api/resources/a/stats', 200, 0.004, 0, 1000)
+        self.stats.on_request(STATS, 'https://h/suite-api/api/resources/b/stats', 200, 0.3, 0, 3000)
+        self.stats.on_request(STATS, 'https://h/suite-api/api/resources/c/stats', 503, 0.02, 0, 50)
+        self.stats.on_retry(STATS, 0.5)
+        self.stats.on_request(QUERY, 'https://h/suite-api/api/resources/stats/query', None, 12.0, 400, 0,
+                              error=ConnectionError('reset'))
+        self.stats.on_cache_hit(STATS, 'https://h/suite-api/api/resources/a/stats')
+        self.stats.on_token_refresh(0.1, True)
+        self.stats.on_token_refresh(0.2, False)
+
+    def test_counters(self):
+        endpoints = self.stats.to_dict()['endpoints']
+        stats = endpoints[STATS]
+        self.assertEqual((stats['calls'], stats['errors'], stats['retries'], stats['cache_hits']), (3, 1, 1, 1))
+        self.assertEqual(stats['status'], {'200': 2, '503': 1})
+        self.assertEqual((stats['bytes_sent'], stats['bytes_received']), (0, 4050))
+        self.assertAlmostEqual(stats['total_seconds'], 0.324)
+        self.assertEqual(stats['max_seconds'], 0.3)
+        self.assertEqual(endpoints[QUERY]['status'], {'error': 1})
+        self.assertEqual(endpoints[QUERY]['errors'], 1)
+
+    def test_histogram(self):
+        buckets = RequestStats.LATENCY_BUCKETS
+        histograms = {endpoint: stats['histogram'] for endpoint, stats in self.stats.to_dict()['endpoints'].items()}
+        expected = [0] * len(buckets)
+        expected[buckets.index(0.005)] += 1
+        expected[buckets.index(0.025)] += 1
+        expected[buckets.index(0.5)] += 1
+        self.assertEqual(histograms[STATS], expected)
+        # slower than the last finite bucket
+        self.assertEqual(histograms[QUERY][-1], 1)
+        self.assertEqual(sum(histograms[QUERY]), 1)
+        # a latency on a bucket bound counts in that bucket
+        self.stats.on_request(STATS, 'https://h/suite-api/api/resources/d/stats', 200, 0.1, 0, 0)
+        self.assertEqual(self.stats.to_dict()['endpoints'][STATS]['histogram'][buckets.index(0.1)], 1)
+
+    def test_recent_calls_are_bounded(self):
+        recent = self.stats.to_dict()['recent_calls']
+        self.assertEqual(len(recent), 3)
+        self.assertEqual([(call['endpoint'], call['status']) for call in recent],
+                         [(STATS, 503), (QUERY, None), (STATS, None)])
+        self.assertEqual(recent[1]['error'], 'reset')
+        self.assertTrue(recent[2]['cached'])
+        for i in range(100):
+            self.stats.on_request(STATS, 'https://h/suite-api/api/resources/%d/stats' % i, 200, 0.01, 0, 10)
+        recent = self.stats.to_dict()['recent_calls']
+        self.assertEqual([call['url'] for call in recent],
+                         ['https://h/suite-api/api/resources/%d/stats' % i for i in (97, 98, 99)])
+        self.assertEqual(RequestStats().to_dict()['recent_calls'], [])
+
+    def test_summary(self):
+        lines = self.stats.summary().split('\n')
+        self.assertEqual(lines, [
+            '%s: 3 calls, 1 errors, 1 retries, 1 cache hits, 0.108s mean, 0.300s max, 0 bytes sent, 4050 received'
+            % STATS,
+            '%s: 1 calls, 1 errors, 0 retries, 0 cache hits, 12.000s mean, 12.000s max, 400 bytes sent, 0 received'
+            % QUERY,
+            'token refreshes: 2 (1 failed)',
+        ])
+
+    def test_to_dict_is_a_json_snapshot(self):
+        snapshot = self.stats.to_dict()
+        json.dumps(snapshot)
+        self.stats.on_request(STATS, 'https://h/suite-api/api/resources/e/stats', 404, 0.01, 0, 0)
+        self.assertEqual(snapshot['endpoints'][STATS]['calls'], 3)
+        self.assertEqual(snapshot['endpoints'][STATS]['status'], {'200': 2, '503': 1})
+        self.assertEqual((snapshot['token_refreshes'], snapshot['token_refresh_failures']), (2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
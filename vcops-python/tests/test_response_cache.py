@@ -0,0 +1,69 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import RequestStats
+from nagini.response_cache import DEFAULT_TTLS, ResponseCache
+
+
+class ResponseCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache = ResponseCache(os.path.join(self.workdir, 'cache.db'), ttl={'get_resource': 60}, max_bytes=100)
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.workdir)
+
+    def call(self, url):
+        return self.cache.begin_call('user', 'get_resource', 'GET', url, {}, None)
+
+    def test_hit_after_store(self):
+        call = self.call('/resources/a')
+        self.assertFalse(call.fresh())
+        call.store('application/json', b'{"a": 1}')
+        call = self.call('/resources/a')
+        self.assertTrue(call.fresh())
+        self.assertEqual(call.hit(), {'a': 1})
+        self.assertEqual(self.cache.counts['hits'], 1)
+
+    def test_uncached_methods(self):
+        self.assertIsNone(self.cache.begin_call('user', 'get_stats', 'GET', '/stats', {}, None))
+        self.assertIsNone(self.cache.begin_call('user', 'get_resource', 'POST', '/resources/a', {}, None))
+        self.assertNotIn('get_resources', DEFAULT_TTLS)
+
+    def test_eviction_keeps_the_stored_response(self):
+        self.call('/resources/a').store('application/json', b'"' + b'a' * 58 + b'"')
+        self.call('/resources/b').store('application/json', b'"' + b'b' * 58 + b'"')
+        self.assertIsNone(self.call('/resources/a').entry)
+        self.assertIsNotNone(self.call('/resources/b').entry)
+        self.assertEqual(self.cache.counts['stored'], 2)
+        self.assertEqual(self.cache.counts['evicted'], 1)
+
+    def test_body_larger_than_max_bytes_is_not_stored(self):
+        self.call('/resources/a').store('application/json', b'"a"')
+        self.call('/resources/a').store('application/json', b'"' + b'a' * 200 + b'"')
+        self.assertIsNone(self.call('/resources/a').entry)
+        self.assertEqual(self.cache.counts['stored'], 1)
+        self.assertEqual(self.cache.counts['evicted'], 0)
+        self.assertEqual(self.cache.counts['too_large'], 1)
+
+
+class RequestStatsCacheHitTest(unittest.TestCase):
+
+    def test_cache_hits_are_counted_apart_from_calls(self):
+        stats = RequestStats(recent_calls=2)
+        stats.on_cache_hit('GET /api/resources/{id}', '/api/resources/a')
+        endpoint = stats.to_dict()['endpoints']['GET /api/resources/{id}']
+        self.assertEqual(endpoint['cache_hits'], 1)
+        self.assertEqual(endpoint['calls'], 0)
+        self.assertIn('1 cache hits', stats.summary())
+
+
+if __name__ == '__main__':
+    unittest.main()
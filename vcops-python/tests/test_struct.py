@@ -0,0 +1,49 @@
+import copy
+import json
+import os
+import pickle
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import Struct
+
+
+class StructTest(unittest.TestCase):
+    def setUp(self):
+        self.entries = {'name': 'vm-01', 'resourceList': [{'identifier': 'id-1'}, 3], 'resourceKey': {'tags': [1, 2]},
+                        'stat-list': []}
+        self.struct = Struct.view(self.entries)
+
+    def test_nested_values(self):
+        self.assertEqual(self.struct.name, 'vm-01')
+        self.assertEqual(self.struct.resourceList[0].identifier, 'id-1')
+        self.assertEqual(self.struct['stat-list'], [])
+        self.assertIs(self.struct.to_dict(), self.entries)
+
+    def test_lists_are_lists(self):
+        tags = self.struct.resourceKey.tags
+        self.assertIsInstance(tags, list)
+        self.assertEqual(tags + [3], [1, 2, 3])
+        self.assertEqual(json.dumps(tags), '[1, 2]')
+
+    def test_read_only(self):
+        with self.assertRaises(AttributeError):
+            self.struct.name = 'vm-02'
+        with self.assertRaises(AttributeError):
+            self.struct.missing
+
+    def test_copy_and_pickle(self):
+        for copied in (copy.copy(self.struct), copy.deepcopy(self.struct), pickle.loads(pickle.dumps(self.struct))):
+            self.assertEqual(copied.to_dict(), self.entries)
+            self.assertEqual(copied.resourceList[0].identifier, 'id-1')
+        self.assertIs(copy.copy(self.struct).to_dict(), self.entries)
+        self.assertIsNot(copy.deepcopy(self.struct).to_dict(), self.entries)
+
+    def test_hashable(self):
+        self.assertIn(self.struct, {self.struct})
+
+
+if __name__ == '__main__':
+    unittest.main()
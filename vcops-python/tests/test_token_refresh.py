@@ -0,0 +1,146 @@
+import asyncio
+import os
+import sys
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from nagini.nagini import AuthException, Nagini, NaginiException, RequestStats, ServerSideException, \
+    TOKEN_REFRESH_RETRY_INTERVAL
+
+try:
+    from nagini.async_nagini import AsyncNagini
+except ImportError:
+    AsyncNagini = None
+
+
+class FakeResponse(object):
+    reason = 'reason'
+    headers = {'Content-Type': 'application/json'}
+    content = b'{}'
+
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.request = mock.Mock(body=None)
+
+    def json(self):
+        return {}
+
+
+def validity_in(seconds):
+    return int((time.time() + seconds) * 1000)
+
+
+class TokenRefreshTest(unittest.TestCase):
+    """Nagini renews its token shortly before it expires and re-authenticates only when a call gets a 401"""
+
+    def setUp(self):
+        self.stats = RequestStats()
+        self.client = Nagini('vrops.example.com', user_pass=('admin', 'secret'), instrumentation=self.stats)
+        self.client._client_acquired_token = 'old'
+        self.client._client_token_validity = validity_in(3600)
+        self.tokens = iter(['new', 'newer'])
+        self.client.acquire_token = mock.Mock(side_effect=lambda body: {'token': next(self.tokens),
+                                                                        'validity': validity_in(3600)})
+        self.statuses = []
+        self.sent_tokens = []
+
+        def get(url, headers=None, **kwargs):
+            self.sent_tokens.append(headers['Authorization'].split()[-1])
+            return FakeResponse(self.statuses.pop(0))
+        self.client.client.get = get
+
+    def call(self, *statuses):
+        self.statuses = list(statuses)
+        return self.client.do_request('https://vrops.example.com/suite-api/api/resources', self.client.client.get)
+
+    def test_server_error_does_not_reauthenticate(self):
+        with self.assertRaises(ServerSideException):
+            self.call(500)
+        self.client.acquire_token.assert_not_called()
+        self.assertEqual(self.sent_tokens, ['old'])
+
+    def test_forbidden_does_not_reauthenticate(self):
+        with self.assertRaises(AuthException):
+            self.call(403)
+        self.client.acquire_token.assert_not_called()
+
+    def test_unauthorized_reauthenticates_once_and_retries(self):
+        self.assertEqual(self.call(401, 200), {})
+        self.assertEqual(self.client.acquire_token.call_count, 1)
+        self.assertEqual(self.sent_tokens, ['old', 'new'])
+
+        # a new token rejected as well is not renewed again
+        with self.assertRaises(AuthException):
+            self.call(401, 401, 200)
+        self.assertEqual(self.client.acquire_token.call_count, 2)
+        self.assertEqual(self.sent_tokens, ['old', 'new', 'new', 'newer'])
+
+    def test_token_about_to_expire_is_renewed_before_the_call(self):
+        self.client._client_token_validity = validity_in(30)
+        self.call(200)
+        self.assertEqual(self.client.acquire_token.call_count, 1)
+        self.assertEqual(self.sent_tokens, ['new'])
+        self.call(200)
+        self.assertEqual(self.client.acquire_token.call_count, 1)
+        self.assertEqual(self.stats.token_refreshes, 1)
+
+    def test_failed_renewal_keeps_the_valid_token_and_backs_off(self):
+        self.client._client_token_validity = validity_in(30)
+        self.client.acquire_token.side_effect = ServerSideException(503, 'unavailable', None)
+        with self.assertLogs(level='WARNING') as logs:
+            self.call(200)
+            self.call(200)
+        self.assertEqual(len(logs.output), 1)
+        self.assertEqual(self.sent_tokens, ['old', 'old'])
+        # renewing is not tried again on every call
+        self.assertEqual(self.client.acquire_token.call_count, 1)
+        self.assertEqual((self.stats.token_refreshes, self.stats.token_refresh_failures), (1, 1))
+
+        self.client._token_refresh_failed_at -= TOKEN_REFRESH_RETRY_INTERVAL
+        self.client.acquire_token.side_effect = lambda body: {'token': 'new', 'validity': validity_in(3600)}
+        self.call(200)
+        self.assertEqual(self.client.acquire_token.call_count, 2)
+        self.assertEqual(self.sent_tokens, ['old', 'old', 'new'])
+        self.assertIsNone(self.client._token_refresh_failed_at)
+
+    def test_failed_renewal_of_an_expired_token_raises(self):
+        self.client._client_token_validity = validity_in(-1)
+        self.client._token_refresh_failed_at = time.monotonic()
+        self.client.acquire_token.side_effect = ServerSideException(503, 'unavailable', None)
+        with self.assertRaises(NaginiException):
+            self.call(200)
+        self.assertEqual(self.client.acquire_token.call_count, 1)
+        self.assertEqual(self.sent_tokens, [])
+
+
+@unittest.skipIf(AsyncNagini is None, "aiohttp is not installed")
+class AsyncTokenRefreshTest(unittest.TestCase):
+
+    def test_failed_renewal_backs_off(self):
+        client = AsyncNagini('vrops.example.com', user_pass=('admin', 'secret'))
+        client._client_acquired_token = 'old'
+        client._client_token_validity = validity_in(30)
+        renewals = []
+
+        async def acquire_token(body):
+            renewals.append(body)
+            raise ServerSideException(503, 'unavailable', None)
+        client.acquire_token = acquire_token
+
+        async def calls():
+            for _ in range(3):
+                await client._acquire_token_if_necessary()
+            client._token_refresh_failed_at -= TOKEN_REFRESH_RETRY_INTERVAL
+            await client._acquire_token_if_necessary()
+
+        with self.assertLogs(level='WARNING'):
+            asyncio.run(calls())
+        self.assertEqual(len(renewals), 2)
+        self.assertEqual(client._client_acquired_token, 'old')
+
+
+if __name__ == '__main__':
+    unittest.main()